@@ -0,0 +1,59 @@
+"""
+The same arithmetic on every element, as a for loop and as array set.
+
+The loop runs one set per element and pushes the result onto a list;
+the array version runs a single set on the whole array and a single sum.
+Both print the same total. The arrays use NumPy if it is installed
+(the speed-up is much larger then) and the standard library's array
+module otherwise.
+
+Run from the repository root with: python -m benchmarks.bench_arrays
+"""
+import io
+import sys
+import time
+
+from cerona import Program
+from cerona import arrays
+
+N = 1_000_000
+ENGINES = ("tree", "closure", "python", "vm")
+
+LOOP = """
+list ys
+set total 0.0
+for i in 0 n
+    set y i * 2 + 1
+    push ys y
+    set total total + y
+endfor
+print total
+"""
+
+ARRAY = """
+array xs range 0 n
+set ys xs * 2 + 1
+sum ys total
+print total
+"""
+
+
+def timed(program, n):
+    out = io.StringIO()
+    start = time.perf_counter()
+    program.run({"n": n}, stdout=out)
+    return time.perf_counter() - start, out.getvalue()
+
+
+def main(n=N):
+    backend = "NumPy" if arrays.numpy is not None else "array module"
+    print(f"{n:,} elements, arrays backed by the {backend}")
+    for engine in ENGINES:
+        loop, expected = timed(Program(LOOP, engine=engine), n)
+        array, output = timed(Program(ARRAY, engine=engine), n)
+        assert output == expected, (output, expected)
+        print(f"{engine:8} for {loop:7.3f}s  array {array:7.3f}s ({loop / array:.1f}x)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else N)
@@ -0,0 +1,67 @@
+"""
+Cost of a function call with many globals defined.
+
+Calls a small function a million times with 1000 globals in scope, once
+with call frames that copy the caller's variables (how calls used to
+work) and once with the chained frames cerona.main.call_scope builds.
+
+Run from the repository root with: python -m benchmarks.bench_calls
+"""
+import importlib
+import io
+import sys
+import time
+from contextlib import redirect_stdout
+
+cerona_main = importlib.import_module("cerona.main")
+
+GLOBALS = 1000
+CALLS = 1_000_000
+ENGINES = ("tree", "closure", "python", "vm")
+
+
+def program(globals_count, calls):
+    lines = [f"set g{n} {n}" for n in range(globals_count)]
+    lines += [
+        "set total 0",
+        "func bump n",
+        "    set local n * 2",
+        "endfunc",
+        f"for i in 0 {calls}",
+        "    call bump i",
+        "endfor",
+        "print(g1)",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def copying_scope(scope):
+    return scope.copy()
+
+
+def run(code, engine):
+    output = io.StringIO()
+    start = time.perf_counter()
+    with redirect_stdout(output):
+        cerona_main.ifs(code, "<bench>", engine=engine)
+    return time.perf_counter() - start, output.getvalue()
+
+
+def main(calls=CALLS):
+    code = program(GLOBALS, calls)
+    chained_scope = cerona_main.call_scope
+    vm = importlib.import_module("cerona.vm")
+    print(f"{calls} calls, {GLOBALS} globals")
+    for engine in ENGINES:
+        try:
+            cerona_main.call_scope = vm.call_scope = copying_scope
+            copied, copied_output = run(code, engine)
+        finally:
+            cerona_main.call_scope = vm.call_scope = chained_scope
+        chained, chained_output = run(code, engine)
+        assert copied_output == chained_output, f"{engine}: frames changed the output"
+        print(f"{engine:8} copied {copied:6.2f}s  chained {chained:6.2f}s  ({copied / chained:.1f}x)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else CALLS)
@@ -0,0 +1,60 @@
+"""
+Building a list one item at a time, with push and with set.
+
+push appends to the list in place, so each item costs the same however
+long the list already is and the time per item stays flat as the list
+grows. set xs xs + [i] builds a new list every time, copying everything
+so far, and the time per item grows with the length of the list.
+
+Run from the repository root with: python -m benchmarks.bench_collections
+"""
+import io
+import sys
+import time
+
+from cerona import Program
+
+ITEMS = 1_000_000
+ENGINES = ("tree", "closure", "python", "vm")
+
+PUSH = """
+list xs
+for i in 0 n
+    push xs i
+endfor
+len xs count
+print count
+"""
+
+SET = """
+set xs []
+for i in 0 n
+    set xs xs + [i]
+endfor
+"""
+
+
+def per_item(program, n):
+    start = time.perf_counter()
+    program.run({"n": n}, stdout=io.StringIO())
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def main(items=ITEMS):
+    sizes = (items // 4, items // 2, items)
+    copies = (items // 200, items // 100, items // 50)
+    print("microseconds per item for lists of the given length")
+    print(f"{'':8} {'push':>32}    {'set xs xs + [i]':>32}")
+    print(f"{'':8} " + " ".join(f"{n:>10,}" for n in sizes) + "    "
+          + " ".join(f"{n:>10,}" for n in copies))
+    for engine in ENGINES:
+        push = Program(PUSH, engine=engine)
+        copy = Program(SET, engine=engine)
+        pushed = [per_item(push, n) for n in sizes]
+        copied = [per_item(copy, n) for n in copies]
+        print(f"{engine:8} " + " ".join(f"{t:10.3f}" for t in pushed) + "    "
+              + " ".join(f"{t:10.3f}" for t in copied))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else ITEMS)
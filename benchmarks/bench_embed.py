@@ -0,0 +1,63 @@
+"""
+Runs per second of one small script, through execute() and through a
+Program parsed once.
+
+execute() tokenizes the source and builds a fresh interpreter on every
+call. Program.run() reuses the parse and whatever the engine compiled
+(expressions, conditions, vm bytecode, the python engine's module).
+
+Run from the repository root with: python -m benchmarks.bench_embed
+"""
+import importlib
+import io
+import sys
+import time
+from contextlib import redirect_stdout
+
+from cerona import Program
+
+cerona_main = importlib.import_module("cerona.main")
+
+RUNS = 2000
+ENGINES = ("tree", "closure", "python", "vm")
+
+SCRIPT = """
+func price amount rate
+    set taxed amount * (1 + rate)
+    return taxed
+endfunc
+set total 0
+for i in 0 20
+    set r i % 3
+    if r equals 0 and i greater 0
+        set p call price i 0.2
+        set total total + p
+    endif
+endfor
+print total
+"""
+
+
+def timed(run, runs):
+    start = time.perf_counter()
+    for _ in range(runs):
+        run()
+    return time.perf_counter() - start
+
+
+def main(runs=RUNS):
+    print(f"{runs} runs of the same script")
+    for engine in ENGINES:
+        output = io.StringIO()
+        with redirect_stdout(output):
+            per_call = timed(lambda: cerona_main.execute(SCRIPT, engine=engine), runs)
+        program = Program(SCRIPT, engine=engine)
+        program_output = io.StringIO()
+        reused = timed(lambda: program.run(stdout=program_output), runs)
+        assert output.getvalue() == program_output.getvalue()
+        print(f"{engine:8} execute() {runs / per_call:8,.0f} runs/s  "
+              f"Program.run() {runs / reused:8,.0f} runs/s  ({per_call / reused:.1f}x)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else RUNS)
@@ -0,0 +1,79 @@
+"""
+Compare the execution engines on loop-heavy scripts.
+
+Run from the repository root with: python -m benchmarks.bench_engines
+"""
+import io
+import time
+from contextlib import redirect_stdout
+
+from cerona.main import ifs, ENGINES
+
+COUNTER_LOOP = """
+set i 0
+set total 0
+while i less 200000
+    set total total + i
+    set i i + 1
+endwhile
+print(total)
+"""
+
+NESTED_FOR = """
+set hits 0
+for i in 0 300
+    for j in 0 300
+        if j less i
+            set hits hits + 1
+        else
+            set hits hits - 1
+        endif
+    endfor
+endfor
+print(hits)
+"""
+
+FUNCTION_CALLS = """
+set total 0
+func bump n
+    set local n * 2
+endfunc
+for i in 0 50000
+    call bump i
+    set total total + 1
+endfor
+print(total)
+"""
+
+WORKLOADS = {
+    "counter loop": COUNTER_LOOP,
+    "nested for": NESTED_FOR,
+    "function calls": FUNCTION_CALLS,
+}
+
+
+def run(code, engine):
+    output = io.StringIO()
+    start = time.perf_counter()
+    with redirect_stdout(output):
+        ifs(code, "<bench>", engine=engine)
+    return time.perf_counter() - start, output.getvalue()
+
+
+def main():
+    for name, code in WORKLOADS.items():
+        timings = {}
+        outputs = set()
+        for engine in ENGINES:
+            timings[engine], output = run(code, engine)
+            outputs.add(output)
+        assert len(outputs) == 1, f"engines disagree on {name}"
+        report = "  ".join(
+            f"{engine} {timings[engine]:.3f}s ({timings['tree'] / timings[engine]:.1f}x)"
+            for engine in ENGINES
+        )
+        print(f"{name:16} {report}")
+
+
+if __name__ == "__main__":
+    main()
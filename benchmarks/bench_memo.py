@@ -0,0 +1,57 @@
+"""
+Recursive Fibonacci with and without memo func.
+
+The plain version makes an exponential number of calls; the memo func
+one computes each fib(k) once and answers the repeats from its cache,
+so its cost grows linearly with n. memostats shows the hit/miss counts.
+
+Run from the repository root with: python -m benchmarks.bench_memo
+"""
+import importlib
+import io
+import sys
+import time
+from contextlib import redirect_stdout
+
+cerona_main = importlib.import_module("cerona.main")
+
+SIZES = (15, 20, 24)
+ENGINES = ("tree", "closure", "python", "vm")
+
+PROGRAM = """
+{kind} fib n
+    if n less 2
+        return n
+    endif
+    set a n - 1
+    set b n - 2
+    set fa call fib a
+    set fb call fib b
+    return fa + fb
+endfunc
+set n {n}
+set result call fib n
+print result
+"""
+
+
+def run(code, engine):
+    output = io.StringIO()
+    start = time.perf_counter()
+    with redirect_stdout(output):
+        cerona_main.ifs(code, "<bench>", engine=engine)
+    return time.perf_counter() - start, output.getvalue()
+
+
+def main(sizes=SIZES):
+    for engine in ENGINES:
+        for n in sizes:
+            plain, plain_output = run(PROGRAM.format(kind="func", n=n), engine)
+            memo, memo_output = run(PROGRAM.format(kind="memo func", n=n) + "memostats fib\n", engine)
+            assert memo_output.startswith(plain_output), f"{engine}: memo changed the result"
+            stats = memo_output.split("\n")[1]
+            print(f"{engine:8} fib({n:2})  func {plain:7.3f}s  memo func {memo:7.4f}s  ({stats})")
+
+
+if __name__ == "__main__":
+    main(tuple(int(n) for n in sys.argv[1:]) or SIZES)
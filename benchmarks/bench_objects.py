@@ -0,0 +1,103 @@
+"""
+Memory per instance and `new` throughput of Cerona objects.
+
+Compares CeronaObject (a slotted object holding a list laid out by its
+class) with the dict-per-instance representation it replaced.
+
+Run from the repository root with: python -m benchmarks.bench_objects
+"""
+import importlib
+import io
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+
+cerona_main = importlib.import_module("cerona.main")
+vm = importlib.import_module("cerona.vm")
+CeronaClass = cerona_main.CeronaClass
+CeronaObject = cerona_main.CeronaObject
+
+INSTANCES = 100_000
+NEWS = 200_000
+
+
+class DictObject:
+    """The old representation: every instance copies the class attributes into its own dict"""
+    def __init__(self, class_def, instance_vars=None):
+        self.class_def = class_def
+        self.attributes = (class_def.attributes if instance_vars is None else instance_vars).copy()
+
+    @property
+    def instance_vars(self):
+        return self.attributes.copy()
+
+    def has_attr(self, attr_name):
+        return attr_name in self.attributes
+
+    def get_attr(self, attr_name):
+        return self.attributes.get(attr_name)
+
+    def set_attr(self, attr_name, value):
+        self.attributes[attr_name] = value
+
+    def items(self):
+        return self.attributes.items()
+
+    def update_from(self, scope):
+        for key in self.attributes.keys():
+            if key in scope:
+                self.attributes[key] = scope[key]
+
+
+PARTICLE = CeronaClass("Particle", {"x": 0, "y": 0, "vx": 1, "vy": 1, "mass": 1.0}, {}, 1)
+
+NEW_LOOP = f"""
+class Particle
+    set x 0
+    set y 0
+    set vx 1
+    set vy 1
+    set mass 1.0
+    func init px
+        set x px
+    endfunc
+endclass
+for i in 0 {NEWS}
+    new Particle p i
+endfor
+call p.init 7
+print(x)
+"""
+
+
+def instance_size(object_type):
+    tracemalloc.start()
+    instances = [object_type(PARTICLE) for _ in range(INSTANCES)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del instances
+    return size / INSTANCES
+
+
+def new_throughput(object_type, engine):
+    cerona_main.CeronaObject = vm.CeronaObject = object_type
+    try:
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            cerona_main.ifs(NEW_LOOP, "<bench>", engine=engine)
+        return NEWS / (time.perf_counter() - start)
+    finally:
+        cerona_main.CeronaObject = vm.CeronaObject = CeronaObject
+
+
+def main():
+    print(f"bytes per instance (5 attributes): "
+          f"dict {instance_size(DictObject):.0f}  slots {instance_size(CeronaObject):.0f}")
+    for engine in ("tree", "vm"):
+        before = new_throughput(DictObject, engine)
+        after = new_throughput(CeronaObject, engine)
+        print(f"{engine:5} new/s: dict {before:,.0f}  slots {after:,.0f}  ({after / before:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+A million print statements into a pipe, buffered and --unbuffered.
+
+Each run is a separate cerona process whose stdout is a pipe read by
+this one, as in a log pipeline. With the default buffered output the
+printed lines go out in 64 KB writes; --unbuffered makes one print()
+call per line.
+
+Run from the repository root with: python -m benchmarks.bench_output
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+LINES = 1_000_000
+ENGINES = ("tree", "closure", "python", "vm")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROGRAM = """
+for i in 0 {lines}
+    print(i)
+endfor
+"""
+
+
+def run(path, engine, unbuffered):
+    # What the cerona console script runs
+    command = [sys.executable, "-c", "from cerona.main import main; main()", path, "--engine", engine]
+    if unbuffered:
+        command.append("--unbuffered")
+    start = time.perf_counter()
+    # The cerona module from this checkout, and no parsed-program cache file
+    env = dict(os.environ, PYTHONPATH=ROOT, CERONA_NO_CACHE="1")
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, env=env)
+    lines = 0
+    for chunk in iter(lambda: process.stdout.read(1 << 16), b""):
+        lines += chunk.count(b"\n")
+    process.wait()
+    return time.perf_counter() - start, lines
+
+
+def main(lines=LINES):
+    with tempfile.NamedTemporaryFile("w", suffix=".cerona", delete=False) as source:
+        source.write(PROGRAM.format(lines=lines))
+    try:
+        print(f"{lines:,} print statements into a pipe")
+        for engine in ENGINES:
+            buffered, buffered_lines = run(source.name, engine, False)
+            unbuffered, unbuffered_lines = run(source.name, engine, True)
+            assert buffered_lines == unbuffered_lines == lines, (buffered_lines, unbuffered_lines)
+            print(f"{engine:8} buffered {buffered:6.2f}s  unbuffered {unbuffered:6.2f}s  "
+                  f"({unbuffered / buffered:.2f}x)")
+    finally:
+        os.unlink(source.name)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else LINES)
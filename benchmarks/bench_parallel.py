@@ -0,0 +1,75 @@
+"""
+A loop of pure computation, as a for loop and as a parallel for.
+
+The body calls a function and does some arithmetic for every index;
+the serial loop adds the results up itself, the parallel one through a
+sum reduction. The first parallel run also starts the worker processes,
+so it is timed separately from the ones after it. The speed-up grows
+with the number of CPUs (cerona.parallel.PARALLEL_WORKERS).
+
+Run from the repository root with: python -m benchmarks.bench_parallel
+"""
+import io
+import sys
+import time
+
+from cerona import Program
+from cerona import parallel
+
+N = 200_000
+ENGINES = ("tree", "closure", "python", "vm")
+
+BODY = """
+    set a i % 97
+    set b call weight a
+    set c b * b + i
+"""
+
+SERIAL = """
+func weight x
+    set y x * 3 + 1
+    return y % 11
+endfunc
+set total 0
+for i in 0 {n}
+{body}
+    set total total + c
+endfor
+print total
+"""
+
+PARALLEL = """
+func weight x
+    set y x * 3 + 1
+    return y % 11
+endfunc
+set total 0
+parallel for i in 0 {n} with sum total
+{body}
+    set total c
+endfor
+print total
+"""
+
+
+def timed(program):
+    out = io.StringIO()
+    start = time.perf_counter()
+    program.run(stdout=out)
+    return time.perf_counter() - start, out.getvalue()
+
+
+def main(n=N):
+    print(f"{n:,} iterations, {parallel.PARALLEL_WORKERS} worker processes")
+    for engine in ENGINES:
+        serial, expected = timed(Program(SERIAL.format(n=n, body=BODY), engine=engine))
+        program = Program(PARALLEL.format(n=n, body=BODY), engine=engine)
+        first, output = timed(program)
+        again, _ = timed(program)
+        assert output == expected, (output, expected)
+        print(f"{engine:8} for {serial:7.3f}s  parallel for {first:7.3f}s first, "
+              f"{again:7.3f}s after ({serial / again:.1f}x)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else N)
@@ -0,0 +1,66 @@
+"""
+Deep recursion on the explicit frame stack.
+
+A recursive countdown from 100,000 needs that many Cerona calls active at
+once. The tree walker and the vm keep their frames on a stack of their
+own, so it runs; the closure and python engines turn Cerona calls into
+Python calls and stop at Python's recursion limit instead, which is
+reported as such.
+
+Run from the repository root with: python -m benchmarks.bench_recursion
+"""
+import importlib
+import io
+import sys
+import time
+from contextlib import redirect_stderr, redirect_stdout
+
+cerona_main = importlib.import_module("cerona.main")
+
+DEPTH = 100_000
+ENGINES = ("tree", "closure", "python", "vm")
+
+PROGRAM = """
+func countdown n
+    if n greater 0
+        set m n - 1
+        call countdown m
+    endif
+endfunc
+set start {depth}
+call countdown start
+print "done"
+"""
+
+
+def run(code, engine, limit):
+    output = io.StringIO()
+    errors = io.StringIO()
+    start = time.perf_counter()
+    try:
+        with redirect_stdout(output), redirect_stderr(errors):
+            cerona_main.ifs(code, "<bench>", engine=engine, recursion_limit=limit)
+    except SystemExit:
+        pass
+    return time.perf_counter() - start, output.getvalue(), errors.getvalue()
+
+
+def main(depth=DEPTH):
+    code = PROGRAM.format(depth=depth)
+    print(f"recursive countdown from {depth}")
+    for engine in ENGINES:
+        elapsed, output, errors = run(code, engine, depth + 1)
+        if output == "done\n":
+            rate = (depth + 1) / elapsed
+            print(f"{engine:8} {elapsed:6.2f}s  ({rate:,.0f} calls/s)")
+        else:
+            message = errors.split("\n")[0].split(": ", 1)[-1]
+            print(f"{engine:8} failed: {message}")
+
+    # Going one call past the limit is an ordinary Cerona error
+    elapsed, output, errors = run(code, "tree", depth)
+    assert "recursion limit exceeded" in errors, errors
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEPTH)
@@ -0,0 +1,44 @@
+"""
+Peak memory of running straight-line scripts of growing size, with and
+without streaming.
+
+Run from the repository root with: python -m benchmarks.bench_stream
+"""
+import io
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+
+from cerona.main import ifs
+
+
+def generate(count):
+    for n in range(count):
+        yield f"set x{n % 10} {n} + 1\n"
+    yield "print(x9)\n"
+
+
+def measure(source, stream):
+    output = io.StringIO()
+    tracemalloc.start()
+    start = time.perf_counter()
+    with redirect_stdout(output):
+        ifs(source, "<bench>", stream=stream)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, output.getvalue()
+
+
+def main():
+    for count in (10_000, 50_000, 150_000):
+        whole = measure("".join(generate(count)), stream=False)
+        streamed = measure(generate(count), stream=True)
+        assert whole[2] == streamed[2], "streaming changed the output"
+        print(f"{count:>8} lines  "
+              f"whole file {whole[1] / 1e6:7.1f} MB {whole[0]:.2f}s  "
+              f"streamed {streamed[1] / 1e6:7.1f} MB {streamed[0]:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Building a 100 MB report, with append and with set.
+
+Every row of the report is a label, its number and a line of text.
+append adds each piece to a string builder, which joins them only when
+the report is read, so the time per row stays flat however long the
+report already is. set report report + row copies the whole report for
+every row; its time per row grows with the report, so it is only timed
+up to a few megabytes.
+
+Run from the repository root with: python -m benchmarks.bench_text
+"""
+import io
+import sys
+import time
+
+from cerona import Program
+
+MEGABYTES = 100
+ENGINES = ("tree", "closure", "python", "vm")
+
+# What each row adds besides its label and number
+ROW = ": " + "." * 88 + "\n"
+
+APPEND = """
+for i in 0 n
+    append report "item "
+    append report i
+    append report row
+endfor
+len report size
+print size
+"""
+
+SET = """
+set report ""
+for i in 0 n
+    set report report + row
+endfor
+len report size
+print size
+"""
+
+
+def timed(program, rows):
+    out = io.StringIO()
+    start = time.perf_counter()
+    program.run({"n": rows, "row": ROW}, stdout=out)
+    return time.perf_counter() - start, int(out.getvalue())
+
+
+def main(megabytes=MEGABYTES):
+    rows = megabytes * 1_000_000 // (len(ROW) + 10)
+    copies = [size * 1_000_000 // len(ROW) for size in (1, 2, 4)]
+    print("microseconds per row for reports of 1, 2 and 4 MB")
+    print(f"{'':8} {'append':>26}    {'set report report + row':>26}")
+    for engine in ENGINES:
+        append = Program(APPEND, engine=engine)
+        copy = Program(SET, engine=engine)
+        appended = [timed(append, n)[0] / n * 1e6 for n in copies]
+        copied = [timed(copy, n)[0] / n * 1e6 for n in copies]
+        print(f"{engine:8} " + " ".join(f"{t:8.3f}" for t in appended) + "    "
+              + " ".join(f"{t:8.3f}" for t in copied))
+    print()
+    print(f"a report of {rows:,} rows with append")
+    for engine in ENGINES:
+        seconds, size = timed(Program(APPEND, engine=engine), rows)
+        print(f"{engine:8} {size / 1e6:7.1f} MB in {seconds:6.2f}s ({size / 1e6 / seconds:6.1f} MB/s)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else MEGABYTES)
@@ -0,0 +1,145 @@
+"""
+Tokenizer throughput on a large generated script.
+
+Times parse_line against the character-at-a-time tokenizer it replaced
+and checks that both produce the same tokens.
+
+Run from the repository root with: python -m benchmarks.bench_tokenizer
+"""
+import time
+
+from cerona.main import CeronaError, parse_line
+
+# Lines of the kind our generated scripts are made of
+TEMPLATES = [
+    'set total_{n} total_{m} + {n} * 3',
+    'print("row {n}:" total_{n})  # progress',
+    'if total_{n} greater {m} then print("big {n}")',
+    "set label_{n} 'item (#{n})'",
+    'call report "line {n}" total_{m}',
+    'set path_{n} "C:\\\\data\\\\{n}.csv"',
+    '    while i less {n}',
+    '# comment only, line {n}',
+]
+
+
+def generate(megabytes):
+    lines = []
+    size = 0
+    n = 0
+    while size < megabytes * 1024 * 1024:
+        line = TEMPLATES[n % len(TEMPLATES)].format(n=n, m=n // 2)
+        lines.append(line)
+        size += len(line) + 1
+        n += 1
+    return lines
+
+
+def legacy_parse_line(line, line_num, original_lines=()):
+    """The character-at-a-time tokenizer parse_line replaced, for comparison"""
+    try:
+        comment_index = -1
+        in_quotes = False
+        quote_char = None
+
+        for idx, char in enumerate(line):
+            if char in ['"', "'"]:
+                if not in_quotes:
+                    in_quotes = True
+                    quote_char = char
+                elif char == quote_char:
+                    in_quotes = False
+                    quote_char = None
+            elif char == '#' and not in_quotes:
+                comment_index = idx
+                break
+
+        if comment_index != -1:
+            line = line[:comment_index]
+
+        line = line.strip()
+        if not line:
+            return []
+
+        # Strip leading/trailing parentheses before tokenizing
+        while line.startswith('(') and line.endswith(')'):
+            line = line[1:-1].strip()
+
+        tokens = []
+        current_token = ""
+        in_quotes = False
+        quote_char = None
+        escape_next = False
+
+        for char in line:
+            if escape_next:
+                current_token += char
+                escape_next = False
+            elif char == '\\':
+                escape_next = True
+            elif char in ['"', "'"]:
+                if not in_quotes:
+                    in_quotes = True
+                    quote_char = char
+                    if current_token.strip():
+                        tokens.extend(current_token.strip().split())
+                    current_token = ""
+                elif char == quote_char:
+                    in_quotes = False
+                    quote_char = None
+                    tokens.append(current_token)
+                    current_token = ""
+                else:
+                    current_token += char
+            elif char in ['(', ')'] and not in_quotes:
+                # Skip parentheses when not in quotes
+                if current_token:
+                    tokens.append(current_token)
+                    current_token = ""
+            elif char in [' ', '\t'] and not in_quotes:
+                if current_token:
+                    tokens.append(current_token)
+                    current_token = ""
+            else:
+                current_token += char
+
+        if current_token:
+            tokens.append(current_token)
+
+        if in_quotes:
+            raise CeronaError(
+                f"unterminated string literal",
+                line_num,
+                original_lines[line_num - 1] if line_num <= len(original_lines) else line
+            )
+
+        return tokens
+    except CeronaError:
+        raise
+    except Exception as e:
+        raise CeronaError(
+            f"parse error: {str(e)}",
+            line_num,
+            original_lines[line_num - 1] if line_num <= len(original_lines) else line
+        )
+
+
+def tokenize(tokenizer, lines):
+    start = time.perf_counter()
+    tokens = [tokenizer(line, line_num, lines) for line_num, line in enumerate(lines, start=1)]
+    return time.perf_counter() - start, tokens
+
+
+def main(megabytes=8):
+    lines = generate(megabytes)
+    print(f"{len(lines)} lines, {megabytes} MB")
+    legacy_time, legacy_tokens = tokenize(legacy_parse_line, lines)
+    new_time, new_tokens = tokenize(parse_line, lines)
+    assert new_tokens == legacy_tokens, "tokenizers disagree"
+    for name, elapsed in (("character loop", legacy_time), ("parse_line", new_time)):
+        print(f"{name:16} {elapsed:.3f}s  {len(lines) / elapsed:,.0f} lines/s")
+    print(f"speedup {legacy_time / new_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Compare the bytecode VM against the tree walker on loops, recursion and OOP.
+
+Run from the repository root with: python -m benchmarks.bench_vm
+"""
+import io
+import time
+from contextlib import redirect_stdout
+
+from cerona.main import ifs, parse_program, build_block_table
+from cerona.vm import Code, VirtualMachine, compile_program
+
+LOOPS = """
+set i 0
+set total 0
+while i less 200000
+    set total total + i
+    set i i + 1
+endwhile
+print(total)
+"""
+
+# The tree walker recurses in Python for every Cerona call, so keep the
+# depth well below the Python recursion limit and repeat instead
+RECURSION = """
+func down n
+    if n greater 0
+        set m n - 1
+        call down m
+    endif
+endfunc
+set depth 60
+for round in 0 300
+    call down depth
+endfor
+print("done")
+"""
+
+OOP = """
+class Counter
+    set count 0
+
+    func bump step
+        set count count + step
+    endfunc
+endclass
+
+new Counter c
+for i in 0 30000
+    call c.bump 1
+endfor
+call c.bump 0
+print(count)
+"""
+
+WORKLOADS = {"loops": LOOPS, "recursion": RECURSION, "oop": OOP}
+
+
+def timed(run):
+    output = io.StringIO()
+    start = time.perf_counter()
+    with redirect_stdout(output):
+        run()
+    return time.perf_counter() - start, output.getvalue()
+
+
+def main():
+    for name, source in WORKLOADS.items():
+        tree_time, tree_output = timed(lambda: ifs(source, "<bench>", engine="tree"))
+
+        # Serialize and reload so the VM timing covers the on-disk format
+        original_lines = source.split("\n")
+        cleaned = parse_program(original_lines)
+        line_index, blocks = build_block_table(cleaned, original_lines)
+        code = Code.loads(compile_program(cleaned, blocks, original_lines).dumps())
+        vm_time, vm_output = timed(lambda: VirtualMachine(code).run({}))
+
+        assert vm_output == tree_output, f"outputs differ on {name}"
+        print(f"{name:10} tree {tree_time:.3f}s  vm {vm_time:.3f}s  ({tree_time / vm_time:.1f}x, "
+              f"{len(code)} instructions)")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,25 @@ Cerona - A custom scripting language interpreter
 __version__ = "0.1.0"
 __author__ = "ZaiperUnbound"
 
-from .main import ifs
+# Loaded on first use rather than here, so that cerona.client (the
+# cerona-client command) starts without importing the interpreter
+_LAZY_NAMES = {
+    "ifs": "main",
+    "CeronaError": "main",
+    "Interpreter": "interpreter",
+    "Program": "interpreter",
+}
+
+def __getattr__(name):
+    if name not in _LAZY_NAMES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+    return getattr(importlib.import_module(f".{_LAZY_NAMES[name]}", __name__), name)
 
 def main():
     """Main entry point for the CLI"""
     import sys
+    from .main import ifs
     if len(sys.argv) < 2:
         print("Usage: cerona <filename>")
         sys.exit(1)
@@ -0,0 +1,204 @@
+"""
+Numeric arrays: the values the array command makes.
+
+    array xs range 0 1000000
+    array ws 0.5 1.5 2.5
+    array data file "readings.txt"
+    set ys xs * 2 + 1
+    sum ys total
+    set head ys[0:10]
+
+An Array holds floating-point numbers. Arithmetic (+ - * / % ** and
+unary minus) between two arrays of the same length, or an array and a
+number, works on every element at once and makes a new array, so set
+runs one expression for the whole array instead of a loop running one
+per element. The sum, mean, min and max commands reduce an array to a
+number (through the methods of the same names), a[i] is one element and
+a[i:j] (any Python slice) a new array.
+
+The elements live in a NumPy array when NumPy can be imported and in an
+array.array of doubles from the standard library otherwise; both give
+the same results, apart from the last bits of sums and the wording of
+errors such as division by zero.
+"""
+import math
+import operator
+import os
+import re
+from array import array
+from itertools import repeat
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# What separates the numbers in an array file
+_NUMBER_SEPARATORS = re.compile(r"[\s,]+")
+
+
+class Array:
+    """A fixed-length array of floats with element-wise arithmetic"""
+    __slots__ = ("values",)
+
+    def __init__(self, values):
+        # A float64 numpy.ndarray, or array("d") without NumPy
+        self.values = values
+
+    @classmethod
+    def of(cls, numbers):
+        """An Array holding numbers (an iterable of numbers)"""
+        if numpy is not None:
+            return cls(numpy.array(numbers if isinstance(numbers, list) else list(numbers), dtype=float))
+        return cls(array("d", numbers))
+
+    @classmethod
+    def from_range(cls, start, stop, step=1):
+        """start, start + step, ... up to but not including stop"""
+        if step == 0:
+            raise ValueError("array range step must not be zero")
+        if numpy is not None:
+            return cls(numpy.arange(start, stop, step, dtype=float))
+        if all(isinstance(n, int) for n in (start, stop, step)):
+            return cls(array("d", range(start, stop, step)))
+        count = max(0, math.ceil((stop - start) / step))
+        return cls(array("d", (start + n * step for n in range(count))))
+
+    @classmethod
+    def from_file(cls, path):
+        """The numbers in the file at path, separated by blanks, commas or newlines"""
+        with open(path, "r") as file:
+            text = file.read()
+        return cls.of([float(word) for word in _NUMBER_SEPARATORS.split(text) if word])
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def tolist(self):
+        return self.values.tolist()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            values = self.values[index]
+            return Array(values.copy() if numpy is not None else values)
+        return float(self.values[index])
+
+    def __str__(self):
+        return str(self.tolist())
+
+    __repr__ = __str__
+
+    # --- ELEMENT-WISE ARITHMETIC ---
+    def _apply(self, op, other, reflected=False):
+        if isinstance(other, Array):
+            if len(other) != len(self):
+                raise ValueError(f"arrays of different lengths ({len(self)} and {len(other)})")
+            other = other.values
+        elif not isinstance(other, (int, float)):
+            return NotImplemented
+        left, right = (other, self.values) if reflected else (self.values, other)
+        if numpy is not None:
+            with numpy.errstate(divide="raise", invalid="raise"):
+                return Array(op(left, right))
+        # One pass in C over both operands
+        if not isinstance(left, array):
+            left = repeat(left)
+        if not isinstance(right, array):
+            right = repeat(right)
+        return Array(array("d", map(op, left, right)))
+
+    def __add__(self, other):
+        return self._apply(operator.add, other)
+
+    def __radd__(self, other):
+        return self._apply(operator.add, other, True)
+
+    def __sub__(self, other):
+        return self._apply(operator.sub, other)
+
+    def __rsub__(self, other):
+        return self._apply(operator.sub, other, True)
+
+    def __mul__(self, other):
+        return self._apply(operator.mul, other)
+
+    def __rmul__(self, other):
+        return self._apply(operator.mul, other, True)
+
+    def __truediv__(self, other):
+        return self._apply(operator.truediv, other)
+
+    def __rtruediv__(self, other):
+        return self._apply(operator.truediv, other, True)
+
+    def __mod__(self, other):
+        return self._apply(operator.mod, other)
+
+    def __rmod__(self, other):
+        return self._apply(operator.mod, other, True)
+
+    def __pow__(self, other):
+        return self._apply(operator.pow, other)
+
+    def __rpow__(self, other):
+        return self._apply(operator.pow, other, True)
+
+    def __neg__(self):
+        return Array(-self.values) if numpy is not None else Array(array("d", map(operator.neg, self.values)))
+
+    def __pos__(self):
+        return self
+
+    # --- REDUCTIONS ---
+    def sum(self):
+        if numpy is not None:
+            return float(self.values.sum())
+        return math.fsum(self.values)
+
+    def mean(self):
+        if not len(self):
+            raise ValueError("mean of an empty array")
+        return self.sum() / len(self)
+
+    def min(self):
+        if not len(self):
+            raise ValueError("min of an empty array")
+        return float(self.values.min()) if numpy is not None else min(self.values)
+
+    def max(self):
+        if not len(self):
+            raise ValueError("max of an empty array")
+        return float(self.values.max()) if numpy is not None else max(self.values)
+
+
+def make_array(mode, values, directory=None):
+    """
+    The Array an array command makes: mode is "range" (start, stop[,
+    step]), "file" (path, relative to directory if given) or "values"
+    (numbers, or lists and arrays of them)
+    """
+    if mode == "range":
+        bounds = [_number(value) for value in values]
+        return Array.from_range(*bounds)
+    if mode == "file":
+        path = str(values[0])
+        return Array.from_file(os.path.join(directory, path) if directory else path)
+    numbers = []
+    for value in values:
+        if isinstance(value, (list, tuple, Array)):
+            numbers.extend(_number(item) for item in value)
+        else:
+            numbers.append(_number(value))
+    return Array.of(numbers)
+
+
+def _number(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"array elements must be numbers, got '{value}'")
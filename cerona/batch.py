@@ -0,0 +1,157 @@
+"""
+cerona batch: run many scripts on a pool of worker processes.
+
+Starting Python and importing cerona costs far more than running a
+small script, so cerona batch starts a few workers once and feeds them
+scripts. Each script runs as a Program in a worker with its own stdout,
+stderr and an empty stdin; the parent collects them together with the
+exit status (as cerona FILE would give it) and the time the run took,
+and reports the scripts in the order they were named.
+
+With --timeout a script that runs too long is interrupted in its worker
+and reported with TIMEOUT_STATUS; the worker goes on with the next one.
+"""
+import glob
+import io
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .interpreter import Program
+from .main import CeronaError, ENGINES, DEFAULT_ENGINE, RECURSION_LIMIT
+
+# Exit status of a script stopped by --timeout, as with timeout(1)
+TIMEOUT_STATUS = 124
+
+
+class JobResult:
+    """What running one script produced"""
+    __slots__ = ("path", "status", "stdout", "stderr", "elapsed")
+
+    def __init__(self, path, status, stdout, stderr, elapsed):
+        self.path = path
+        self.status = status
+        self.stdout = stdout
+        self.stderr = stderr
+        self.elapsed = elapsed
+
+
+class JobTimeout(BaseException):
+    """Raised inside a worker when its script runs out of time"""
+
+
+def _time_up(signum, frame):
+    raise JobTimeout()
+
+
+def run_script(path, engine=None, recursion_limit=None, timeout=None):
+    """Run the script at path and return its JobResult; runs in a worker"""
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    # Only the main thread can take SIGALRM; elsewhere the timeout is not enforced
+    timed = bool(timeout) and hasattr(signal, "setitimer") and \
+        threading.current_thread() is threading.main_thread()
+    start = time.perf_counter()
+    try:
+        if timed:
+            signal.signal(signal.SIGALRM, _time_up)
+            # Keep firing in case bare excepts in the interpreter swallow one
+            signal.setitimer(signal.ITIMER_REAL, timeout, 0.05)
+        try:
+            Program.from_file(path, engine, recursion_limit).run(stdout=stdout, stdin=io.StringIO())
+            status = 0
+        finally:
+            if timed:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+    except JobTimeout:
+        print(f"{path}: error: timed out after {timeout}s", file=stderr)
+        status = TIMEOUT_STATUS
+    except FileNotFoundError:
+        print(f"{path}: error: file not found", file=stderr)
+        status = 1
+    except CeronaError as e:
+        print(f"{path}:{e}", file=stderr)
+        status = 1
+    except Exception as e:
+        print(f"{path}: error: {type(e).__name__}: {e}", file=stderr)
+        status = 1
+    return JobResult(path, status, stdout.getvalue(), stderr.getvalue(), time.perf_counter() - start)
+
+
+def expand_scripts(patterns):
+    """The script paths named by patterns; glob patterns are expanded, ** included"""
+    paths = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            paths.extend(sorted(glob.glob(pattern, recursive=True)))
+        else:
+            paths.append(pattern)
+    return paths
+
+
+def run_batch(paths, workers=None, timeout=None, engine=None, recursion_limit=None):
+    """Run every script in paths on workers processes; return their JobResults in order"""
+    if not paths:
+        return []
+    workers = min(workers or os.cpu_count() or 1, len(paths))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_script, path, engine, recursion_limit, timeout) for path in paths]
+        return [future.result() for future in futures]
+
+
+def report(result, out=None, err=None):
+    """Print one script's header line and what it wrote (to sys.stdout and sys.stderr by default)"""
+    out = sys.stdout if out is None else out
+    err = sys.stderr if err is None else err
+    if result.status == 0:
+        outcome = "ok"
+    elif result.status == TIMEOUT_STATUS:
+        outcome = "timed out"
+    else:
+        outcome = f"exit {result.status}"
+    print(f"== {result.path}: {outcome} in {result.elapsed:.3f}s", file=out)
+    out.write(result.stdout)
+    out.flush()
+    err.write(result.stderr)
+    err.flush()
+
+
+def main(argv=None):
+    """cerona batch SCRIPT... ; exits 1 if any script failed"""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="cerona batch",
+                                     description="Run many Cerona scripts on a pool of worker processes")
+    parser.add_argument("scripts", nargs="+", metavar="SCRIPT",
+                        help="a .cerona file or a glob pattern such as 'jobs/**/*.cerona'")
+    parser.add_argument("-j", "--workers", type=int, default=None, metavar="N",
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--timeout", type=float, default=None, metavar="SECONDS",
+                        help="stop a script that runs longer than this")
+    parser.add_argument("--engine", choices=ENGINES, default=DEFAULT_ENGINE,
+                        help="execution engine (default: %(default)s)")
+    parser.add_argument("--recursion-limit", type=int, default=None, metavar="N",
+                        help=f"allow at most N nested calls (default: {RECURSION_LIMIT})")
+    args = parser.parse_args(argv)
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    paths = expand_scripts(args.scripts)
+    if not paths:
+        parser.error("no scripts match")
+
+    start = time.perf_counter()
+    results = run_batch(paths, args.workers, args.timeout, args.engine, args.recursion_limit)
+    elapsed = time.perf_counter() - start
+    for result in results:
+        report(result)
+
+    failed = sum(1 for result in results if result.status not in (0, TIMEOUT_STATUS))
+    timed_out = sum(1 for result in results if result.status == TIMEOUT_STATUS)
+    print(f"{len(results)} scripts: {len(results) - failed - timed_out} ok, {failed} failed, "
+          f"{timed_out} timed out in {elapsed:.3f}s")
+    if failed or timed_out:
+        sys.exit(1)
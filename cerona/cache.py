@@ -0,0 +1,121 @@
+"""
+On-disk cache of parsed Cerona programs.
+
+Tokenizing a large script with parse_line costs more than running much
+of it, so the result of parsing a file (the (line_num, tokens) list and
+the block table built from it) is written to a .ceronac file the first
+time the file runs and loaded with marshal on later runs.
+
+A cache file is only used when the source hash, the source file's mtime
+and the interpreter version all match what was recorded when it was
+written; anything else (including a corrupt or unreadable file) means
+the source is parsed again and the cache rewritten.
+
+By default foo.cerona is cached as foo.ceronac next to it. Set
+CERONA_CACHE_DIR to keep cache files in one directory instead, and
+CERONA_NO_CACHE to any non-empty value to turn the cache off.
+"""
+import hashlib
+import marshal
+import os
+
+from . import __version__
+from .main import parse_program, build_block_table
+
+CACHE_SUFFIX = ".ceronac"
+
+# Bump when the layout of the cached data or the tokenizer output changes
+CACHE_FORMAT = 2
+
+DISABLE_ENV = "CERONA_NO_CACHE"
+CACHE_DIR_ENV = "CERONA_CACHE_DIR"
+
+
+def cache_enabled(environ=None):
+    return not (os.environ if environ is None else environ).get(DISABLE_ENV)
+
+
+def interpreter_version():
+    return f"{__version__}/{CACHE_FORMAT}"
+
+
+def source_hash(source):
+    return hashlib.sha256(source.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def cache_path(filename, environ=None):
+    """Where the parsed form of filename is cached"""
+    cache_dir = (os.environ if environ is None else environ).get(CACHE_DIR_ENV)
+    if cache_dir:
+        key = hashlib.sha256(os.path.abspath(filename).encode("utf-8", "surrogatepass")).hexdigest()
+        return os.path.join(cache_dir, key[:32] + CACHE_SUFFIX)
+    root, ext = os.path.splitext(filename)
+    return root + CACHE_SUFFIX
+
+
+def _source_mtime(filename):
+    try:
+        return os.stat(filename).st_mtime_ns
+    except OSError:
+        return None
+
+
+def read_cache(path, source, mtime):
+    """The cached (cleaned, line_index, blocks) for source, or None"""
+    try:
+        # loads() on the whole file is far faster than load() on the stream
+        with open(path, "rb") as f:
+            data = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    try:
+        version, cached_mtime, digest, cleaned, line_index, blocks = data
+    except (TypeError, ValueError):
+        return None
+    if version != interpreter_version() or cached_mtime != mtime or digest != source_hash(source):
+        return None
+    return cleaned, line_index, blocks
+
+
+def write_cache(path, source, mtime, cleaned, line_index, blocks):
+    """Write a cache file; failures (read-only directories etc.) are ignored"""
+    data = (interpreter_version(), mtime, source_hash(source), cleaned, line_index, blocks)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(temp_path, "wb") as f:
+            f.write(marshal.dumps(data))
+        os.replace(temp_path, path)
+    except OSError:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+
+def load_program(source, filename="<input>", environ=None):
+    """
+    Parse source, going through the cache when it was read from filename.
+    The cache settings come from environ (os.environ by default).
+
+    Returns (original_lines, cleaned, line_index, blocks). Parse errors
+    raise CeronaError as usual and are never cached.
+    """
+    original_lines = source.split("\n")
+    mtime = _source_mtime(filename) if cache_enabled(environ) else None
+    if mtime is None:
+        cleaned = parse_program(original_lines)
+        line_index, blocks = build_block_table(cleaned, original_lines)
+        return original_lines, cleaned, line_index, blocks
+
+    path = cache_path(filename, environ)
+    cached = read_cache(path, source, mtime)
+    if cached is not None:
+        return (original_lines,) + cached
+
+    cleaned = parse_program(original_lines)
+    line_index, blocks = build_block_table(cleaned, original_lines)
+    write_cache(path, source, mtime, cleaned, line_index, blocks)
+    return original_lines, cleaned, line_index, blocks
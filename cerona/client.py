@@ -0,0 +1,191 @@
+"""
+cerona-client: run a file through a cerona serve daemon.
+
+cerona-client FILE takes the same options as cerona FILE and behaves the
+same way, but instead of importing and starting the interpreter it hands
+the file to the daemon listening on the socket (see cerona.server) and
+relays what comes back: printed output, error messages, requests for
+input lines and finally the exit status. When no daemon is running, or
+for --stream and --emit-python, it runs the file itself like cerona.
+
+This module is imported on every client start, so it depends on nothing
+but the standard library and must not import cerona.main.
+
+The protocol is one JSON object per line in each direction. The client
+sends the request:
+
+    {"filename": ..., "path": ..., "engine": ..., "recursion_limit": ...,
+     "unbuffered": ..., "tty": ..., "cwd": ..., "env": {...}}
+
+cwd is the client's working directory, which the daemon takes relative
+paths in the program from, and env holds the client's values of the
+environment variables in FORWARDED_ENV, which the daemon uses in place
+of its own.
+
+and the daemon answers with any number of {"out": text}, {"err": text}
+and {"read": true} messages and then {"exit": status}. The client answers
+each "read" with {"line": text}, or {"line": null} at end of input.
+"""
+import json
+import os
+import socket
+import stat
+import sys
+
+SOCKET_ENV = "CERONA_SOCKET"
+
+# Environment variables a run through the daemon takes from the client (see cerona.cache)
+FORWARDED_ENV = ("CERONA_NO_CACHE", "CERONA_CACHE_DIR")
+
+
+def default_socket_path():
+    """
+    CERONA_SOCKET, or cerona.sock in the user's runtime directory, or
+    serve.sock in a cerona-UID directory of the temporary directory
+    (which cerona serve makes readable by the user alone)
+    """
+    path = os.environ.get(SOCKET_ENV)
+    if path:
+        return path
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "cerona.sock")
+    user = os.getuid() if hasattr(os, "getuid") else os.environ.get("USERNAME", "user")
+    # Not tempfile.gettempdir(): importing tempfile costs more than the rest of the client
+    return os.path.join(os.environ.get("TMPDIR", "/tmp"), f"cerona-{user}", "serve.sock")
+
+
+def owned_by_user(path):
+    """
+    Whether the socket at path belongs to the user running this process.
+    Anyone else's could be a daemon set up to receive our programs and
+    input, so the client never connects to one.
+    """
+    if not hasattr(os, "getuid"):
+        return True
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(info.st_mode) and info.st_uid == os.getuid()
+
+
+class Connection:
+    """Newline-delimited JSON messages over a connected socket"""
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = sock.makefile("rb")
+        self.writer = sock.makefile("wb")
+
+    def send(self, message):
+        self.writer.write(json.dumps(message).encode("utf-8") + b"\n")
+        self.writer.flush()
+
+    def receive(self):
+        """The next message, or None once the other side has closed the connection"""
+        line = self.reader.readline()
+        return json.loads(line) if line else None
+
+    def close(self):
+        for f in (self.reader, self.writer):
+            try:
+                f.close()
+            except OSError:
+                pass
+        self.sock.close()
+
+
+def connect(path=None):
+    """
+    A Connection to the daemon at path, or None if none is listening
+    there or the socket belongs to another user
+    """
+    path = path or default_socket_path()
+    if not hasattr(socket, "AF_UNIX") or not owned_by_user(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return Connection(sock)
+
+
+def _is_terminal(stream):
+    try:
+        return stream.isatty()
+    except (AttributeError, ValueError):
+        return False
+
+
+def run_remote(connection, request):
+    """Send request, relay the replies and return the exit status"""
+    connection.send(request)
+    while True:
+        message = connection.receive()
+        if message is None:
+            print(f"{request['filename']}: error: lost the connection to cerona serve", file=sys.stderr)
+            return 1
+        if "out" in message:
+            sys.stdout.write(message["out"])
+            sys.stdout.flush()
+        elif "err" in message:
+            sys.stderr.write(message["err"])
+            sys.stderr.flush()
+        elif "read" in message:
+            line = sys.stdin.readline()
+            connection.send({"line": line or None})
+        elif "exit" in message:
+            return message["exit"]
+
+
+def run_locally(argv):
+    from .main import main as cerona_main
+    cerona_main(argv)
+
+
+def main(argv=None):
+    """CLI entry point of cerona-client"""
+    import argparse
+
+    argv = sys.argv[1:] if argv is None else list(argv)
+    parser = argparse.ArgumentParser(prog="cerona-client",
+                                     description="Run a Cerona program through cerona serve",
+                                     epilog=f"The daemon's socket is ${SOCKET_ENV}, by default {default_socket_path()}.")
+    parser.add_argument("filename", help="the .cerona file to run")
+    parser.add_argument("--engine", default=None)
+    parser.add_argument("--compile", action="store_true")
+    parser.add_argument("--emit-python", action="store_true")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--recursion-limit", type=int, default=None, metavar="N")
+    parser.add_argument("--unbuffered", action="store_true")
+    args = parser.parse_args(argv)
+
+    connection = None if args.stream or args.emit_python else connect()
+    if connection is None:
+        path = default_socket_path()
+        if not args.stream and not args.emit_python and os.path.lexists(path) and not owned_by_user(path):
+            print(f"cerona-client: warning: not using {path}, which belongs to another user", file=sys.stderr)
+        return run_locally(argv)
+
+    request = {
+        "filename": args.filename,
+        "path": os.path.abspath(args.filename),
+        "engine": "python" if args.compile else args.engine,
+        "recursion_limit": args.recursion_limit,
+        "unbuffered": args.unbuffered,
+        "tty": _is_terminal(sys.stdout),
+        "cwd": os.getcwd(),
+        "env": {name: os.environ[name] for name in FORWARDED_ENV if name in os.environ},
+    }
+    try:
+        status = run_remote(connection, request)
+    finally:
+        connection.close()
+    if status:
+        sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
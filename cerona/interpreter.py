@@ -0,0 +1,205 @@
+"""
+Running Cerona programs from Python.
+
+ifs() and execute() parse the source on every call and end the process
+when the program fails, which suits the command line but not a service
+that runs the same scripts over and over. A Program is parsed once
+(through the on-disk cache when it comes from a file) and can then be
+run any number of times. Each run starts with fresh functions, classes
+and objects and the variables it is given, prints to the stream it is
+given and raises CeronaError instead of exiting.
+
+What does not change between runs stays on the Program: compiled
+expressions and conditions, the vm's bytecode and the python engine's
+compiled module. The closure engine still builds its closures per run.
+
+Runs are isolated from each other, so one Program or Interpreter can be
+used from many threads at once as long as each run is given its own
+stdout and stdin (the defaults are the process-wide sys.stdout and
+sys.stdin).
+
+Inside an asyncio application, run_async() runs a program as a coroutine
+that hands control back to the event loop every so many statements, so
+a long loop does not hold up everything else, and waits for input
+without blocking.
+"""
+import asyncio
+import threading
+from collections import OrderedDict
+
+from .cache import load_program
+from .main import ExpressionCache, _interpret, check_engine
+from .output import InputNeeded, PendingInput, make_output
+
+# Programs an Interpreter keeps parsed, by source text
+PROGRAM_CACHE_SIZE = 64
+
+# Statements run_async() runs between visits to the event loop
+ASYNC_SLICE_SIZE = 1000
+
+
+class _WriterStream:
+    """A text stream in front of an asyncio.StreamWriter"""
+    def __init__(self, writer):
+        self.writer = writer
+
+    def write(self, text):
+        self.writer.write(text.encode("utf-8"))
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class Program:
+    """
+    A parsed Cerona program.
+
+    Parse errors are raised from the constructor; engine and
+    recursion_limit are as for ifs(), and environ is the environment
+    the parse cache takes its settings from (see cerona.cache).
+    """
+    def __init__(self, source, filename="<input>", engine=None, recursion_limit=None, environ=None):
+        self.engine, self.recursion_limit = check_engine(engine, recursion_limit)
+        self.filename = filename
+        # (original_lines, cleaned, line_index, blocks) as load_program returns them
+        self.parsed = load_program(source, filename, environ)
+        self.expressions = ExpressionCache()
+        self.conditions = OrderedDict()
+        # Per-engine compiled forms, filled in by the first run that needs one
+        self.compiled = {}
+
+    @classmethod
+    def from_file(cls, path, engine=None, recursion_limit=None):
+        """Parse the program in the file at path"""
+        with open(path, 'r') as file:
+            return cls(file.read(), path, engine, recursion_limit)
+
+    def run(self, variables=None, stdout=None, unbuffered=False, stdin=None, directory=None):
+        """
+        Run the program and return its top-level variables.
+
+        variables is copied, so the same dict can start any number of
+        runs. print goes to stdout (sys.stdout by default), buffered as
+        described in cerona.output unless unbuffered is set, and input
+        reads lines from stdin (sys.stdin by default). Relative paths the
+        program opens are taken from directory instead of the working
+        directory, if it is given.
+        """
+        scope = dict(variables) if variables else {}
+        output = make_output(unbuffered, stdout)
+        try:
+            _interpret(None, self.filename, self.engine, False, self.recursion_limit,
+                       output, scope, self, stdin, directory=directory)
+        finally:
+            output.flush()
+        return scope
+
+    async def run_async(self, variables=None, stdout=None, stdin=None, slice_size=ASYNC_SLICE_SIZE):
+        """
+        Run the program as a coroutine and return its top-level variables.
+
+        After every slice_size statements (or loop iterations) what was
+        printed is written out and the event loop gets to run other
+        tasks. stdout may be a text stream or an asyncio.StreamWriter,
+        which is drained after each slice; stdin may be a text stream or
+        anything with an async readline(), such as an asyncio.StreamReader,
+        which input then awaits. Only the tree engine can run this way.
+        """
+        scope = dict(variables) if variables else {}
+        writer = stdout if hasattr(stdout, "drain") else None
+        output = make_output(False, stdout if writer is None else _WriterStream(writer))
+        reader = stdin if asyncio.iscoroutinefunction(getattr(stdin, "readline", None)) else None
+        if reader is not None:
+            stdin = PendingInput()
+        run_slice = _interpret(None, self.filename, self.engine, False, self.recursion_limit,
+                               output, scope, self, stdin, slice_size)
+        try:
+            while True:
+                try:
+                    more = run_slice()
+                except InputNeeded:
+                    output.flush()
+                    if writer is not None:
+                        await writer.drain()
+                    line = await reader.readline()
+                    if isinstance(line, bytes):
+                        line = line.decode("utf-8")
+                    if not line:
+                        stdin.supply(None)
+                    else:
+                        stdin.supply(line[:-1] if line.endswith("\n") else line)
+                    continue
+                output.flush()
+                if writer is not None:
+                    await writer.drain()
+                if not more:
+                    return scope
+                await asyncio.sleep(0)
+        finally:
+            output.flush()
+
+
+class Interpreter:
+    """
+    Runs programs with one set of options and its own I/O streams.
+
+    Source text given to run() is parsed the first time it is seen and
+    kept as a Program for later calls, up to cache_size programs. shared
+    is an optional mapping of (source, filename) to Program, such as
+    another interpreter's programs, that is looked in first and never
+    changed; hosts can parse their scripts once and hand the same
+    programs to every interpreter.
+    """
+    def __init__(self, engine=None, recursion_limit=None, stdout=None, unbuffered=False,
+                 cache_size=PROGRAM_CACHE_SIZE, stdin=None, shared=None):
+        self.engine, self.recursion_limit = check_engine(engine, recursion_limit)
+        self.stdout = stdout
+        self.stdin = stdin
+        self.unbuffered = unbuffered
+        self.cache_size = cache_size
+        self.shared = {} if shared is None else shared
+        self.programs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def compile(self, source, filename="<input>", environ=None):
+        """
+        The Program for source, parsing it unless it was seen before (with
+        the parse cache settings from environ, see Program)
+        """
+        key = (source, filename)
+        program = self.shared.get(key)
+        if program is not None:
+            return program
+        programs = self.programs
+        with self.lock:
+            program = programs.get(key)
+            if program is not None:
+                programs.move_to_end(key)
+                return program
+        # Parse outside the lock; two threads may both parse a new source
+        program = Program(source, filename, self.engine, self.recursion_limit, environ)
+        with self.lock:
+            program = programs.setdefault(key, program)
+            if len(programs) > self.cache_size:
+                programs.popitem(last=False)
+        return program
+
+    def run(self, program, variables=None, stdout=None, stdin=None):
+        """
+        Run a Program or source text and return its top-level variables.
+
+        stdout and stdin replace the interpreter's own streams for this run.
+        """
+        if not isinstance(program, Program):
+            program = self.compile(program)
+        return program.run(variables, self.stdout if stdout is None else stdout,
+                           self.unbuffered, self.stdin if stdin is None else stdin)
+
+    async def run_async(self, program, variables=None, stdout=None, stdin=None,
+                        slice_size=ASYNC_SLICE_SIZE):
+        """Program.run_async() for a Program or source text, with this interpreter's streams by default"""
+        if not isinstance(program, Program):
+            program = self.compile(program)
+        return await program.run_async(variables, self.stdout if stdout is None else stdout,
+                                       self.stdin if stdin is None else stdin, slice_size)
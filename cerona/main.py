@@ -1,4 +1,12 @@
+import operator
+import re
 import sys
+from collections import OrderedDict
+from functools import lru_cache
+from types import CodeType
+
+from .output import InputNeeded, make_output, read_input
+from .text import TEXT_COMMANDS, TextBuilder, text_command
 
 class CeronaError(Exception):
     """Base exception for Cerona errors"""
@@ -29,19 +37,286 @@ class CeronaClass:
         self.attributes = attributes
         self.methods = methods
         self.line_num = line_num
+        # Every instance stores the declared attributes in this order
+        self.layout = {attr_name: index for index, attr_name in enumerate(attributes)}
+        self.defaults = list(attributes.values())
 
 
 class CeronaObject:
-    """Represents an instance of a Cerona class"""
-    def __init__(self, class_def, instance_vars):
+    """
+    Represents an instance of a Cerona class.
+
+    The attributes the class declares live in a list laid out by
+    class_def.layout; a dict is only created for attributes set on the
+    instance that the class does not declare.
+    """
+    __slots__ = ("class_def", "values", "extra")
+
+    def __init__(self, class_def, instance_vars=None):
         self.class_def = class_def
-        self.instance_vars = instance_vars.copy()
+        self.values = class_def.defaults.copy()
+        self.extra = None
+        if instance_vars is not None:
+            for attr_name, value in instance_vars.items():
+                self.set_attr(attr_name, value)
+
+    def has_attr(self, attr_name):
+        return attr_name in self.class_def.layout or (self.extra is not None and attr_name in self.extra)
 
     def get_attr(self, attr_name):
-        return self.instance_vars.get(attr_name)
+        index = self.class_def.layout.get(attr_name)
+        if index is not None:
+            return self.values[index]
+        if self.extra is not None:
+            return self.extra.get(attr_name)
+        return None
 
     def set_attr(self, attr_name, value):
-        self.instance_vars[attr_name] = value
+        index = self.class_def.layout.get(attr_name)
+        if index is not None:
+            self.values[index] = value
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[attr_name] = value
+
+    def items(self):
+        """(name, value) for every attribute of the instance"""
+        if self.extra is None:
+            return zip(self.class_def.layout, self.values)
+        return list(zip(self.class_def.layout, self.values)) + list(self.extra.items())
+
+    @property
+    def instance_vars(self):
+        """The attributes as a new dict"""
+        if self.extra is None:
+            return dict(zip(self.class_def.layout, self.values))
+        return dict(self.items())
+
+    def update_from(self, scope):
+        """Copy back every attribute that scope can see, after a method call"""
+        layout = self.class_def.layout
+        try:
+            # A frame from method_scope sees every attribute
+            self.values = list(map(scope.__getitem__, layout))
+        except KeyError:
+            self.values = [
+                scope[attr_name] if attr_name in scope else value
+                for attr_name, value in zip(layout, self.values)
+            ]
+        if self.extra is not None:
+            for attr_name in self.extra:
+                if attr_name in scope:
+                    self.extra[attr_name] = scope[attr_name]
+
+
+class Scope(dict):
+    """
+    Variables of a function or method call.
+
+    Only the call's own variables (parameters and whatever it sets) are
+    stored in the dict; every other name is looked up in parent, the
+    global variables. Making a frame therefore costs O(locals) instead of
+    a copy of every global.
+    """
+    __slots__ = ("parent",)
+
+    def __init__(self, parent, own=()):
+        super().__init__(own)
+        self.parent = parent
+
+    def __missing__(self, key):
+        return self.parent[key]
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.parent
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+
+def call_scope(scope):
+    """
+    The scope for a function called from scope.
+
+    Functions see the caller's variables (a copy of its locals) and the
+    globals; what they set stays their own.
+    """
+    if isinstance(scope, Scope):
+        return Scope(scope.parent, scope)
+    return Scope(scope)
+
+
+def method_scope(obj, global_vars):
+    """The scope for a method call on obj: its attributes, with globals taking precedence"""
+    own = obj.instance_vars
+    if not global_vars.keys().isdisjoint(own):
+        for name in [name for name in own if name in global_vars]:
+            del own[name]
+    return Scope(global_vars, own)
+
+
+class Frame:
+    """
+    A body the tree walker is running: commands[start:end] in scope.
+
+    Blocks and calls push a Frame onto an explicit stack instead of
+    recursing, so neither deep nesting nor deep Cerona recursion uses up
+    the Python stack. When the body reaches end, repeat (set for loops)
+    says whether to run it again. Call frames count towards the
+    recursion limit; owner is the object a method was called on, updated
+    from the scope when the method returns, and on_return is given the
+    call's result.
+    """
+    __slots__ = ("commands", "program", "index", "start", "end", "scope",
+                 "line_num", "repeat", "owner", "is_call", "on_return")
+
+    def __init__(self, commands, start, end, scope, line_num=None,
+                 repeat=None, owner=None, is_call=False, program=None, on_return=None):
+        self.commands = commands
+        # What statements in the body look block structure up in
+        self.program = commands if program is None else program
+        self.index = start
+        self.start = start
+        self.end = end
+        self.scope = scope
+        self.line_num = line_num
+        self.repeat = repeat
+        self.owner = owner
+        self.is_call = is_call
+        self.on_return = on_return
+
+
+@lru_cache(maxsize=1024)
+def _code_names(code):
+    """Every global name code, or code nested in it, can look up"""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            names |= _code_names(const)
+    return frozenset(names)
+
+
+def eval_globals(code, scope):
+    """
+    A dict to pass to eval() as the globals of code run in scope.
+
+    eval() reads globals as a plain dict, so a Scope's inherited names
+    would not be found; give it just the names code uses instead.
+    """
+    if not isinstance(scope, Scope):
+        return scope
+    return {name: scope[name] for name in _code_names(code) if name in scope}
+
+
+class ExpressionCache:
+    """
+    Bounded LRU cache of compiled Python expressions, keyed by source text and mode.
+
+    Several threads may share one: an entry evicted by another thread in
+    the middle of a lookup is simply compiled again.
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.codes = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def compile(self, expr, mode="eval"):
+        """Return the code object for expr, compiling it on first use"""
+        key = (expr, mode)
+        codes = self.codes
+        code = codes.get(key)
+        if code is not None:
+            self.hits += 1
+            try:
+                codes.move_to_end(key)
+            except KeyError:
+                pass
+        else:
+            self.misses += 1
+            try:
+                # eval() ignores leading blanks in a string source, compile() does not
+                code = compile(expr.lstrip(" \t"), "<cerona>", mode)
+            except (SyntaxError, ValueError) as e:
+                # Remember failures too so literal text is not re-parsed every time
+                code = e
+            codes[key] = code
+            if len(codes) > self.maxsize:
+                try:
+                    codes.popitem(last=False)
+                except KeyError:
+                    pass
+
+        if isinstance(code, Exception):
+            raise code.with_traceback(None)
+        return code
+
+    def eval(self, expr, globals_dict, locals_dict=None):
+        """Evaluate expr like the builtin eval(), reusing its compiled code"""
+        return eval(self.compile(expr), globals_dict, locals_dict)
+
+    def __len__(self):
+        return len(self.codes)
+
+
+# Results a memo func keeps, per function
+MEMO_CACHE_SIZE = 1024
+
+# What MemoCache.lookup returns for arguments it has no result for
+MISSING = object()
+
+
+class MemoCache:
+    """
+    Results of a memo func, keyed by argument tuple, least recently used
+    dropped first. Calls with unhashable arguments are not cached.
+    """
+    def __init__(self, maxsize=MEMO_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, args):
+        """The cache key for args, or None if they cannot be one"""
+        key = tuple(args)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def lookup(self, key):
+        """The remembered result for key, or MISSING"""
+        results = self.results
+        if key in results:
+            self.hits += 1
+            results.move_to_end(key)
+            return results[key]
+        self.misses += 1
+        return MISSING
+
+    def remember(self, key, value):
+        results = self.results
+        results[key] = value
+        if len(results) > self.maxsize:
+            results.popitem(last=False)
+
+    def stats(self, name):
+        """The line memostats prints"""
+        return f"{name}: {self.hits} hits, {self.misses} misses, {len(self)}/{self.maxsize} cached"
+
+    def __len__(self):
+        return len(self.results)
+
+
+class FunctionReturn(Exception):
+    """Raised by return in the closure engine to leave the function it is in"""
+    def __init__(self, value, line_num=None):
+        super().__init__(value)
+        self.value = value
+        self.line_num = line_num
 
 
 def find_matching_end(commands, start_index, start_keyword, end_keyword):
@@ -62,102 +337,716 @@ def find_matching_end(commands, start_index, start_keyword, end_keyword):
     return -1
 
 
-def ifs(lines, filename="<input>"):
-    variables = {}
-    functions = {}
-    classes = {}
-    objects = {}
+BLOCK_KEYWORDS = {
+    "if": "endif",
+    "while": "endwhile",
+    "for": "endfor",
+    "func": "endfunc",
+    "class": "endclass",
+}
+
+
+def block_keyword(cmd):
+    """The keyword cmd starts with as far as blocks go; "memo func" opens a func, "parallel for" a for"""
+    if cmd[0] == "memo" and len(cmd) > 1 and cmd[1] == "func":
+        return "func"
+    if cmd[0] == "parallel" and len(cmd) > 1 and cmd[1] == "for":
+        return "for"
+    return cmd[0]
+
+
+def _missing_end_message(cmd):
+    """Error message for a block opener that never gets its terminator"""
+    keyword = block_keyword(cmd)
+    if keyword != cmd[0]:
+        cmd = cmd[1:]
+    name = cmd[1] if len(cmd) > 1 else ""
+    if keyword == "if":
+        return "missing 'endif' for if statement"
+    elif keyword == "while":
+        return "missing 'endwhile' for while loop"
+    elif keyword == "for":
+        return "missing 'endfor' for for loop"
+    elif keyword == "func":
+        return f"missing 'endfunc' for function '{name}'"
+    return f"missing 'endclass' for class '{name}'"
+
+
+def build_block_table(commands, original_lines=(), start=0):
+    """
+    Resolve every block opener in a parsed program in a single pass.
+
+    Returns (line_index, blocks): line_index maps a line number to its
+    position in commands, blocks maps the position of each if/while/for/
+    func/class opener to (end_index, else_index). else_index is None for
+    everything except an if block that has an else branch. Positions are
+    counted from start, for commands that are a slice of a longer program.
+
+    Raises CeronaError for unmatched openers and stray terminators.
+    """
+    line_index = {}
+    blocks = {}
+    else_indexes = {}
+    open_blocks = {keyword: [] for keyword in BLOCK_KEYWORDS}
+    openers = {end: start for start, end in BLOCK_KEYWORDS.items()}
+
+    def source(line_num):
+        return original_lines[line_num - 1] if line_num <= len(original_lines) else None
+
+    for index, (line_num, cmd) in enumerate(commands, start):
+        line_index[line_num] = index
+        keyword = block_keyword(cmd)
+
+        if keyword in BLOCK_KEYWORDS:
+            # Inline "if ... then ..." statements do not open a block
+            if keyword == "if" and "then" in cmd:
+                continue
+            open_blocks[keyword].append(index)
+        elif keyword in openers:
+            stack = open_blocks[openers[keyword]]
+            if not stack:
+                raise CeronaError(
+                    f"'{keyword}' without matching '{openers[keyword]}'",
+                    line_num,
+                    source(line_num)
+                )
+            start_index = stack.pop()
+            blocks[start_index] = (index, else_indexes.pop(start_index, None))
+        elif keyword == "else":
+            if not open_blocks["if"]:
+                raise CeronaError("'else' without matching 'if'", line_num, source(line_num))
+            else_indexes[open_blocks["if"][-1]] = index
 
-    # Store original lines for error reporting
-    original_lines = lines.split("\n")
+    unmatched = [index for stack in open_blocks.values() for index in stack]
+    if unmatched:
+        line_num, cmd = commands[min(unmatched) - start]
+        raise CeronaError(_missing_end_message(cmd), line_num, source(line_num))
 
-    def parse_line(line, line_num):
-        """Parse a line, handling quotes properly and stripping parentheses"""
-        try:
-            comment_index = -1
-            in_quotes = False
-            quote_char = None
-
-            for idx, char in enumerate(line):
-                if char in ['"', "'"]:
-                    if not in_quotes:
-                        in_quotes = True
-                        quote_char = char
-                    elif char == quote_char:
-                        in_quotes = False
-                        quote_char = None
-                elif char == '#' and not in_quotes:
-                    comment_index = idx
-                    break
+    return line_index, blocks
+
+
+# Everything before the first '#' that is outside a quoted string; quotes
+# pair up naively here, backslashes do not escape them
+_COMMENT_PREFIX = re.compile(r"""(?:[^"'#]+|"[^"]*"|'[^']*')*""")
+
+# Tokens of a line without quotes or backslashes
+_BARE_WORDS = re.compile(r"[^ \t()]+")
+_BARE_WORDS_AND_PARENS = re.compile(r"[^ \t()]+|[()]")
+
+# A line splits into words, quoted strings, runs of separators and, if a
+# string is never closed, its lone opening quote
+_PIECES = re.compile(r"""[^ \t()"']+|"[^"]*"|'[^']*'|[ \t()]+|["']""")
+
+# The same for lines with backslashes, which take the next character
+# literally (a trailing backslash is dropped)
+_ESCAPED_PIECES = re.compile(r"""
+    (?:[^ \t()"'\\]+|\\.|\\\Z)+
+  | "[^"\\]*(?:\\.[^"\\]*)*"
+  | '[^'\\]*(?:\\.[^'\\]*)*'
+  | [ \t()]+
+  | ["']
+""", re.VERBOSE | re.DOTALL)
 
-            if comment_index != -1:
+_ESCAPE = re.compile(r"\\(.?)", re.DOTALL)
+
+
+def _unescape(text):
+    if '\\' not in text:
+        return text
+    return _ESCAPE.sub(lambda match: match.group(1), text)
+
+
+def parse_line(line, line_num, original_lines=(), keep_parens=False):
+    """
+    Parse a line, handling quotes properly and stripping parentheses.
+
+    With keep_parens, parentheses outside quotes come back as tokens of
+    their own instead (conditions use this to recover their grouping).
+    """
+    try:
+        comment_index = line.find('#')
+        if comment_index != -1:
+            head = line[:comment_index]
+            if '"' in head or "'" in head:
+                comment_index = _COMMENT_PREFIX.match(line).end()
+            if comment_index < len(line) and line[comment_index] == '#':
                 line = line[:comment_index]
 
-            line = line.strip()
-            if not line:
-                return []
-
-            # Strip leading/trailing parentheses before tokenizing
-            while line.startswith('(') and line.endswith(')'):
-                line = line[1:-1].strip()
-
-            tokens = []
-            current_token = ""
-            in_quotes = False
-            quote_char = None
-            escape_next = False
-
-            for char in line:
-                if escape_next:
-                    current_token += char
-                    escape_next = False
-                elif char == '\\':
-                    escape_next = True
-                elif char in ['"', "'"]:
-                    if not in_quotes:
-                        in_quotes = True
-                        quote_char = char
-                        if current_token.strip():
-                            tokens.extend(current_token.strip().split())
-                        current_token = ""
-                    elif char == quote_char:
-                        in_quotes = False
-                        quote_char = None
-                        tokens.append(current_token)
-                        current_token = ""
-                    else:
-                        current_token += char
-                elif char in ['(', ')'] and not in_quotes:
-                    # Skip parentheses when not in quotes
-                    if current_token:
-                        tokens.append(current_token)
-                        current_token = ""
-                elif char in [' ', '\t'] and not in_quotes:
-                    if current_token:
-                        tokens.append(current_token)
-                        current_token = ""
-                else:
-                    current_token += char
+        line = line.strip()
+        if not line:
+            return []
 
-            if current_token:
-                tokens.append(current_token)
+        # Strip leading/trailing parentheses before tokenizing
+        while not keep_parens and line.startswith('(') and line.endswith(')'):
+            line = line[1:-1].strip()
 
-            if in_quotes:
-                raise CeronaError(
-                    f"unterminated string literal",
-                    line_num,
-                    original_lines[line_num - 1] if line_num <= len(original_lines) else line
-                )
+        escaped = '\\' in line
+        if not escaped and '"' not in line and "'" not in line:
+            return (_BARE_WORDS_AND_PARENS if keep_parens else _BARE_WORDS).findall(line)
 
-            return tokens
-        except CeronaError:
-            raise
-        except Exception as e:
-            raise CeronaError(
-                f"parse error: {str(e)}",
-                line_num,
-                original_lines[line_num - 1] if line_num <= len(original_lines) else line
-            )
+        tokens = []
+        word = ""
+        for piece in (_ESCAPED_PIECES if escaped else _PIECES).findall(line):
+            first = piece[0]
+            if first == '"' or first == "'":
+                if len(piece) == 1:
+                    raise CeronaError(
+                        f"unterminated string literal",
+                        line_num,
+                        original_lines[line_num - 1] if line_num <= len(original_lines) else line
+                    )
+                # A word running straight into a quote is split on any whitespace
+                if word:
+                    tokens.pop()
+                    tokens.extend(word.split())
+                    word = ""
+                piece = piece[1:-1]
+                tokens.append(_unescape(piece) if escaped else piece)
+            elif first in ' \t()':
+                word = ""
+                if keep_parens:
+                    tokens.extend(char for char in piece if char in '()')
+            else:
+                word = _unescape(piece) if escaped else piece
+                if word:
+                    tokens.append(word)
+
+        return tokens
+    except CeronaError:
+        raise
+    except Exception as e:
+        raise CeronaError(
+            f"parse error: {str(e)}",
+            line_num,
+            original_lines[line_num - 1] if line_num <= len(original_lines) else line
+        )
+
+
+def parse_program(original_lines):
+    """Tokenize source lines into the (line_num, tokens) list the interpreter runs"""
+    cleaned = []
+    for line_num, line in enumerate(original_lines, start=1):
+        stripped = line.strip()
+        if stripped:
+            tokens = parse_line(stripped, line_num, original_lines)
+            if tokens:
+                cleaned.append((line_num, tokens))
+    return cleaned
+
+
+# Compiled conditions the tree walker keeps around
+CONDITION_CACHE_SIZE = 1024
+
+# How many Cerona function and method calls may be active at once
+RECURSION_LIMIT = 200_000
+
+ENGINES = ("tree", "closure", "python", "vm")
+STREAM_ENGINES = ("tree", "closure")
+DEFAULT_ENGINE = "tree"
+
+# Characters that make the set fallback retry a resolved string as an expression
+EXPRESSION_OPERATORS = ['+', '-', '*', '/', '%']
+
+
+CONDITION_OPERATORS = ["equals", "==", "notequals", "!=", "greater", ">",
+                       "greaterequals", ">=", "less", "<", "lessequals", "<=",
+                       "contains", "in"]
+
+
+def coerce_number(value):
+    """Turn numeric-looking strings into floats for comparisons, leave anything else alone"""
+    if isinstance(value, str) and value.replace('.', '', 1).replace('-', '', 1).isdigit():
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    return value
+
+
+# Conditions compare numbers for orderings and text for everything else
+ORDERINGS = {
+    "greater": operator.gt, ">": operator.gt,
+    "greaterequals": operator.ge, ">=": operator.ge,
+    "less": operator.lt, "<": operator.lt,
+    "lessequals": operator.le, "<=": operator.le,
+}
+TEXT_TESTS = {
+    "equals": operator.eq, "==": operator.eq,
+    "notequals": operator.ne, "!=": operator.ne,
+    "contains": operator.contains,
+}
+
+
+def _constant_operand(token):
+    """(True, text) for a number or quoted string, which is never looked up as a variable"""
+    if len(token) >= 2 and token[0] == token[-1] and token[0] in ('"', "'"):
+        return True, token[1:-1]
+    if token.replace('.', '', 1).replace('-', '', 1).isdigit():
+        return True, token
+    return False, None
+
+
+def _failing_condition(message, line_num, line_content):
+    def condition(scope):
+        raise CeronaError(message, line_num, line_content)
+    return condition
+
+
+# Words joining comparisons into a compound condition
+LOGICAL_WORDS = ("and", "or", "not")
+
+
+def _restore_parens(tokens, line_content):
+    """
+    Put back the parentheses the tokenizer dropped from a condition.
+
+    The condition is found again in its source line, tokenized with the
+    parentheses kept. If it cannot be found, or its parentheses do not
+    balance, the tokens are returned unchanged.
+    """
+    if not line_content or '(' not in line_content:
+        return tokens
+    try:
+        full = parse_line(line_content.strip(), 0, keep_parens=True)
+    except CeronaError:
+        return tokens
+
+    for start, token in enumerate(full):
+        if token != tokens[0]:
+            continue
+        restored = []
+        matched = 0
+        index = start
+        while index < len(full) and matched < len(tokens):
+            if full[index] in ('(', ')'):
+                restored.append(full[index])
+            elif full[index] == tokens[matched]:
+                restored.append(full[index])
+                matched += 1
+            else:
+                break
+            index += 1
+        if matched < len(tokens):
+            continue
+        # Opening parentheses just before the condition, closing ones just after
+        first = start
+        while first > 0 and full[first - 1] == '(':
+            first -= 1
+        restored = full[first:start] + restored
+        depth = restored.count('(') - restored.count(')')
+        while depth > 0 and index < len(full) and full[index] == ')':
+            restored.append(')')
+            depth -= 1
+            index += 1
+        while depth > 0 and restored[0] == '(':
+            restored.pop(0)
+            depth -= 1
+        if depth == 0:
+            return restored
+        return tokens
+    return tokens
+
+
+def parse_condition(tokens, line_num=None, line_content=None):
+    """
+    Parse the tokens of an if/while condition into a tree of tuples:
+
+        ("compare", left, operator, right)
+        ("not", node)
+        ("and", nodes) / ("or", nodes)
+
+    Comparisons can be joined with and/or, negated with not and grouped
+    with parentheses; not binds tightest, then and, then or. A condition
+    without those words is its first three tokens, as it always was.
+    Raises CeronaError for malformed conditions.
+    """
+    def fail(message):
+        raise CeronaError(message, line_num, line_content)
+
+    def comparison(left, operator_name, right):
+        if operator_name not in CONDITION_OPERATORS:
+            fail(f"unknown operator '{operator_name}' (valid: {', '.join(CONDITION_OPERATORS)})")
+        return ("compare", left, operator_name, right)
+
+    if not any(token in LOGICAL_WORDS for token in tokens):
+        if len(tokens) < 3:
+            fail(f"invalid condition: expected at least 3 tokens, got {len(tokens)}")
+        return comparison(tokens[0], tokens[1], tokens[2])
+
+    tokens = _restore_parens(tokens, line_content)
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        token = peek()
+        if token is None:
+            fail("invalid condition: ends too early")
+        position += 1
+        return token
+
+    def parse_any():
+        nodes = [parse_all()]
+        while peek() == "or":
+            take()
+            nodes.append(parse_all())
+        return nodes[0] if len(nodes) == 1 else ("or", tuple(nodes))
+
+    def parse_all():
+        nodes = [parse_term()]
+        while peek() == "and":
+            take()
+            nodes.append(parse_term())
+        return nodes[0] if len(nodes) == 1 else ("and", tuple(nodes))
+
+    def parse_term():
+        token = take()
+        if token == "not":
+            return ("not", parse_term())
+        if token == "(":
+            node = parse_any()
+            if take() != ")":
+                fail("invalid condition: missing ')'")
+            return node
+        operands = [token, take(), take()]
+        for operand in (operands[0], operands[2]):
+            if operand in LOGICAL_WORDS or operand in ('(', ')'):
+                fail(f"invalid condition: unexpected '{operand}'")
+        return comparison(*operands)
+
+    try:
+        node = parse_any()
+        if position < len(tokens):
+            fail(f"invalid condition: unexpected '{tokens[position]}'")
+    except CeronaError:
+        # A lone comparison with a quoted "and"/"or"/"not" operand
+        if len(tokens) == 3 and tokens[1] in CONDITION_OPERATORS:
+            return ("compare", tokens[0], tokens[1], tokens[2])
+        raise
+    return node
+
+
+def compile_condition(tokens, line_num=None, line_content=None):
+    """
+    Compile the tokens of an if/while condition into a function of the scope.
+
+    The operator is bound once and constant operands are converted once;
+    any other operand costs one scope lookup and falls back to its own
+    text when it is not a variable. and/or short-circuit. A malformed
+    condition compiles to a function raising the CeronaError, so it only
+    fails when it runs.
+    """
+    try:
+        node = parse_condition(tokens, line_num, line_content)
+    except CeronaError as e:
+        return _failing_condition(e.message, line_num, line_content)
+    return _compile_node(node)
+
+
+def _compile_node(node):
+    kind = node[0]
+    if kind == "compare":
+        left, operator_name, right = node[1:]
+        if operator_name in ORDERINGS:
+            return _compile_comparison(ORDERINGS[operator_name], left, right, coerce_number)
+        if operator_name == "in":
+            # "a in b" is "b contains a"
+            return _compile_comparison(operator.contains, right, left, str)
+        return _compile_comparison(TEXT_TESTS[operator_name], left, right, str)
+
+    if kind == "not":
+        operand = _compile_node(node[1])
+
+        def condition(scope):
+            return not operand(scope)
+        return condition
+
+    parts = tuple(_compile_node(part) for part in node[1])
+    if len(parts) == 2:
+        first, second = parts
+        if kind == "and":
+            def condition(scope):
+                return first(scope) and second(scope)
+        else:
+            def condition(scope):
+                return first(scope) or second(scope)
+        return condition
+
+    if kind == "and":
+        def condition(scope):
+            for part in parts:
+                if not part(scope):
+                    return False
+            return True
+    else:
+        def condition(scope):
+            for part in parts:
+                if part(scope):
+                    return True
+            return False
+    return condition
+
+
+def _compile_comparison(compare, left, right, convert):
+    """A condition computing compare(convert(left), convert(right))"""
+    left_is_constant, left_value = _constant_operand(left)
+    right_is_constant, right_value = _constant_operand(right)
+    numeric = convert is coerce_number
+    # Text tests leave operands that are text already as they are
+    same = str if convert is str else None
+
+    if left_is_constant:
+        left_value = convert(left_value)
+    if right_is_constant:
+        right_value = convert(right_value)
+
+    if left_is_constant and right_is_constant:
+        def condition(scope):
+            return compare(left_value, right_value)
+        return condition
+
+    if right_is_constant and numeric:
+        # The loop test: while i less 1000000
+        def condition(scope):
+            try:
+                value = scope[left]
+            except KeyError:
+                value = left
+            if value.__class__ is str:
+                value = coerce_number(value)
+            return compare(value, right_value)
+        return condition
+
+    if right_is_constant:
+        def condition(scope):
+            try:
+                value = scope[left]
+            except KeyError:
+                value = left
+            if value.__class__ is not same:
+                value = convert(value)
+            return compare(value, right_value)
+        return condition
+
+    if left_is_constant:
+        def condition(scope):
+            try:
+                value = scope[right]
+            except KeyError:
+                value = right
+            if value.__class__ is not same:
+                value = convert(value)
+            return compare(left_value, value)
+        return condition
+
+    def condition(scope):
+        try:
+            left_operand = scope[left]
+        except KeyError:
+            left_operand = left
+        try:
+            right_operand = scope[right]
+        except KeyError:
+            right_operand = right
+        if left_operand.__class__ is not same:
+            left_operand = convert(left_operand)
+        if right_operand.__class__ is not same:
+            right_operand = convert(right_operand)
+        return compare(left_operand, right_operand)
+    return condition
+
+
+# List, map, array and text commands, with what each expects
+COLLECTION_COMMANDS = {
+    "list": "list NAME [ITEM ...]",
+    "array": "array NAME range START END [STEP], array NAME file PATH or array NAME NUMBER ...",
+    "sum": "sum NAME VAR",
+    "mean": "mean NAME VAR",
+    "min": "min NAME VAR",
+    "max": "max NAME VAR",
+    "map": "map NAME",
+    "push": "push LIST VALUE",
+    "pop": "pop LIST [VAR]",
+    "get": "get LIST_OR_MAP KEY VAR",
+    "put": "put LIST_OR_MAP KEY VALUE",
+    "len": "len LIST_OR_MAP VAR",
+    "has": "has LIST_OR_MAP KEY VAR",
+    "del": "del LIST_OR_MAP KEY",
+    "append": "append VAR VALUE",
+    "split": "split TEXT [SEPARATOR] VAR",
+    "concat": "concat LIST [SEPARATOR] VAR",
+    "replace": "replace TEXT OLD NEW VAR",
+    "upper": "upper TEXT VAR",
+    "lower": "lower TEXT VAR",
+    "find": "find TEXT PART VAR",
+    "match": "match PATTERN TEXT VAR",
+}
+
+
+def collection_syntax(i):
+    """
+    (operation, value expressions, variable the result goes into or None)
+    for a list, map, array or text command; ValueError if it is
+    malformed. The operation is the keyword, or "array range", "array
+    file" or "array values" for array.
+    """
+    keyword = i[0]
+    count = len(i)
+    if count >= 2:
+        if keyword == "list":
+            return keyword, i[2:], i[1]
+        if keyword == "array" and count >= 3:
+            if i[2] == "range" and count in (5, 6):
+                return "array range", i[3:], i[1]
+            if i[2] == "file" and count == 4:
+                return "array file", i[3:], i[1]
+            if i[2] not in ("range", "file"):
+                return "array values", i[2:], i[1]
+        if keyword == "map" and count == 2:
+            return keyword, (), i[1]
+        if keyword == "push" and count >= 3:
+            return keyword, (" ".join(i[2:]),), None
+        if keyword == "pop" and count in (2, 3):
+            return keyword, (), i[2] if count == 3 else None
+        if keyword in ("get", "has") and count == 4:
+            return keyword, (i[2],), i[3]
+        if keyword == "put" and count >= 4:
+            return keyword, (i[2], " ".join(i[3:])), None
+        if keyword in ("len", "sum", "mean", "min", "max") and count == 3:
+            return keyword, (), i[2]
+        if keyword == "del" and count == 3:
+            return keyword, (i[2],), None
+        if keyword == "append" and count >= 3:
+            return keyword, (" ".join(i[2:]),), i[1]
+        if keyword in ("split", "concat") and count in (3, 4):
+            return keyword, i[1:-1], i[-1]
+        if keyword == "replace" and count == 5:
+            return keyword, i[1:4], i[4]
+        if keyword in ("upper", "lower") and count == 3:
+            return keyword, (i[1],), i[2]
+        if keyword == "find" and count == 4:
+            return keyword, (i[1], i[2]), i[3]
+        if keyword == "match" and count == 4:
+            return keyword, (i[2],), i[3]
+    raise ValueError(f"invalid {keyword} syntax (expected: {COLLECTION_COMMANDS[keyword]})")
+
+
+def _list_index(items, name, key):
+    try:
+        index = int(key)
+    except (TypeError, ValueError):
+        raise ValueError(f"list index must be an integer, got '{key}'")
+    if not -len(items) <= index < len(items):
+        raise ValueError(f"index {index} is out of range for '{name}' (length {len(items)})")
+    return index
+
+
+def collection_command(keyword, name, scope, values, directory=None):
+    """
+    Run a list, map or array operation (see collection_syntax) on the
+    collection in scope[name], in place, with the values of its
+    expressions, or a text command; return its result. Relative paths
+    are taken from directory, if given. Mistakes raise ValueError, which
+    the statement reports as a runtime error.
+    """
+    if keyword in TEXT_COMMANDS:
+        return text_command(keyword, name, scope, values)
+    if keyword == "list":
+        return list(values)
+    if keyword.startswith("array"):
+        # NumPy, if it is there, is only imported by programs using arrays
+        from .arrays import make_array
+        return make_array(keyword[6:], values, directory)
+    if keyword == "map":
+        return {}
+    collection = scope[name] if name in scope else None
+    if keyword in ("sum", "mean", "min", "max"):
+        from .arrays import Array
+        if not isinstance(collection, Array):
+            raise ValueError(f"'{name}' is not an array")
+        return getattr(collection, keyword)()
+    if keyword == "len" and not isinstance(collection, (list, dict)):
+        if isinstance(collection, (str, TextBuilder)):
+            return len(collection)
+        from .arrays import Array
+        if isinstance(collection, Array):
+            return len(collection)
+    if keyword in ("push", "pop"):
+        if not isinstance(collection, list):
+            raise ValueError(f"'{name}' is not a list")
+        if keyword == "push":
+            collection.append(values[0])
+            return None
+        if not collection:
+            raise ValueError(f"pop from empty list '{name}'")
+        return collection.pop()
+    if not isinstance(collection, (list, dict)):
+        raise ValueError(f"'{name}' is not a list or map")
+    if keyword == "len":
+        return len(collection)
+    key = values[0]
+    is_list = isinstance(collection, list)
+    if keyword == "has":
+        if not is_list:
+            return key in collection
+        # Whether get would find an item there, as for a map
+        try:
+            index = int(key)
+        except (TypeError, ValueError):
+            raise ValueError(f"list index must be an integer, got '{key}'")
+        return -len(collection) <= index < len(collection)
+    if is_list:
+        key = _list_index(collection, name, key)
+    elif keyword != "put" and key not in collection:
+        raise ValueError(f"key '{key}' not found in '{name}'")
+    if keyword == "get":
+        return collection[key]
+    if keyword == "put":
+        collection[key] = values[1]
+    else:
+        del collection[key]
+    return None
+
+
+def _interpret(lines, filename, engine, stream, recursion_limit, output, variables=None, program=None,
+               stdin=None, slice_size=0, chunk=None, directory=None):
+    """
+    The interpreter behind ifs() and Program.run(): run lines (or the
+    already parsed program) with the top-level variables given, printing
+    to output and reading input from stdin (see read_input). Errors are
+    raised as CeronaError.
+
+    With a slice_size (tree engine only) nothing runs yet; the function
+    returned runs the next slice_size statements or so each time it is
+    called and returns False once the program has finished.
+
+    With a chunk (functions, classes, objects, loop, first, last), only
+    the body of a parallel for runs, for first <= VAR < last, after
+    defining functions, classes and objects as
+    cerona.parallel.run_parallel_for() describes them; what is returned
+    is the reductions of the chunk.
+
+    Relative paths the program opens (array NAME file PATH) are taken
+    from directory instead of the current working directory if it is
+    given.
+
+    Everything a run changes is local to the call, so runs on different
+    threads do not see each other; a shared program's caches tolerate
+    concurrent use.
+    """
+    engine, recursion_limit = check_engine(engine, recursion_limit, stream)
+
+    if variables is None:
+        variables = {}
+    functions = {}
+    memos = {}
+    classes = {}
+    objects = {}
+    # Compiled expressions and conditions outlive a run when the program does
+    expressions = program.expressions if program is not None else ExpressionCache()
+    write_line = output.line
 
     def resolve_value(token, variables, line_num=None):
         """Resolve a token to its actual value (variable or literal)"""
@@ -167,57 +1056,108 @@ def ifs(lines, filename="<input>"):
             return token[1:-1]
         return token
 
-    def evaluate_condition(condition_tokens, variables, line_num=None):
-        """Evaluate a condition with multiple operators"""
-        if len(condition_tokens) < 3:
-            raise CeronaError(
-                f"invalid condition: expected at least 3 tokens, got {len(condition_tokens)}",
-                line_num,
-                original_lines[line_num - 1] if line_num and line_num <= len(original_lines) else None
-            )
+    def resolved_value(expr, variables, line_num=None):
+        """The value of a set or return expression that did not evaluate as Python"""
+        resolved = resolve_value(expr, variables, line_num)
+        # Check if resolved value is a string that looks like an expression
+        if isinstance(resolved, str) and any(op in resolved for op in EXPRESSION_OPERATORS):
+            try:
+                return expressions.eval(resolved, {"__builtins__": None}, variables)
+            except:
+                return resolved
+        return resolved
 
-        left = resolve_value(condition_tokens[0], variables, line_num)
-        operator = condition_tokens[1]
-        right = resolve_value(condition_tokens[2], variables, line_num)
+    def store_resolved(var_name, expr, variables, line_num=None):
+        """Store a set value that did not evaluate as a Python expression"""
+        variables[var_name] = resolved_value(expr, variables, line_num)
 
+    def value_of(expr, variables, line_num=None):
+        """The value set would store for expr"""
         try:
-            left_num = float(left) if isinstance(left, str) and left.replace('.', '', 1).replace('-', '', 1).isdigit() else left
-            right_num = float(right) if isinstance(right, str) and right.replace('.', '', 1).replace('-', '', 1).isdigit() else right
+            return expressions.eval(expr, {"__builtins__": None}, variables)
         except:
-            left_num, right_num = left, right
+            return resolved_value(expr, variables, line_num)
 
-        valid_operators = ["equals", "==", "notequals", "!=", "greater", ">",
-                          "greaterequals", ">=", "less", "<", "lessequals", "<=",
-                          "contains", "in"]
+    def run_collection(operation, name, target, values, scope):
+        """A list, map, array or text command whose values have been worked out; the result goes into target"""
+        result = collection_command(operation, name, scope, values, directory)
+        if target is not None:
+            scope[target] = result
 
-        if operator not in valid_operators:
-            raise CeronaError(
-                f"unknown operator '{operator}' (valid: {', '.join(valid_operators)})",
-                line_num,
-                original_lines[line_num - 1] if line_num and line_num <= len(original_lines) else None
-            )
+    def print_expression(expr, variables):
+        """The print statement: evaluate expr if possible, otherwise print what it names"""
+        # First, try to evaluate as expression with current scope
+        try:
+            code = expressions.compile(expr)
+            result = eval(code, eval_globals(code, variables))
+            write_line(result)
+            return
+        except:
+            pass
+
+        # If that fails, try variables, object attributes and finally the literal text
+        print_unevaluated(expr, variables)
 
-        if operator in ["equals", "=="]:
-            return str(left) == str(right)
-        elif operator in ["notequals", "!="]:
-            return str(left) != str(right)
-        elif operator in ["greater", ">"]:
-            return left_num > right_num
-        elif operator in ["greaterequals", ">="]:
-            return left_num >= right_num
-        elif operator in ["less", "<"]:
-            return left_num < right_num
-        elif operator in ["lessequals", "<="]:
-            return left_num <= right_num
-        elif operator == "contains":
-            return str(right) in str(left)
-        elif operator == "in":
-            return str(left) in str(right)
-
-        return False
-
-    def call_function(func_name, args, scope, all_commands):
-        """Call a user-defined function"""
+    def resolve_iterable(token, variables):
+        """Resolve the iterable of a 'for VAR in EXPR' loop"""
+        iterable_value = resolve_value(token, variables)
+        if isinstance(iterable_value, str):
+            try:
+                return expressions.eval(iterable_value, {"__builtins__": None}, variables)
+            except:
+                return iterable_value
+        return iterable_value
+
+    def print_unevaluated(expr, variables):
+        """Print text that did not evaluate: a variable, an object attribute or a literal"""
+        if expr in variables:
+            write_line(variables[expr])
+            return
+
+        # Check object attributes
+        for obj in objects.values():
+            if obj.has_attr(expr):
+                write_line(obj.get_attr(expr))
+                return
+
+        # If all else fails, print as literal
+        write_line(expr)
+
+    compiled_conditions = program.conditions if program is not None else OrderedDict()
+
+    def condition_for(condition_tokens, line_num=None):
+        """The compiled form of a condition, compiled on first use"""
+        key = (line_num, *condition_tokens)
+        condition = compiled_conditions.get(key)
+        if condition is None:
+            condition = compile_condition(condition_tokens, line_num, source_line(line_num))
+            compiled_conditions[key] = condition
+            if len(compiled_conditions) > CONDITION_CACHE_SIZE:
+                compiled_conditions.popitem(last=False)
+        return condition
+
+    def evaluate_condition(condition_tokens, variables, line_num=None):
+        """Evaluate an if/while condition"""
+        return condition_for(condition_tokens, line_num)(variables)
+
+    call_depth = 0
+
+    def enter_call(line_num=None):
+        """Count a call starting, failing if it goes past the recursion limit"""
+        nonlocal call_depth
+        if call_depth >= recursion_limit:
+            raise recursion_limit_error(line_num)
+        call_depth += 1
+
+    def recursion_limit_error(line_num):
+        return CeronaError(
+            f"recursion limit exceeded ({recursion_limit} nested calls)",
+            line_num,
+            source_line(line_num)
+        )
+
+    def function_frame(func_name, args, scope):
+        """The frame for a call to a user-defined function"""
         if func_name not in functions:
             raise CeronaError(f"undefined function '{func_name}'")
 
@@ -229,25 +1169,16 @@ def ifs(lines, filename="<input>"):
             )
 
         # Create function scope
-        func_scope = scope.copy()
+        func_scope = call_scope(scope)
         for param, arg in zip(params, args):
             func_scope[param] = arg
 
-        # Execute function body
-        current_index = next((idx for idx, (ln, cmd) in enumerate(commands) if ln == func_line_num), -1)
-        endfunc_index = find_matching_end(commands, current_index, "func", "endfunc")
-
-        if endfunc_index != -1:
-            body_index = current_index + 1
-            while body_index < endfunc_index:
-                ln, cmd = commands[body_index]
-                skip = execute_single_command(ln, cmd, func_scope, commands)
-                if skip is not None:
-                    body_index += skip
-                body_index += 1
+        current_index = line_index[func_line_num]
+        return Frame(commands, current_index + 1, blocks[current_index][0], func_scope,
+                     func_line_num, is_call=True)
 
-    def call_method(obj, method_name, args, all_commands):
-        """Call a method on an object"""
+    def method_frame(obj, method_name, args):
+        """The frame for a call to a method on an object"""
         if method_name not in obj.class_def.methods:
             raise CeronaError(
                 f"method '{method_name}' not found in class '{obj.class_def.name}'"
@@ -261,35 +1192,328 @@ def ifs(lines, filename="<input>"):
             )
 
         # Create method scope with instance variables
-        method_scope = obj.instance_vars.copy()
-        method_scope.update(variables)
+        scope = method_scope(obj, variables)
 
         for param, arg in zip(params, args):
-            method_scope[param] = arg
-
-        # Execute method body
-        current_index = next((idx for idx, (ln, cmd) in enumerate(commands) if ln == func_line_num), -1)
-        endfunc_index = find_matching_end(commands, current_index, "func", "endfunc")
-
-        if endfunc_index != -1:
-            body_index = current_index + 1
-            while body_index < endfunc_index:
-                ln, cmd = commands[body_index]
-                skip = execute_single_command(ln, cmd, method_scope, commands)
-                if skip is not None:
-                    body_index += skip
-                body_index += 1
-
-        # Update instance variables from method scope
-        for key in obj.instance_vars.keys():
-            if key in method_scope:
-                obj.instance_vars[key] = method_scope[key]
-
-    def execute_single_command(line_num, i, variables, all_commands):
-        """Execute a single command - core interpreter logic"""
+            scope[param] = arg
+
+        current_index = line_index[func_line_num]
+        return Frame(commands, current_index + 1, blocks[current_index][0], scope,
+                     func_line_num, owner=obj, is_call=True)
+
+    def start_call(frame, stack, line_num=None):
+        """Begin a call; the tree walker pushes it onto stack, anything else runs it now"""
+        nonlocal call_depth
+        if stack is not None and engine == "tree":
+            if call_depth >= recursion_limit:
+                raise recursion_limit_error(line_num)
+            call_depth += 1
+            stack.append(frame)
+        else:
+            run_call(frame, line_num)
+
+    def run_call(frame, line_num=None):
+        """Run a function or method call to completion with the selected engine"""
+        nonlocal call_depth
+        if engine == "tree":
+            enter_call(line_num)
+            run_frames([frame])
+            return
+
+        enter_call(line_num)
+        try:
+            value = execute_range(frame.start, frame.end, frame.scope, frame.commands)
+        except FunctionReturn as returned:
+            value = returned.value
+        finally:
+            call_depth -= 1
+        finish_call(frame, value)
+
+    def finish_call(frame, value):
+        """Hand the result of a call that has ended back to whoever made it"""
+        if frame.owner is not None:
+            # Update instance variables from method scope
+            frame.owner.update_from(frame.scope)
+        if frame.on_return is not None:
+            frame.on_return(value)
+
+    def return_from(stack, value, line_num=None):
+        """The return statement: leave the innermost call on stack with value"""
+        nonlocal call_depth
+        while stack:
+            frame = stack.pop()
+            if frame.is_call:
+                call_depth -= 1
+                finish_call(frame, value)
+                return
+        raise CeronaError("return outside function", line_num, source_line(line_num))
+
+    def start_function(func_name, args, scope, stack, line_num=None, on_return=None):
+        """Call a user-defined function, going through its cache if it is a memo func"""
+        memo = memos.get(func_name)
+        if memo is not None:
+            key = memo.key(args)
+            if key is not None:
+                value = memo.lookup(key)
+                if value is not MISSING:
+                    if on_return is not None:
+                        on_return(value)
+                    return
+                on_return = remembering(memo, key, on_return)
+
+        frame = function_frame(func_name, args, scope)
+        frame.on_return = on_return
+        start_call(frame, stack, line_num)
+
+    def remembering(memo, key, on_return):
+        def remember(value):
+            memo.remember(key, value)
+            if on_return is not None:
+                on_return(value)
+        return remember
+
+    def start_method(obj, method_name, args, stack, line_num=None, on_return=None):
+        """Call a method on an object"""
+        frame = method_frame(obj, method_name, args)
+        frame.on_return = on_return
+        start_call(frame, stack, line_num)
+
+    def call_function(func_name, args, scope, all_commands, line_num=None):
+        """Call a user-defined function and return its result"""
+        returned = []
+        start_function(func_name, args, scope, None, line_num, returned.append)
+        return returned[0]
+
+    def call_method(obj, method_name, args, all_commands, line_num=None):
+        """Call a method on an object and return its result"""
+        returned = []
+        start_method(obj, method_name, args, None, line_num, returned.append)
+        return returned[0]
+
+    # --- TASKS AND CHANNELS (cerona.tasks) ---
+    scheduler = None
+
+    def tasks():
+        """The Scheduler of this run, made by its first spawn or channel"""
+        nonlocal scheduler
+        if scheduler is None:
+            from .tasks import Scheduler
+            scheduler = Scheduler()
+        return scheduler
+
+    def finish_tasks(failed=False):
+        """Wait for the tasks the run spawned before it ends"""
+        if scheduler is not None:
+            scheduler.finish(failed)
+
+    def spawn_task(name, call_tokens, scope, all_commands, line_num):
+        """Start "call_tokens[0] ARGS..." as a task and return its Task"""
+        target = call_tokens[0]
+        args = [resolve_value(arg, scope, line_num) for arg in call_tokens[1:]]
+        if "." in target:
+            obj_name, method_name = target.split(".", 1)
+            if obj_name not in objects:
+                raise CeronaError(f"undefined object '{obj_name}'", line_num, source_line(line_num))
+            obj = objects[obj_name]
+            return tasks().spawn(name, lambda: call_method(obj, method_name, args, all_commands, line_num))
+        if target not in functions:
+            raise CeronaError(f"undefined function '{target}'", line_num, source_line(line_num))
+        return tasks().spawn(name, lambda: call_function(target, args, scope, all_commands, line_num))
+
+    def task_variable(name, kind, scope, line_num):
+        """The Task or Channel (kind) in the variable name"""
+        value = scope.get(name)
+        if not isinstance(value, kind):
+            raise CeronaError(f"'{name}' is not a {kind.__name__.lower()}", line_num, source_line(line_num))
+        return value
+
+    # --- PARALLEL FOR (cerona.parallel) ---
+    def parallel_for(line_num, i, start, end, scope):
+        """Run cleaned[start:end] as the body of the parallel for on line_num"""
+        from .parallel import Loop, parse_header, run_parallel_for
+        try:
+            var_name, first, last, reductions = parse_header(i)
+        except ValueError as e:
+            raise CeronaError(str(e), line_num, source_line(line_num))
+        if stream:
+            raise CeronaError("parallel for cannot run in --stream mode", line_num, source_line(line_num))
+        try:
+            first = int(resolve_value(first, scope, line_num))
+            last = int(resolve_value(last, scope, line_num))
+        except ValueError:
+            raise CeronaError("for loop range bounds must be integers", line_num, source_line(line_num))
+        defined = {name: (params, func_line_num, name in memos)
+                   for name, (params, commands, func_line_num) in functions.items()
+                   if commands is cleaned}
+        run_parallel_for(Loop(var_name, start, end, reductions), first, last, scope, defined,
+                         "\n".join(original_lines), filename, engine, recursion_limit, output, directory,
+                         {name: class_def.line_num for name, class_def in classes.items()}, objects)
+
+    def run_chunk(defined, defined_classes, object_states, loop, first, last):
+        """The body of a parallel for, for one chunk of its range (see _interpret)"""
+        from .parallel import reduce_into
+        for name, (params, func_line_num, memo) in defined.items():
+            functions[name] = (params, cleaned, func_line_num)
+            if memo:
+                memos[name] = MemoCache()
+        for class_line_num in defined_classes.values():
+            # Run the class statement again, which defines the class just as it did
+            execute_single_command(class_line_num, cleaned[line_index[class_line_num]][1], variables, cleaned)
+        for name, (class_name, instance_vars) in object_states.items():
+            if class_name in classes:
+                objects[name] = CeronaObject(classes[class_name], instance_vars)
+        # Whatever the engine, the body runs as closures; calls go through the engine
+        body = compile_block(loop.start, loop.end)
+        reductions = loop.reductions
+        partials = {}
+        for value in range(first, last):
+            for kind, name in reductions:
+                variables.pop(name, None)
+            variables[loop.var] = value
+            try:
+                run_block(body, variables)
+            except FunctionReturn as returned:
+                raise CeronaError("return outside function", returned.line_num, source_line(returned.line_num))
+            for kind, name in reductions:
+                if name in variables:
+                    reduce_into(partials, kind, name, variables[name])
+        return partials
+
+    def call_statement(i, variables, stack, line_num, on_return=None):
+        """A "call NAME ARGS..." statement; on_return gets the result"""
+        if len(i) < 2:
+            raise CeronaError(
+                "call requires function name",
+                line_num,
+                source_line(line_num)
+            )
+
+        # Check if it's a method call (obj.method)
+        if "." in i[1]:
+            obj_name, method_name = i[1].split(".", 1)
+
+            if obj_name not in objects:
+                raise CeronaError(
+                    f"undefined object '{obj_name}'",
+                    line_num,
+                    source_line(line_num)
+                )
+
+            args = [resolve_value(arg, variables, line_num) for arg in i[2:]]
+            start_method(objects[obj_name], method_name, args, stack, line_num, on_return)
+        else:
+            # Regular function call
+            args = [resolve_value(arg, variables, line_num) for arg in i[2:]]
+            start_function(i[1], args, variables, stack, line_num, on_return)
+
+    def run_frames(stack, slice_size=0):
+        """
+        Run the frames on stack, and every frame they push, until it is empty.
+
+        With a slice_size, return True once about that many statements
+        (or loop iterations) have run instead. The stack then holds where
+        the program got to, and running it again carries on from there;
+        so does an InputNeeded raised by input.
+        """
+        nonlocal call_depth
+        countdown = slice_size or sys.maxsize
+        while stack:
+            frame = stack[-1]
+            commands = frame.commands
+            program = frame.program
+            scope = frame.scope
+            end = frame.end
+            repeat = frame.repeat
+            index = frame.index
+            while True:
+                while index < end:
+                    line_num, cmd = commands[index]
+                    index += 1
+                    try:
+                        skip = execute_single_command(line_num, cmd, scope, program, stack)
+                    except InputNeeded:
+                        # Run the input statement again once the line is there
+                        frame.index = index - 1
+                        raise
+                    if skip is not None:
+                        index += skip
+                    countdown -= 1
+                    if not stack or stack[-1] is not frame:
+                        break
+                    if countdown <= 0:
+                        frame.index = index
+                        return True
+                else:
+                    if repeat is not None:
+                        try:
+                            again = repeat()
+                        except CeronaError:
+                            raise
+                        except Exception as e:
+                            raise CeronaError(f"runtime error: {str(e)}", frame.line_num,
+                                              source_line(frame.line_num))
+                        if again:
+                            index = frame.start
+                            countdown -= 1
+                            if countdown <= 0:
+                                frame.index = index
+                                return True
+                            continue
+                    # The body is done
+                    stack.pop()
+                    if frame.is_call:
+                        call_depth -= 1
+                        if frame.owner is not None:
+                            # Update instance variables from method scope
+                            frame.owner.update_from(scope)
+                        if frame.on_return is not None:
+                            frame.on_return(None)
+                    break
+                # Run the block or call the statement started first
+                frame.index = index
+                break
+
+    def execute_range(start, end, scope, commands):
+        """
+        Execute commands[start:end] with the selected engine. A python
+        engine function body returns its result; the other engines hand
+        results back through Frame.on_return or FunctionReturn.
+        """
+        if engine == "closure":
+            run_block(compile_block(start, end), scope)
+            return
+
+        if engine == "python":
+            try:
+                return python_bodies[start](scope)
+            except CeronaError:
+                raise
+            except RecursionError as e:
+                raise python_stack_exhausted(python_error_line(e))
+            except Exception as e:
+                line_num = python_error_line(e)
+                raise CeronaError(f"runtime error: {str(e)}", line_num, source_line(line_num))
+            return
+
+        run_frames([Frame(commands, start, end, scope)])
+
+    def execute_single_command(line_num, i, variables, all_commands, stack=None):
+        """
+        Execute a single command - core interpreter logic.
+
+        Blocks and calls are not run here: their frame is pushed onto
+        stack for run_frames. Without a stack (the other engines falling
+        back to this function) the command runs to completion.
+        """
         if not i:
             return
 
+        if stack is None:
+            stack = []
+            skip = execute_single_command(line_num, i, variables, all_commands, stack)
+            run_frames(stack)
+            return skip
+
         try:
             # --- SET VARIABLE ---
             if i[0] == "set":
@@ -301,22 +1525,21 @@ def ifs(lines, filename="<input>"):
                     )
 
                 var_name = i[1]
+                if i[2] == "call" and len(i) >= 4:
+                    # set VAR call NAME ARGS...: store what the function returns
+                    def store(value):
+                        variables[var_name] = value
+                    call_statement(i[2:], variables, stack, line_num, store)
+                    return
+
                 expr = " ".join(i[2:])
 
                 # Try to evaluate as expression
                 try:
-                    variables[var_name] = eval(expr, {"__builtins__": None}, variables)
+                    variables[var_name] = expressions.eval(expr, {"__builtins__": None}, variables)
                 except:
                     # If eval fails, try to resolve and then store
-                    resolved = resolve_value(expr, variables, line_num)
-                    # Check if resolved value is a string that looks like an expression
-                    if isinstance(resolved, str) and any(op in resolved for op in ['+', '-', '*', '/', '%']):
-                        try:
-                            variables[var_name] = eval(resolved, {"__builtins__": None}, variables)
-                        except:
-                            variables[var_name] = resolved
-                    else:
-                        variables[var_name] = resolved
+                    store_resolved(var_name, expr, variables, line_num)
 
             # Replace the print section in execute_single_command (around line 281)
 
@@ -326,29 +1549,7 @@ def ifs(lines, filename="<input>"):
                     raise CeronaError("print requires at least one argument", line_num)
 
                 # Join all tokens after "print"
-                expr = " ".join(i[1:])
-    
-                # First, try to evaluate as expression with current scope
-                try:
-                    result = eval(expr,  variables)
-                    print(result)
-                    return
-                except:
-                    pass
-    
-                # If that fails, try direct variable lookup
-                if expr in variables:
-                    print(variables[expr])
-                    return
-    
-                # Check object attributes
-                for obj in objects.values():
-                    if expr in obj.instance_vars:
-                        print(obj.instance_vars[expr])
-                        return
-    
-                # If all else fails, print as literal
-                print(expr)
+                print_expression(" ".join(i[1:]), variables)
             # --- CLASS DEFINITION ---
             elif i[0] == "class":
                 if len(i) < 2:
@@ -359,8 +1560,8 @@ def ifs(lines, filename="<input>"):
                     )
 
                 class_name = i[1]
-                current_index = next((idx for idx, (ln, cmd) in enumerate(all_commands) if ln == line_num), -1)
-                endclass_index = find_matching_end(all_commands, current_index, "class", "endclass")
+                current_index = line_index[line_num]
+                endclass_index = blocks[current_index][0] if current_index in blocks else -1
 
                 if endclass_index == -1:
                     raise CeronaError(
@@ -383,10 +1584,17 @@ def ifs(lines, filename="<input>"):
                             attr_name = cmd[1]
                             attr_value = " ".join(cmd[2:])
                             try:
-                                attributes[attr_name] = eval(attr_value, {"__builtins__": None}, {})
+                                attributes[attr_name] = expressions.eval(attr_value, {"__builtins__": None}, {})
                             except:
                                 attributes[attr_name] = attr_value
 
+                    elif cmd[0] == "memo":
+                        raise CeronaError(
+                            "memo func is not supported for methods",
+                            ln,
+                            original_lines[ln - 1] if ln <= len(original_lines) else None
+                        )
+
                     elif cmd[0] == "func":
                         # Class method
                         if len(cmd) < 2:
@@ -400,7 +1608,7 @@ def ifs(lines, filename="<input>"):
                         params = cmd[2:]
 
                         # Find matching endfunc
-                        endfunc_index = find_matching_end(all_commands, class_index, "func", "endfunc")
+                        endfunc_index = blocks[class_index][0] if class_index in blocks else -1
                         if endfunc_index == -1:
                             raise CeronaError(
                                 f"missing 'endfunc' for method '{method_name}'",
@@ -442,15 +1650,24 @@ def ifs(lines, filename="<input>"):
                 class_def = classes[class_name]
 
                 # Create instance with default attributes
-                obj = CeronaObject(class_def, class_def.attributes)
+                obj = CeronaObject(class_def)
                 objects[instance_name] = obj
 
                 # Call init method if it exists
                 if "init" in class_def.methods:
-                    call_method(obj, "init", args, all_commands)
+                    start_call(method_frame(obj, "init", args), stack, line_num)
 
             # --- FUNCTION DEFINITIONS ---
-            elif i[0] == "func":
+            elif i[0] == "func" or i[0] == "memo":
+                memo = i[0] == "memo"
+                if memo:
+                    if len(i) < 2 or i[1] != "func":
+                        raise CeronaError(
+                            "memo must be followed by func NAME",
+                            line_num,
+                            original_lines[line_num - 1] if line_num <= len(original_lines) else None
+                        )
+                    i = i[1:]
                 if len(i) < 2:
                     raise CeronaError(
                         "func requires function name",
@@ -459,13 +1676,17 @@ def ifs(lines, filename="<input>"):
                     )
                 func_name = i[1]
                 params = i[2:]
-                current_index = next((idx for idx, (ln, cmd) in enumerate(all_commands) if ln == line_num), -1)
+                current_index = line_index.get(line_num, -1)
                 if current_index == -1:
                     raise CeronaError("internal error: could not find current command", line_num)
 
-                endfunc_index = find_matching_end(all_commands, current_index, "func", "endfunc")
+                endfunc_index = blocks[current_index][0] if current_index in blocks else -1
                 if endfunc_index != -1:
                     functions[func_name] = (params, all_commands, line_num)
+                    if memo:
+                        memos[func_name] = MemoCache()
+                    else:
+                        memos.pop(func_name, None)
                     return endfunc_index - current_index
                 else:
                     raise CeronaError(
@@ -475,33 +1696,28 @@ def ifs(lines, filename="<input>"):
                     )
 
             elif i[0] == "call":
+                call_statement(i, variables, stack, line_num)
+
+            # --- RETURN FROM A FUNCTION OR METHOD ---
+            elif i[0] == "return":
+                value = value_of(" ".join(i[1:]), variables, line_num) if len(i) > 1 else None
+                return_from(stack, value, line_num)
+
+            # --- MEMO STATISTICS ---
+            elif i[0] == "memostats":
                 if len(i) < 2:
                     raise CeronaError(
-                        "call requires function name",
+                        "memostats requires function name",
                         line_num,
                         original_lines[line_num - 1] if line_num <= len(original_lines) else None
                     )
-
-                # Check if it's a method call (obj.method)
-                if "." in i[1]:
-                    parts = i[1].split(".", 1)
-                    obj_name = parts[0]
-                    method_name = parts[1]
-
-                    if obj_name not in objects:
-                        raise CeronaError(
-                            f"undefined object '{obj_name}'",
-                            line_num,
-                            original_lines[line_num - 1] if line_num <= len(original_lines) else None
-                        )
-
-                    args = [resolve_value(arg, variables, line_num) for arg in i[2:]]
-                    call_method(objects[obj_name], method_name, args, all_commands)
-                else:
-                    # Regular function call
-                    func_name = i[1]
-                    args = [resolve_value(arg, variables, line_num) for arg in i[2:]]
-                    call_function(func_name, args, variables, all_commands)
+                if i[1] not in memos:
+                    raise CeronaError(
+                        f"'{i[1]}' is not a memo func",
+                        line_num,
+                        original_lines[line_num - 1] if line_num <= len(original_lines) else None
+                    )
+                write_line(memos[i[1]].stats(i[1]))
 
             # --- CONTROL FLOW: IF STATEMENTS ---
             elif i[0] == "if":
@@ -510,27 +1726,19 @@ def ifs(lines, filename="<input>"):
                     condition_tokens = i[1:then_index]
                     command_tokens = i[then_index + 1:]
                     if evaluate_condition(condition_tokens, variables, line_num):
-                        for cmd in " ".join(command_tokens).split(";"):
-                            cmd_tokens = parse_line(cmd.strip(), line_num)
-                            execute_single_command(line_num, cmd_tokens, variables, all_commands)
+                        inline = [(line_num, parse_line(cmd.strip(), line_num, original_lines))
+                                  for cmd in " ".join(command_tokens).split(";")]
+                        if len(inline) == 1:
+                            execute_single_command(line_num, inline[0][1], variables, all_commands, stack)
+                        else:
+                            # The commands run as a block of their own, so an input among
+                            # them that has to wait for its line (InputNeeded) runs again
+                            # alone, not with the condition and the commands before it
+                            stack.append(Frame(inline, 0, len(inline), variables, line_num,
+                                               program=all_commands))
                 else:
-                    current_index = next((idx for idx, (ln, cmd) in enumerate(all_commands) if ln == line_num), -1)
-                    else_index = None
-                    endif_index = None
-                    depth = 1
-                    search_index = current_index + 1
-
-                    while search_index < len(all_commands) and depth > 0:
-                        ln, cmd = all_commands[search_index]
-                        if cmd and cmd[0] == "if":
-                            depth += 1
-                        elif cmd and cmd[0] == "endif":
-                            depth -= 1
-                            if depth == 0:
-                                endif_index = search_index
-                        elif cmd and cmd[0] == "else" and depth == 1:
-                            else_index = search_index
-                        search_index += 1
+                    current_index = line_index[line_num]
+                    endif_index, else_index = blocks.get(current_index, (-1, None))
 
                     if endif_index == -1:
                         raise CeronaError(
@@ -544,28 +1752,16 @@ def ifs(lines, filename="<input>"):
 
                     if condition_met:
                         end_of_block = else_index if else_index else endif_index
-                        block_index = current_index + 1
-                        while block_index < end_of_block:
-                            ln, cmd = all_commands[block_index]
-                            skip = execute_single_command(ln, cmd, variables, all_commands)
-                            if skip is not None:
-                                block_index += skip
-                            block_index += 1
+                        stack.append(Frame(all_commands, current_index + 1, end_of_block, variables, line_num))
                     elif else_index is not None:
-                        block_index = else_index + 1
-                        while block_index < endif_index:
-                            ln, cmd = all_commands[block_index]
-                            skip = execute_single_command(ln, cmd, variables, all_commands)
-                            if skip is not None:
-                                block_index += skip
-                            block_index += 1
+                        stack.append(Frame(all_commands, else_index + 1, endif_index, variables, line_num))
 
                     return endif_index - current_index
 
             # --- WHILE LOOP ---
             elif i[0] == "while":
-                current_index = next((idx for idx, (ln, cmd) in enumerate(all_commands) if ln == line_num), -1)
-                endwhile_index = find_matching_end(all_commands, current_index, "while", "endwhile")
+                current_index = line_index[line_num]
+                endwhile_index = blocks[current_index][0] if current_index in blocks else -1
 
                 if endwhile_index == -1:
                     raise CeronaError(
@@ -576,21 +1772,17 @@ def ifs(lines, filename="<input>"):
 
                 condition_tokens = i[1:]
 
-                while evaluate_condition(condition_tokens, variables, line_num):
-                    loop_index = current_index + 1
-                    while loop_index < endwhile_index:
-                        ln, cmd = all_commands[loop_index]
-                        skip = execute_single_command(ln, cmd, variables, all_commands)
-                        if skip is not None:
-                            loop_index += skip
-                        loop_index += 1
+                condition = condition_for(condition_tokens, line_num)
+                if condition(variables):
+                    stack.append(Frame(all_commands, current_index + 1, endwhile_index, variables, line_num,
+                                       repeat=lambda: condition(variables)))
 
                 return endwhile_index - current_index
 
             # --- FOR LOOP ---
             elif i[0] == "for":
-                current_index = next((idx for idx, (ln, cmd) in enumerate(all_commands) if ln == line_num), -1)
-                endfor_index = find_matching_end(all_commands, current_index, "for", "endfor")
+                current_index = line_index[line_num]
+                endfor_index = blocks[current_index][0] if current_index in blocks else -1
 
                 if endfor_index == -1:
                     raise CeronaError(
@@ -620,14 +1812,7 @@ def ifs(lines, filename="<input>"):
                             original_lines[line_num - 1] if line_num <= len(original_lines) else None
                         )
                 elif len(i) == 4:
-                    iterable_value = resolve_value(i[3], variables, line_num)
-                    if isinstance(iterable_value, str):
-                        try:
-                            iterable = eval(iterable_value, {"__builtins__": None}, variables)
-                        except:
-                            iterable = iterable_value
-                    else:
-                        iterable = iterable_value
+                    iterable = resolve_iterable(i[3], variables)
                 else:
                     raise CeronaError(
                         "invalid for loop syntax",
@@ -635,15 +1820,17 @@ def ifs(lines, filename="<input>"):
                         original_lines[line_num - 1] if line_num <= len(original_lines) else None
                     )
 
-                for value in iterable:
-                    variables[var_name] = value
-                    loop_index = current_index + 1
-                    while loop_index < endfor_index:
-                        ln, cmd = all_commands[loop_index]
-                        skip = execute_single_command(ln, cmd, variables, all_commands)
-                        if skip is not None:
-                            loop_index += skip
-                        loop_index += 1
+                values = iter(iterable)
+
+                def next_value():
+                    for value in values:
+                        variables[var_name] = value
+                        return True
+                    return False
+
+                if next_value():
+                    stack.append(Frame(all_commands, current_index + 1, endfor_index, variables, line_num,
+                                       repeat=next_value))
 
                 return endfor_index - current_index
 
@@ -655,14 +1842,96 @@ def ifs(lines, filename="<input>"):
                         original_lines[line_num - 1] if line_num <= len(original_lines) else None
                     )
                 prompt = " ".join(i[2:]) if len(i) > 2 else ""
-                variables[i[1]] = input(prompt)
+                if scheduler is None:
+                    variables[i[1]] = read_input(prompt, output, stdin)
+                else:
+                    # The other tasks run while this one waits for the line
+                    variables[i[1]] = scheduler.read_input(prompt, output, stdin)
+
+            # --- PARALLEL FOR LOOP (cerona.parallel) ---
+            elif i[0] == "parallel":
+                current_index = line_index[line_num]
+                if current_index not in blocks:
+                    raise CeronaError(
+                        "missing 'endfor' for for loop",
+                        line_num,
+                        original_lines[line_num - 1] if line_num <= len(original_lines) else None
+                    )
+                endfor_index = blocks[current_index][0]
+                parallel_for(line_num, i, current_index + 1, endfor_index, variables)
+                return endfor_index - current_index
+
+            # --- LISTS AND MAPS ---
+            elif i[0] in COLLECTION_COMMANDS:
+                try:
+                    operation, value_exprs, target = collection_syntax(i)
+                except ValueError as e:
+                    raise CeronaError(
+                        str(e),
+                        line_num,
+                        original_lines[line_num - 1] if line_num <= len(original_lines) else None
+                    )
+                values = [value_of(expr, variables, line_num) for expr in value_exprs]
+                run_collection(operation, i[1], target, values, variables)
+
+            # --- TASKS AND CHANNELS ---
+            elif i[0] == "spawn":
+                if len(i) < 4 or i[2] != "call":
+                    raise CeronaError(
+                        "invalid spawn syntax (expected: spawn NAME call FUNC ARGS...)",
+                        line_num,
+                        original_lines[line_num - 1] if line_num <= len(original_lines) else None
+                    )
+                variables[i[1]] = spawn_task(i[1], i[3:], variables, all_commands, line_num)
+
+            elif i[0] == "join":
+                if len(i) != 2:
+                    raise CeronaError(
+                        "join requires task name",
+                        line_num,
+                        original_lines[line_num - 1] if line_num <= len(original_lines) else None
+                    )
+                from .tasks import Task
+                variables[i[1]] = tasks().join(task_variable(i[1], Task, variables, line_num))
+
+            elif i[0] == "channel":
+                if len(i) not in (2, 3):
+                    raise CeronaError(
+                        "channel requires channel name and optional capacity",
+                        line_num,
+                        original_lines[line_num - 1] if line_num <= len(original_lines) else None
+                    )
+                from .tasks import CHANNEL_CAPACITY, Channel
+                capacity = int(resolve_value(i[2], variables, line_num)) if len(i) == 3 else CHANNEL_CAPACITY
+                variables[i[1]] = Channel(tasks(), i[1], capacity)
+
+            elif i[0] == "send":
+                if len(i) < 3:
+                    raise CeronaError(
+                        "send requires channel name and value",
+                        line_num,
+                        original_lines[line_num - 1] if line_num <= len(original_lines) else None
+                    )
+                from .tasks import Channel
+                channel = task_variable(i[1], Channel, variables, line_num)
+                channel.send(value_of(" ".join(i[2:]), variables, line_num))
+
+            elif i[0] == "recv":
+                if len(i) != 3:
+                    raise CeronaError(
+                        "recv requires channel name and variable name",
+                        line_num,
+                        original_lines[line_num - 1] if line_num <= len(original_lines) else None
+                    )
+                from .tasks import Channel
+                variables[i[2]] = task_variable(i[1], Channel, variables, line_num).recv()
 
             # --- UNKNOWN COMMAND ---
             else:
                 expr = " ".join(i)
                 try:
-                    result = eval(expr, {"__builtins__": None}, variables)
-                    print(result)
+                    result = expressions.eval(expr, {"__builtins__": None}, variables)
+                    write_line(result)
                 except Exception:
                     raise CeronaError(
                         f"unknown command '{i[0]}'",
@@ -679,43 +1948,562 @@ def ifs(lines, filename="<input>"):
                 original_lines[line_num - 1] if line_num <= len(original_lines) else None
             )
 
-    # --- PARSE LINES WITH LINE NUMBERS ---
-    cleaned = []
-    for line_num, line in enumerate(original_lines, start=1):
-        stripped = line.strip()
-        if stripped:
+    # --- CLOSURE ENGINE ---
+    compiled_blocks = {}
+
+    def source_line(line_num):
+        return original_lines[line_num - 1] if line_num and line_num <= len(original_lines) else None
+
+    def run_block(body, scope):
+        """Run compiled (line_num, closure) pairs, reporting errors like the tree walker"""
+        line_num = None
+        try:
+            for line_num, node in body:
+                node(scope)
+        except (CeronaError, FunctionReturn):
+            raise
+        except RecursionError:
+            raise python_stack_exhausted(line_num)
+        except Exception as e:
+            raise CeronaError(f"runtime error: {str(e)}", line_num, source_line(line_num))
+
+    def python_stack_exhausted(line_num):
+        """The error for running out of Python stack in the closure or python engine"""
+        return CeronaError(
+            f"recursion too deep for the {engine} engine (the tree and vm engines allow "
+            f"{recursion_limit} nested calls)",
+            line_num,
+            source_line(line_num)
+        )
+
+    def compile_block(start, end):
+        """Compile cleaned[start:end] into a tuple of (line_num, closure) pairs"""
+        key = (start, end)
+        if key in compiled_blocks:
+            return compiled_blocks[key]
+
+        body = []
+        index = start
+        while index < end:
+            line_num, cmd = cleaned[index]
+            body.append((line_num, compile_command(index, line_num, cmd)))
+            # Block openers compile their own body, continue after the terminator
+            index = blocks[index][0] + 1 if index in blocks else index + 1
+
+        body = tuple(body)
+        compiled_blocks[key] = body
+        return body
+
+    def compile_expression(expr):
+        try:
+            return expressions.compile(expr)
+        except (SyntaxError, ValueError):
+            return None
+
+    def compile_command(index, line_num, i):
+        """
+        Compile one statement into a closure taking the current scope.
+
+        Malformed statements and commands without a specialized form fall
+        back to execute_single_command, so errors surface at the same time
+        and with the same message as in the tree walker.
+        """
+        keyword = i[0]
+        is_block = index is not None and index in blocks
+
+        if keyword == "set" and len(i) >= 4 and i[2] == "call":
+            var_name = i[1]
+            call = compile_call(line_num, i[2:])
+
+            def set_call(scope):
+                scope[var_name] = call(scope)
+            return set_call
+
+        if keyword == "return":
+            if len(i) == 1:
+                def return_nothing(scope):
+                    raise FunctionReturn(None, line_num)
+                return return_nothing
+
+            expr = " ".join(i[1:])
+            code = compile_expression(expr)
+            sandbox = {"__builtins__": None}
+
+            def return_value(scope):
+                try:
+                    value = eval(code, sandbox, scope)
+                except Exception:
+                    value = resolved_value(expr, scope, line_num)
+                raise FunctionReturn(value, line_num)
+            return return_value
+
+        if keyword in COLLECTION_COMMANDS and len(i) >= 2:
             try:
-                tokens = parse_line(stripped, line_num)
-                if tokens:
-                    cleaned.append((line_num, tokens))
-            except CeronaError as e:
-                print(f"{filename}:{e}", file=sys.stderr)
-                sys.exit(1)
+                operation, value_exprs, target = collection_syntax(i)
+            except ValueError:
+                # Reported by the fallback when the statement runs
+                value_exprs = None
+            if value_exprs is not None:
+                name = i[1]
+                values = [compile_value(expr) for expr in value_exprs]
+
+                def collection(scope):
+                    run_collection(operation, name, target, [value(scope) for value in values], scope)
+                return collection
+
+        if keyword == "set" and len(i) >= 3:
+            var_name = i[1]
+            expr = " ".join(i[2:])
+            code = compile_expression(expr)
+
+            def set_literal(scope):
+                store_resolved(var_name, expr, scope, line_num)
+
+            if code is None:
+                return set_literal
+
+            if not code.co_names:
+                # No names involved: immutable results can be computed once
+                try:
+                    value = eval(code, {"__builtins__": None})
+                except Exception:
+                    return set_literal
+                if isinstance(value, (int, float, complex, str, bool, type(None))):
+                    def set_constant(scope):
+                        scope[var_name] = value
+                    return set_constant
+
+            sandbox = {"__builtins__": None}
+
+            def set_expression(scope):
+                try:
+                    scope[var_name] = eval(code, sandbox, scope)
+                except Exception:
+                    store_resolved(var_name, expr, scope, line_num)
+            return set_expression
+
+        if keyword == "print" and len(i) >= 2:
+            expr = " ".join(i[1:])
+            code = compile_expression(expr)
+
+            def print_literal(scope):
+                print_unevaluated(expr, scope)
+
+            if code is None:
+                return print_literal
+
+            def print_compiled(scope):
+                try:
+                    write_line(eval(code, eval_globals(code, scope)))
+                except Exception:
+                    print_unevaluated(expr, scope)
+            return print_compiled
+
+        if keyword == "call" and len(i) >= 2:
+            return compile_call(line_num, i)
+
+        if keyword == "if" and "then" in i:
+            then_index = i.index("then")
+            condition_tokens = i[1:then_index]
+            try:
+                commands = [parse_line(cmd.strip(), line_num, original_lines)
+                            for cmd in " ".join(i[then_index + 1:]).split(";")]
+            except CeronaError:
+                commands = None
+
+            if commands is not None:
+                nodes = tuple(compile_command(None, line_num, cmd) for cmd in commands if cmd)
+                condition = compile_condition(condition_tokens, line_num, source_line(line_num))
+
+                def inline_if(scope):
+                    if condition(scope):
+                        for node in nodes:
+                            node(scope)
+                return inline_if
+
+        elif keyword == "if" and is_block:
+            endif_index, else_index = blocks[index]
+            condition_tokens = i[1:]
+            then_body = compile_block(index + 1, else_index if else_index else endif_index)
+            else_body = compile_block(else_index + 1, endif_index) if else_index is not None else ()
+
+            condition = compile_condition(condition_tokens, line_num, source_line(line_num))
+
+            def if_block(scope):
+                if condition(scope):
+                    run_block(then_body, scope)
+                elif else_body:
+                    run_block(else_body, scope)
+            return if_block
+
+        elif keyword == "while" and is_block:
+            condition_tokens = i[1:]
+            body = compile_block(index + 1, blocks[index][0])
+
+            condition = compile_condition(condition_tokens, line_num, source_line(line_num))
+
+            def while_loop(scope):
+                while condition(scope):
+                    run_block(body, scope)
+            return while_loop
+
+        elif keyword == "for" and is_block and len(i) in (4, 5) and i[2] == "in":
+            var_name = i[1]
+            body = compile_block(index + 1, blocks[index][0])
+
+            if len(i) == 5:
+                def iterate(scope):
+                    try:
+                        start = int(resolve_value(i[3], scope, line_num))
+                        end = int(resolve_value(i[4], scope, line_num))
+                    except ValueError:
+                        raise CeronaError(
+                            "for loop range bounds must be integers",
+                            line_num,
+                            source_line(line_num)
+                        )
+                    return range(start, end)
+            else:
+                def iterate(scope):
+                    return resolve_iterable(i[3], scope)
+
+            def for_loop(scope):
+                for value in iterate(scope):
+                    scope[var_name] = value
+                    run_block(body, scope)
+            return for_loop
+
+        def fallback(scope):
+            execute_single_command(line_num, i, scope, cleaned)
+        return fallback
+
+    def compile_value(expr, line_num=None):
+        """Compile what value_of does for expr into a function of the scope"""
+        code = compile_expression(expr)
+        sandbox = {"__builtins__": None}
+        if code is None:
+            return lambda scope: resolved_value(expr, scope, line_num)
+
+        def value(scope):
+            try:
+                return eval(code, sandbox, scope)
+            except Exception:
+                return resolved_value(expr, scope, line_num)
+        return value
+
+    def compile_call(line_num, i):
+        """Compile "call NAME ARGS..." into a function of the scope returning the result"""
+        arg_tokens = i[2:]
+
+        if "." in i[1]:
+            obj_name, method_name = i[1].split(".", 1)
+
+            def call_method_node(scope):
+                if obj_name not in objects:
+                    raise CeronaError(f"undefined object '{obj_name}'", line_num, source_line(line_num))
+                args = [resolve_value(arg, scope, line_num) for arg in arg_tokens]
+                return call_method(objects[obj_name], method_name, args, cleaned, line_num)
+            return call_method_node
+
+        func_name = i[1]
+
+        def call_function_node(scope):
+            args = [resolve_value(arg, scope, line_num) for arg in arg_tokens]
+            return call_function(func_name, args, scope, cleaned, line_num)
+        return call_function_node
+
+    # --- PYTHON ENGINE ---
+    python_bodies = {}
+    python_line_map = []
+    python_filename = f"<cerona-python {filename}>"
+
+    def python_error_line(error):
+        """Cerona line of the innermost generated-code frame in error's traceback"""
+        line_num = None
+        tb = error.__traceback__
+        while tb is not None:
+            if tb.tb_frame.f_code.co_filename == python_filename:
+                line_num = python_line_map[tb.tb_lineno - 1]
+            tb = tb.tb_next
+        return line_num
+
+    def call_method_on(obj_name, method_name, args, line_num):
+        if obj_name not in objects:
+            raise CeronaError(f"undefined object '{obj_name}'", line_num, source_line(line_num))
+        return call_method(objects[obj_name], method_name, args, cleaned, line_num)
+
+    def load_python_engine():
+        """Translate the program to Python and compile it once"""
+        compiled = program.compiled.get("python") if program is not None else None
+        if compiled is None:
+            from .transpiler import transpile
+
+            source, line_map = transpile(cleaned, blocks, original_lines, filename)
+            compiled = compile(source, python_filename, "exec"), line_map
+            if program is not None:
+                program.compiled["python"] = compiled
+        code, line_map = compiled
+        python_line_map.extend(line_map)
+        namespace = {
+            "_store": lambda v, name, expr, line_num: store_resolved(name, expr, v, line_num),
+            "_resolved": lambda v, expr, line_num: resolved_value(expr, v, line_num),
+            "_print": lambda v, expr: print_expression(expr, v),
+            "_condition": lambda v, tokens, line_num: evaluate_condition(tokens, v, line_num),
+            "_num": coerce_number,
+            "_eval": lambda expr, v: expressions.eval(expr, {"__builtins__": None}, v),
+            "_iterable": lambda v, token, line_num: resolve_iterable(token, v),
+            "_range_error": lambda line_num: CeronaError(
+                "for loop range bounds must be integers", line_num, source_line(line_num)),
+            "_call": lambda name, args, v: call_function(name, args, v, cleaned),
+            "_call_method": call_method_on,
+            "_collection": run_collection,
+            "_exec": lambda line_num, tokens, v: execute_single_command(line_num, tokens, v, cleaned),
+        }
+        exec(code, namespace)
+        python_bodies.update(namespace["BODIES"])
+
+    def run_top_level(start, end):
+        """Run statements of the program itself, where return has no function to leave"""
+        try:
+            execute_range(start, end, variables, cleaned)
+        except FunctionReturn as returned:
+            raise CeronaError("return outside function", returned.line_num, source_line(returned.line_num))
+
+    # --- STREAMING ---
+    def flushing_between(source):
+        """The lines of source, flushing the output before waiting for each next one"""
+        for line in source:
+            yield line
+            output.flush()
+
+    def run_stream(source):
+        """Read, resolve and run source one top-level statement at a time"""
+        nonlocal original_lines, cleaned, line_index, blocks
+        from .stream import SourceWindow, read_statements, is_simple, defines_code, may_wait
+
+        # cleaned becomes a dict from position to statement holding only
+        # what is still needed: the statement running now and the bodies
+        # of functions and classes
+        original_lines = SourceWindow()
+        cleaned = {}
+        line_index = {}
+        blocks = {}
+        start = 0
+        if may_wait(source):
+            # A pipe or a generator may make us wait for the next line, so
+            # whatever the program printed so far goes out first
+            source = flushing_between(source)
+        for statement in read_statements(source, original_lines):
+            if is_simple(statement):
+                # Most lines of a long script: nothing to resolve or keep
+                cleaned[start] = statement[0]
+                run_top_level(start, start + 1)
+                del cleaned[start]
+                compiled_blocks.pop((start, start + 1), None)
+                original_lines.forget(statement[0][0])
+                start += 1
+                continue
+
+            end = start + len(statement)
+            statement_index, statement_blocks = build_block_table(statement, original_lines, start)
+            cleaned.update(zip(range(start, end), statement))
+            line_index.update(statement_index)
+            blocks.update(statement_blocks)
+
+            run_top_level(start, end)
+
+            if not defines_code(statement):
+                for index, (line_num, cmd) in enumerate(statement, start):
+                    del cleaned[index]
+                    del line_index[line_num]
+                    blocks.pop(index, None)
+                    original_lines.forget(line_num)
+                for key in [key for key in compiled_blocks if start <= key[0] < end]:
+                    del compiled_blocks[key]
+            start = end
+
+    if stream:
+        try:
+            run_stream(lines)
+        except BaseException:
+            finish_tasks(failed=True)
+            raise
+        finish_tasks()
+        return variables
+
+    # --- PARSE LINES AND RESOLVE BLOCK STRUCTURE ONCE ---
+    if program is not None:
+        original_lines, cleaned, line_index, blocks = program.parsed
+    else:
+        # Files go through the on-disk cache of parsed programs (cerona.cache);
+        # original_lines are kept for error reporting
+        from .cache import load_program
+        original_lines, cleaned, line_index, blocks = load_program(lines, filename)
+
+    if engine == "python":
+        load_python_engine()
+
+    if chunk is not None:
+        # --- RUN A CHUNK OF A PARALLEL FOR (cerona.parallel) ---
+        try:
+            partials = run_chunk(*chunk)
+        except BaseException:
+            finish_tasks(failed=True)
+            raise
+        finish_tasks()
+        return partials
+
+    if slice_size:
+        # --- RUN A SLICE AT A TIME (Program.run_async) ---
+        if engine != "tree":
+            raise ValueError(f"engine '{engine}' cannot run in slices (only the tree engine can)")
+        stack = [Frame(cleaned, 0, len(cleaned), variables)]
+
+        def run_slice():
+            try:
+                more = run_frames(stack, slice_size)
+            except InputNeeded:
+                raise
+            except BaseException:
+                finish_tasks(failed=True)
+                raise
+            if not more:
+                finish_tasks()
+            return bool(more)
+        return run_slice
 
     # --- EXECUTE LINES ---
-    index = 0
+    if engine == "vm":
+        from .vm import compile_program, VirtualMachine
+        code = program.compiled.get("vm") if program is not None else None
+        if code is None:
+            code = compile_program(cleaned, blocks, original_lines)
+            if program is not None:
+                program.compiled["vm"] = code
+        VirtualMachine(code, recursion_limit, output, expressions, stdin, directory,
+                       filename).run(variables)
+    else:
+        try:
+            run_top_level(0, len(cleaned))
+        except BaseException:
+            finish_tasks(failed=True)
+            raise
+        finish_tasks()
+    return variables
+
+
+def check_engine(engine, recursion_limit=None, stream=False):
+    """engine and recursion_limit with their defaults filled in; ValueError for an unknown engine"""
+    engine = engine or DEFAULT_ENGINE
+    if recursion_limit is None:
+        recursion_limit = RECURSION_LIMIT
+    if engine not in ENGINES:
+        raise ValueError(f"unknown engine '{engine}' (valid: {', '.join(ENGINES)})")
+    if stream and engine not in STREAM_ENGINES:
+        raise ValueError(f"engine '{engine}' cannot stream (valid: {', '.join(STREAM_ENGINES)})")
+    return engine, recursion_limit
+
+
+def ifs(lines, filename="<input>", engine=None, stream=False, recursion_limit=None,
+        unbuffered=False):
+    """
+    Run a Cerona program.
+
+    engine selects how statements are executed: "tree" walks the token
+    lists directly, "closure" compiles each statement once into a Python
+    closure and runs those, "python" translates the whole program into a
+    Python module (see cerona.transpiler) and runs that, "vm" compiles it
+    to bytecode for the stack machine in cerona.vm. All of them produce
+    the same output.
+
+    With stream=True, lines may also be a file object or any iterable of
+    lines, which is read and run one top-level statement at a time (see
+    cerona.stream). Errors further down the program are then reported
+    when they are reached rather than before anything runs. Streaming
+    works with the "tree" and "closure" engines.
+
+    recursion_limit caps how many Cerona calls can be active at once
+    (RECURSION_LIMIT by default); going deeper is a CeronaError. The tree
+    walker and the vm keep their frames on a stack of their own, so any
+    limit works with them. The closure and python engines turn Cerona
+    calls into Python calls and also stop at Python's recursion limit.
+
+    print output is collected and written to sys.stdout in large chunks
+    (see cerona.output), flushed before input, on errors and at the end.
+    unbuffered=True writes every line with its own print() instead.
+
+    Errors are reported on stderr and end the process with exit status 1;
+    cerona.interpreter.Program runs a program and raises them instead.
+    """
+    check_engine(engine, recursion_limit, stream)
+    output = make_output(unbuffered)
     try:
-        while index < len(cleaned):
-            line_num, i = cleaned[index]
-            skip_ahead = execute_single_command(line_num, i, variables, cleaned)
-            if skip_ahead is not None:
-                index += skip_ahead
-            index += 1
+        _interpret(lines, filename, engine, stream, recursion_limit, output)
     except CeronaError as e:
+        output.flush()
         print(f"{filename}:{e}", file=sys.stderr)
         sys.exit(1)
+    finally:
+        output.flush()
 
-def execute(code: str):
+def emit_python(lines, filename="<input>"):
+    """Return the Python source the "python" engine would run for a program"""
+    from .transpiler import transpile
+
+    original_lines = lines.split("\n")
+    cleaned = parse_program(original_lines)
+    line_index, blocks = build_block_table(cleaned, original_lines)
+    return transpile(cleaned, blocks, original_lines, filename)[0]
+
+
+def execute(code: str, engine=None, recursion_limit=None, unbuffered=False):
     """Execute Cerona source code directly from a string."""
-    return ifs(code)
+    return ifs(code, engine=engine, recursion_limit=recursion_limit, unbuffered=unbuffered)
 
-def main():
+def main(argv=None):
     """CLI entry point"""
-    if len(sys.argv) < 2:
-        print("Usage: python -m cerona.main <filename>")
-        sys.exit(1)
+    import argparse
+
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] == "batch":
+        from .batch import main as batch_main
+        return batch_main(argv[1:])
+    if argv and argv[0] == "serve":
+        from .server import main as serve_main
+        return serve_main(argv[1:])
+
+    parser = argparse.ArgumentParser(prog="cerona", description="Run a Cerona program",
+                                     epilog="cerona batch SCRIPT... runs many scripts at once, cerona serve starts "
+                                            "a daemon for cerona-client; see their --help")
+    parser.add_argument("filename", help="the .cerona file to run")
+    parser.add_argument("--engine", choices=ENGINES, default=DEFAULT_ENGINE,
+                        help="execution engine (default: %(default)s)")
+    parser.add_argument("--compile", action="store_true",
+                        help="translate the program to Python and run it (same as --engine python)")
+    parser.add_argument("--emit-python", action="store_true",
+                        help="print the generated Python code instead of running it")
+    parser.add_argument("--stream", action="store_true",
+                        help="read and run the file one statement at a time, for very large programs")
+    parser.add_argument("--recursion-limit", type=int, default=None, metavar="N",
+                        help=f"allow at most N nested calls (default: {RECURSION_LIMIT})")
+    parser.add_argument("--unbuffered", action="store_true",
+                        help="write each printed line out immediately instead of in batches")
+    args = parser.parse_args(argv)
+
+    filename = args.filename
+    if args.stream:
+        if args.compile or args.emit_python or args.engine not in STREAM_ENGINES:
+            parser.error(f"--stream works with --engine {' or '.join(STREAM_ENGINES)}")
+        try:
+            with open(filename, 'r') as file:
+                ifs(file, filename, engine=args.engine, stream=True, recursion_limit=args.recursion_limit,
+                    unbuffered=args.unbuffered)
+        except FileNotFoundError:
+            print(f"{filename}: error: file not found", file=sys.stderr)
+            sys.exit(1)
+        return
 
-    filename = sys.argv[1]
     try:
         with open(filename, 'r') as file:
             lines = file.read()
@@ -723,7 +2511,20 @@ def main():
         print(f"{filename}: error: file not found", file=sys.stderr)
         sys.exit(1)
 
-    ifs(lines, filename)
+    if args.emit_python:
+        try:
+            print(emit_python(lines, filename), end="")
+        except CeronaError as e:
+            print(f"{filename}:{e}", file=sys.stderr)
+            sys.exit(1)
+        return
+
+    ifs(lines, filename, engine="python" if args.compile else args.engine,
+        recursion_limit=args.recursion_limit, unbuffered=args.unbuffered)
 
 if __name__ == "__main__":
-    main()
+    # Under "python -m cerona.main" this file runs as __main__ next to the
+    # cerona.main module the package already imported. Run that copy so the
+    # classes seen here match the ones cerona.vm and cerona.transpiler import.
+    import importlib
+    importlib.import_module("cerona.main").main()
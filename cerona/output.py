@@ -0,0 +1,148 @@
+"""
+Buffered output for Cerona's print.
+
+Calling Python's print() once per Cerona print statement costs a round
+trip through the text layer (and, on an unbuffered or line-buffered
+stream, a write system call) for every line. OutputBuffer collects the
+printed lines instead and writes them to the stream in large chunks.
+
+The interpreter flushes the buffer before input reads a line (see
+read_input), before reporting an error and when the program ends, so
+buffering never reorders output relative to prompts or error messages.
+--unbuffered (ifs(..., unbuffered=True)) goes back to one print() per
+line.
+"""
+import sys
+from collections import deque
+
+# Characters collected before they are written out
+OUTPUT_BUFFER_SIZE = 64 * 1024
+
+
+class OutputBuffer:
+    """
+    Lines printed by a program, written to stream in batches.
+
+    The batch goes out once more than max_chars characters or max_lines
+    lines are waiting, whichever comes first, and on flush(). max_lines
+    defaults to 1 (a flush per line) when stream is a terminal, so
+    interactive output appears as it is printed, and to no line limit
+    otherwise.
+    """
+    def __init__(self, stream=None, max_chars=OUTPUT_BUFFER_SIZE, max_lines=None):
+        self.stream = sys.stdout if stream is None else stream
+        if max_lines is None:
+            max_lines = 1 if _is_terminal(self.stream) else 0
+        self.max_chars = max_chars
+        self.max_lines = max_lines or sys.maxsize
+        self.parts = []
+        self.chars = 0
+
+    def line(self, value):
+        """Print value and a newline, like print(value)"""
+        text = str(value)
+        parts = self.parts
+        parts.append(text)
+        self.chars += len(text) + 1
+        if self.chars > self.max_chars or len(parts) >= self.max_lines:
+            self.flush()
+
+    def flush(self):
+        """Write out everything waiting and flush the stream"""
+        if self.parts:
+            parts = self.parts
+            self.parts = []
+            self.chars = 0
+            parts.append("")
+            self.stream.write("\n".join(parts))
+        self.stream.flush()
+
+
+class DirectOutput:
+    """Output straight through print(), one call per line (--unbuffered)"""
+    def __init__(self, stream=None):
+        # None is whatever sys.stdout is at the time of each print
+        self.stream = stream
+
+    def line(self, value):
+        print(value, file=self.stream)
+
+    def flush(self):
+        pass
+
+
+def _is_terminal(stream):
+    try:
+        return stream.isatty()
+    except (AttributeError, ValueError):
+        return False
+
+
+class InputNeeded(BaseException):
+    """
+    Raised by input in a run sliced up by Program.run_async when the next
+    line has not arrived yet. The statement runs again once it has.
+    """
+
+
+class PendingInput:
+    """
+    stdin of a sliced run: lines are handed in with supply() between
+    slices, by a caller that can wait for them without blocking.
+    """
+    def __init__(self):
+        self.lines = deque()
+        self.prompted = False
+
+    def supply(self, line):
+        """Make line (None for end of input) the answer to the input waiting for it"""
+        self.lines.append(line)
+
+    def read_line(self, prompt, output):
+        if self.lines:
+            self.prompted = False
+            line = self.lines.popleft()
+            if line is None:
+                raise EOFError("EOF when reading a line")
+            return line
+        if not self.prompted:
+            # Only once, although the statement runs again when the line is there
+            stream = sys.stdout if output.stream is None else output.stream
+            stream.write(prompt)
+            self.prompted = True
+        raise InputNeeded()
+
+
+def read_input(prompt, output, stdin=None):
+    """
+    input(prompt) for a program printing to output.
+
+    Whatever the program printed goes out before the prompt. Unless the
+    program has its own stdin or stdout, this is plain input(), line
+    editing included; otherwise the prompt goes to the output's stream
+    and the line is read from stdin (sys.stdin if not given). A stdin
+    with a read_line(prompt, output) method, such as PendingInput, deals
+    with the prompt itself.
+    """
+    output.flush()
+    read_line = getattr(stdin, "read_line", None)
+    if read_line is not None:
+        return read_line(prompt, output)
+    stream = output.stream
+    if stdin is None and (stream is None or stream is sys.stdout):
+        return input(prompt)
+    if stream is None:
+        stream = sys.stdout
+    stream.write(prompt)
+    stream.flush()
+    line = (sys.stdin if stdin is None else stdin).readline()
+    if not line:
+        raise EOFError("EOF when reading a line")
+    return line[:-1] if line.endswith("\n") else line
+
+
+def make_output(unbuffered=False, stream=None):
+    """The output a run of a program writes to"""
+    if unbuffered:
+        return DirectOutput(stream)
+    return OutputBuffer(stream)
@@ -0,0 +1,238 @@
+"""
+parallel for: a range loop whose iterations run in worker processes.
+
+    parallel for i in 0 1000000 with sum total max best collect rows
+        set total i * i
+        ...
+    endfor
+
+The range is cut into chunks, a few per worker, and every chunk runs in
+a process of a pool that is started once and kept for later loops. Each
+chunk starts from a copy of the variables as they were when the loop
+began (variables that cannot be copied to another process, such as
+tasks and channels, are left out), of the functions and classes
+defined so far and of the objects made so far; nothing the body sets or
+changes comes back, apart from the variables named after with.
+
+Each of those is a reduction: after every iteration that set it, its
+value is combined with the others. sum adds them up, min and max keep
+the smallest or largest and collect makes a list of them in iteration
+order. sum, min and max also take in the value the variable had before
+the loop, if it had one.
+
+What the iterations print is written out in iteration order once their
+chunk is done, so the output is the same as that of the serial loop. If
+an iteration fails, the output of the iterations before it is written
+and its error is raised, again as the serial loop would; later chunks
+are abandoned.
+
+Inside a worker (a parallel for nested in another) and with
+PARALLEL_WORKERS set to 1 the chunks run one after the other in the
+process itself.
+"""
+import io
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+from .main import CeronaError, Scope, _interpret
+from .output import make_output
+
+# Worker processes in the pool
+PARALLEL_WORKERS = os.cpu_count() or 1
+
+# Chunks per worker: more balance the load better, fewer cost less to hand out
+CHUNKS_PER_WORKER = 4
+
+REDUCTIONS = ("sum", "min", "max", "collect")
+
+_pool = None
+_in_worker = False
+
+
+class Loop:
+    """What a parallel for runs: cleaned[start:end] for each value of var"""
+    __slots__ = ("var", "start", "end", "reductions")
+
+    def __init__(self, var, start, end, reductions):
+        self.var = var
+        self.start = start
+        self.end = end
+        # (kind, name) pairs
+        self.reductions = reductions
+
+
+def parse_header(tokens):
+    """
+    (var, start, end, reductions) from the tokens of "parallel for VAR in
+    START END [with KIND NAME ...]"; ValueError with the message to report
+    """
+    if len(tokens) < 6 or tokens[1] != "for" or tokens[3] != "in":
+        raise ValueError("invalid parallel for syntax (expected: parallel for VAR in START END)")
+    rest = tokens[6:]
+    if rest and rest[0] != "with":
+        raise ValueError("parallel for needs a range (parallel for VAR in START END with KIND NAME ...)")
+    pairs = rest[1:]
+    if rest and (not pairs or len(pairs) % 2):
+        raise ValueError("with needs a reduction and a variable name for each result")
+    reductions = []
+    for kind, name in zip(pairs[::2], pairs[1::2]):
+        if kind not in REDUCTIONS:
+            raise ValueError(f"unknown reduction '{kind}' (valid: {', '.join(REDUCTIONS)})")
+        reductions.append((kind, name))
+    return tokens[2], tokens[4], tokens[5], tuple(reductions)
+
+
+def combine(kind, earlier, later):
+    """Two sum, min or max results (or values) combined, earlier iterations first"""
+    if kind == "sum":
+        return earlier + later
+    if kind == "min":
+        return min(earlier, later)
+    return max(earlier, later)
+
+
+def reduce_into(partials, kind, name, value):
+    """Combine one iteration's value into partials[name]"""
+    if kind == "collect":
+        partials.setdefault(name, []).append(value)
+    elif name in partials:
+        partials[name] = combine(kind, partials[name], value)
+    else:
+        partials[name] = value
+
+
+def chunk_bounds(first, last, workers):
+    """Split range(first, last) into contiguous (start, stop) chunks, in order"""
+    count = last - first
+    if count <= 0:
+        return []
+    chunks = min(count, workers * CHUNKS_PER_WORKER)
+    size, extra = divmod(count, chunks)
+    bounds = []
+    start = first
+    for n in range(chunks):
+        stop = start + size + (n < extra)
+        bounds.append((start, stop))
+        start = stop
+    return bounds
+
+
+def snapshot(scope):
+    """The pickled variables scope (or any dict) can see, leaving out what cannot be pickled"""
+    variables = dict(scope.parent) if isinstance(scope, Scope) else {}
+    variables.update(scope)
+    try:
+        return pickle.dumps(variables, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        copyable = {}
+        for name, value in variables.items():
+            try:
+                pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                continue
+            copyable[name] = value
+        return pickle.dumps(copyable, pickle.HIGHEST_PROTOCOL)
+
+
+@lru_cache(maxsize=8)
+def _program(source, filename, engine, recursion_limit):
+    from .interpreter import Program
+    # The vm has no way in to the middle of a program; chunks are walked as a tree
+    return Program(source, filename, "tree" if engine == "vm" else engine, recursion_limit)
+
+
+def run_chunk(job):
+    """
+    Run one chunk; this is what the workers do. Returns (partials,
+    printed text, error), error being the arguments of a CeronaError.
+    """
+    (source, filename, engine, recursion_limit, functions, classes, objects, loop, first, last,
+     variables, directory) = job
+    program = _program(source, filename, engine, recursion_limit)
+    stdout = io.StringIO()
+    output = make_output(False, stdout)
+    try:
+        partials = _interpret(None, filename, program.engine, False, recursion_limit, output,
+                              pickle.loads(variables), program, io.StringIO(),
+                              chunk=(functions, classes, pickle.loads(objects), loop, first, last),
+                              directory=directory)
+        error = None
+    except CeronaError as e:
+        partials, error = None, (e.message, e.line_num, e.line_content, e.col)
+    finally:
+        output.flush()
+    return partials, stdout.getvalue(), error
+
+
+def _start_worker():
+    global _in_worker
+    _in_worker = True
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PARALLEL_WORKERS, initializer=_start_worker)
+    return _pool
+
+
+def _forget_pool():
+    global _pool
+    _pool = None
+
+
+def run_parallel_for(loop, first, last, scope, functions, source, filename, engine, recursion_limit,
+                     output, directory=None, classes=None, objects=None):
+    """
+    Run loop over range(first, last) and store its reductions in scope.
+
+    functions maps the name of each function the body may call to
+    (params, line_num, memo) and classes the name of each class to the
+    line of its class statement; objects maps names to CeronaObjects.
+    Relative paths are taken from directory, if given, as in the run the
+    loop is part of.
+    """
+    variables = snapshot(scope)
+    states = snapshot({name: (obj.class_def.name, obj.instance_vars) for name, obj in (objects or {}).items()})
+    workers = 1 if _in_worker else PARALLEL_WORKERS
+    jobs = [(source, filename, engine, recursion_limit, functions, classes or {}, states, loop, start, stop,
+             variables, directory)
+            for start, stop in chunk_bounds(first, last, workers)]
+    if workers == 1:
+        results = map(run_chunk, jobs)
+        futures = []
+    else:
+        futures = [_get_pool().submit(run_chunk, job) for job in jobs]
+        results = (future.result() for future in futures)
+
+    merged = {}
+    try:
+        for partials, text, error in results:
+            if text:
+                output.line(text[:-1] if text.endswith("\n") else text)
+            if error is not None:
+                raise CeronaError(*error)
+            for kind, name in loop.reductions:
+                if name not in partials:
+                    continue
+                if kind == "collect":
+                    merged.setdefault(name, []).extend(partials[name])
+                elif name in merged:
+                    merged[name] = combine(kind, merged[name], partials[name])
+                else:
+                    merged[name] = partials[name]
+    except BrokenProcessPool as e:
+        _forget_pool()
+        raise CeronaError(f"parallel for lost a worker process ({e})")
+    finally:
+        for future in futures:
+            future.cancel()
+
+    for kind, name in loop.reductions:
+        if kind == "collect":
+            scope[name] = merged.get(name, [])
+        elif name in merged:
+            scope[name] = combine(kind, scope[name], merged[name]) if name in scope else merged[name]
@@ -0,0 +1,199 @@
+"""
+cerona serve: a daemon that runs scripts for cerona-client.
+
+For a script that runs in well under a millisecond, nearly all the time
+of cerona FILE goes into starting Python and importing the interpreter.
+cerona serve pays that once: it listens on a Unix domain socket
+(CERONA_SOCKET, see cerona.client) and runs each file a client sends it
+on a thread of its own, with print, errors and input relayed over the
+connection, in the client's working directory and with its cache
+settings (see cerona.client). Parsed programs stay in memory between requests (one
+Interpreter per engine and recursion limit), in front of the .ceronac
+files on disk, so a script that has not changed is not even re-read
+from the cache.
+"""
+import io
+import os
+import signal
+import socket
+import socketserver
+import sys
+import traceback
+
+from .cache import CACHE_DIR_ENV
+from .client import FORWARDED_ENV, SOCKET_ENV, Connection, connect, default_socket_path
+from .interpreter import Interpreter
+from .main import CeronaError, ENGINES
+
+
+class ClientStream:
+    """stdout or stderr of a run, sent to the client as {kind: text} messages"""
+    def __init__(self, connection, kind, tty=False):
+        self.connection = connection
+        self.kind = kind
+        self.tty = tty
+
+    def write(self, text):
+        if text:
+            self.connection.send({self.kind: text})
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        # Decides whether print output is flushed line by line (cerona.output)
+        return self.tty
+
+
+class ClientInput:
+    """stdin of a run: each line is asked for from the client"""
+    def __init__(self, connection):
+        self.connection = connection
+
+    def readline(self):
+        self.connection.send({"read": True})
+        reply = self.connection.receive()
+        return (reply or {}).get("line") or ""
+
+
+class CeronaServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Runs each request on its own thread; runs are isolated (see cerona.interpreter)"""
+    daemon_threads = True
+
+    def __init__(self, path):
+        super().__init__(path, RequestHandler)
+        self.interpreters = {}
+
+    def interpreter(self, engine, recursion_limit):
+        """The Interpreter (and its parsed programs) for these options"""
+        key = (engine, recursion_limit)
+        interpreter = self.interpreters.get(key)
+        if interpreter is None:
+            interpreter = self.interpreters.setdefault(key, Interpreter(engine, recursion_limit))
+        return interpreter
+
+
+class RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        connection = Connection(self.request)
+        try:
+            request = connection.receive()
+            if request is not None:
+                connection.send({"exit": self.run(connection, request)})
+        except (OSError, ValueError):
+            # The client went away or sent something that is not a request
+            pass
+        finally:
+            connection.close()
+
+    def run(self, connection, request):
+        """Run the file the request names and return its exit status"""
+        filename = request["filename"]
+        directory = request.get("cwd")
+        environ = dict(os.environ)
+        for name in FORWARDED_ENV:
+            environ.pop(name, None)
+        environ.update(request.get("env") or {})
+        if directory and environ.get(CACHE_DIR_ENV):
+            environ[CACHE_DIR_ENV] = os.path.join(directory, environ[CACHE_DIR_ENV])
+        stdout = ClientStream(connection, "out", request.get("tty", False))
+        stderr = ClientStream(connection, "err")
+        try:
+            with open(request["path"], 'r') as file:
+                source = file.read()
+        except FileNotFoundError:
+            stderr.write(f"{filename}: error: file not found\n")
+            return 1
+        try:
+            interpreter = self.server.interpreter(request.get("engine"), request.get("recursion_limit"))
+        except ValueError as e:
+            stderr.write(f"cerona: error: {e}\n")
+            return 2
+        try:
+            program = interpreter.compile(source, request["path"], environ)
+            program.run(stdout=stdout, unbuffered=request.get("unbuffered", False),
+                        stdin=ClientInput(connection), directory=directory)
+        except CeronaError as e:
+            stderr.write(f"{filename}:{e}\n")
+            return 1
+        except Exception:
+            # A failure of the interpreter itself must not take the server down
+            stderr.write(traceback.format_exc())
+            return 1
+        return 0
+
+
+def warm_up():
+    """Import everything a request might need, so the first one is as fast as the rest"""
+    from . import cache, stream, transpiler, vm  # noqa: F401
+    for engine in ENGINES:
+        Interpreter(engine).run('set x 1 + 1\nif x equals 2 then print(x)\n', stdout=io.StringIO())
+
+
+def make_server(path=None):
+    """
+    A warmed-up CeronaServer bound to the socket at path; OSError if one
+    is already there.
+
+    Programs sent to the daemon can run any Python through their
+    expressions, so the socket is made for the user alone (mode 0600),
+    and so is its directory when the server has to make it (mode 0700).
+    """
+    path = path or default_socket_path()
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, mode=0o700)
+    if os.path.lexists(path):
+        probe = connect(path)
+        if probe is not None:
+            probe.close()
+            raise OSError(f"a cerona server is already listening on {path}")
+        # Left behind by a server that did not shut down cleanly
+        os.unlink(path)
+    warm_up()
+    server = CeronaServer(path)
+    try:
+        os.chmod(path, 0o600)
+    except OSError:
+        server.server_close()
+        raise
+    return server
+
+
+def serve_until_stopped(server):
+    """Serve requests until server.shutdown() or an interrupt, then remove the socket"""
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        try:
+            os.unlink(server.server_address)
+        except OSError:
+            pass
+
+
+def main(argv=None):
+    """cerona serve [--socket PATH]"""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="cerona serve",
+                                     description="Run Cerona scripts sent by cerona-client")
+    parser.add_argument("--socket", default=None, metavar="PATH",
+                        help=f"where to listen (default: ${SOCKET_ENV} or {default_socket_path()})")
+    args = parser.parse_args(argv)
+    if not hasattr(socket, "AF_UNIX"):
+        parser.error("cerona serve needs Unix domain sockets")
+    path = args.socket or default_socket_path()
+    try:
+        server = make_server(path)
+    except OSError as e:
+        print(f"cerona serve: error: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"cerona serve: listening on {path}", file=sys.stderr)
+    # Shut down cleanly (removing the socket) when killed as well
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        serve_until_stopped(server)
+    except KeyboardInterrupt:
+        pass
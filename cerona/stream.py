@@ -0,0 +1,107 @@
+"""
+Streaming support for very large Cerona programs.
+
+ifs(..., stream=True) does not split the whole source into lines or
+tokenize it up front. It reads one line at a time and hands the program
+to the interpreter one top-level statement at a time, with a block
+(if/while/for/func/class up to its terminator) coming through as a
+whole. Once a statement has run it is forgotten unless it defined a
+function or class, so straight-line scripts run in constant memory
+however long they are.
+"""
+import io
+
+from .main import BLOCK_KEYWORDS, block_keyword, parse_line
+
+
+class SourceWindow:
+    """
+    Stand-in for the list of source lines that error messages quote.
+
+    Only the lines of statements still held by the interpreter are kept;
+    len() is the number of lines read so far.
+    """
+    def __init__(self):
+        self.lines = {}
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return self.lines.get(index + 1, "")
+
+    def forget(self, line_num):
+        self.lines.pop(line_num, None)
+
+
+def read_statements(source, window):
+    """
+    Yield the top-level statements of source as lists of (line_num, tokens).
+
+    source is a string, a file object or any iterable of lines. A block
+    comes out as one list from its opener to the matching terminator. A
+    block that is never closed comes out at the end of the input, for
+    build_block_table to report.
+    """
+    if isinstance(source, str):
+        source = io.StringIO(source)
+
+    openers = {end: start for start, end in BLOCK_KEYWORDS.items()}
+    depth = dict.fromkeys(BLOCK_KEYWORDS, 0)
+    open_blocks = 0
+    statement = []
+
+    for line_num, line in enumerate(source, start=1):
+        window.count = line_num
+        line = line.rstrip("\n")
+        stripped = line.strip()
+        if not stripped:
+            continue
+        window.lines[line_num] = line
+        tokens = parse_line(stripped, line_num, window)
+        if not tokens:
+            window.forget(line_num)
+            continue
+        statement.append((line_num, tokens))
+
+        keyword = block_keyword(tokens)
+        if keyword in BLOCK_KEYWORDS:
+            # Inline "if ... then ..." statements do not open a block
+            if not (keyword == "if" and "then" in tokens):
+                depth[keyword] += 1
+                open_blocks += 1
+        elif keyword in openers and depth[openers[keyword]]:
+            depth[openers[keyword]] -= 1
+            open_blocks -= 1
+
+        if not open_blocks:
+            yield statement
+            statement = []
+
+    if statement:
+        yield statement
+
+
+# Words that take part in block structure
+_BLOCK_WORDS = set(BLOCK_KEYWORDS) | set(BLOCK_KEYWORDS.values()) | {"else"}
+
+
+def is_simple(statement):
+    """Whether statement is a single line outside any block structure"""
+    return len(statement) == 1 and block_keyword(statement[0][1]) not in _BLOCK_WORDS
+
+
+def defines_code(statement):
+    """Whether running statement can register a function or class that refers back to it"""
+    return any(block_keyword(cmd) in ("func", "class") for line_num, cmd in statement)
+
+
+def may_wait(source):
+    """Whether reading the next line of source can block (a pipe, a terminal, a generator)"""
+    if isinstance(source, str):
+        return False
+    try:
+        return not source.seekable()
+    except (AttributeError, ValueError):
+        return True
@@ -0,0 +1,223 @@
+"""
+Tasks and channels: spawn, join, channel, send and recv.
+
+spawn NAME call FUNC ARGS... starts a call to a user-defined function
+(or obj.method) as a task and stores its Task in NAME; join NAME waits
+for it and replaces the Task with what the call returned, raising the
+error the call failed with if it did. channel NAME [CAPACITY] makes a
+bounded Channel (CAPACITY defaults to 1); send NAME VALUE waits while it
+is full and recv NAME VAR waits while it is empty.
+
+Every task runs on a thread of its own, but the tasks of a run take
+turns: one holds the Scheduler's lock and runs statements while the
+others wait for it, and it only hands over while it waits itself, in
+join, send, recv or input. The interpreter's state therefore needs no
+locking of its own, and a task waiting for a line of input or on a
+channel lets the others get on with their work. Under run_async, a task
+waiting for its line waits until the program itself waits, which then
+raises InputNeeded so run_async can fetch the line.
+
+A run ends once every task it spawned has finished. A task that failed
+and was never joined fails the run; when every task is waiting for
+another and none can go on, the one that notices fails with a deadlock
+error.
+"""
+import threading
+from contextlib import contextmanager
+from collections import deque
+
+from .main import CeronaError
+from .output import DirectOutput, InputNeeded, read_input
+
+# Capacity of a channel made without one
+CHANNEL_CAPACITY = 1
+
+
+class TaskError(Exception):
+    """A task cannot go on; the statement waiting reports it as a runtime error"""
+
+
+class _Stopped(BaseException):
+    """Ends a waiting task once the run it belongs to has failed"""
+
+
+class Task:
+    """A spawned call: its result or error once it is done"""
+    def __init__(self, name):
+        self.name = name
+        self.done = False
+        self.joined = False
+        self.value = None
+        self.error = None
+
+    def __str__(self):
+        return f"<task {self.name} {'done' if self.done else 'running'}>"
+
+    __repr__ = __str__
+
+
+class Channel:
+    """A bounded first-in first-out queue between the tasks of a run"""
+    def __init__(self, scheduler, name, capacity=CHANNEL_CAPACITY):
+        if capacity < 1:
+            raise TaskError(f"channel '{name}' needs a capacity of at least 1")
+        self.scheduler = scheduler
+        self.name = name
+        self.capacity = capacity
+        self.items = deque()
+
+    def send(self, value):
+        items = self.items
+        self.scheduler.wait_for(lambda: len(items) < self.capacity, f"send to channel '{self.name}'")
+        items.append(value)
+        self.scheduler.changed.notify_all()
+
+    def recv(self):
+        items = self.items
+        self.scheduler.wait_for(lambda: items, f"recv from channel '{self.name}'")
+        value = items.popleft()
+        self.scheduler.changed.notify_all()
+        return value
+
+    def __len__(self):
+        return len(self.items)
+
+    def __str__(self):
+        return f"<channel {self.name} {len(self.items)}/{self.capacity}>"
+
+    __repr__ = __str__
+
+
+class Scheduler:
+    """
+    The tasks of one run and the lock they take turns with.
+
+    The thread that makes the Scheduler (the one running the program)
+    holds the lock from then on, apart from while it waits, until
+    finish().
+    """
+    def __init__(self):
+        self.changed = threading.Condition(threading.Lock())
+        self.changed.acquire()
+        self.owner = threading.current_thread()
+        self.tasks = []
+        # The program itself and the tasks that have not finished
+        self.alive = 1
+        # What each waiting task is waiting for
+        self.waiting = []
+        self.stopping = False
+        # The PendingInput a task is waiting for a line from, if any
+        self.reading = None
+
+    def spawn(self, name, work):
+        """Start work() as a task and return its Task"""
+        task = Task(name)
+        self.tasks.append(task)
+        self.alive += 1
+        thread = threading.Thread(target=self._run, args=(task, work), name=f"cerona task {name}",
+                                  daemon=True)
+        thread.start()
+        return task
+
+    def _run(self, task, work):
+        with self.changed:
+            try:
+                if not self.stopping:
+                    task.value = work()
+            except _Stopped:
+                pass
+            except BaseException as e:
+                task.error = e
+            finally:
+                task.done = True
+                self.alive -= 1
+                self.changed.notify_all()
+
+    def wait_for(self, ready, what):
+        """Let the other tasks run until ready() is true"""
+        while not ready():
+            if self.stopping:
+                raise _Stopped()
+            reading = self.reading
+            if reading is not None and not reading.lines:
+                if threading.current_thread() is self.owner:
+                    # The statement runs again once run_async has supplied the line
+                    raise InputNeeded()
+            elif len(self.waiting) + 1 >= self.alive and not any(other() for other in self.waiting):
+                raise TaskError(f"deadlock: every task is waiting ({what})")
+            if any(other() for other in self.waiting):
+                # Such as the task whose line was supplied while nobody was waiting
+                self.changed.notify_all()
+            self.waiting.append(ready)
+            try:
+                self.changed.wait()
+            finally:
+                self.waiting.remove(ready)
+
+    def join(self, task):
+        """Wait for task and return its result, or raise its error"""
+        self.wait_for(lambda: task.done, f"join {task.name}")
+        task.joined = True
+        if task.error is not None:
+            raise task.error
+        return task.value
+
+    @contextmanager
+    def released(self):
+        """Let the other tasks run while the caller waits for something else"""
+        self.changed.release()
+        try:
+            yield
+        finally:
+            self.changed.acquire()
+
+    def read_input(self, prompt, output, stdin=None):
+        """read_input(), with the other tasks running while it waits for the line"""
+        output.flush()
+        # The prompt skips the output buffer, which the other tasks go on writing to
+        direct = DirectOutput(getattr(output, "stream", None))
+        if hasattr(stdin, "read_line") and threading.current_thread() is not self.owner:
+            # A PendingInput: only the program can have run_async supply the line
+            while True:
+                try:
+                    return stdin.read_line(prompt, direct)
+                except InputNeeded:
+                    self.reading = stdin
+                    self.changed.notify_all()
+                    try:
+                        self.wait_for(lambda: stdin.lines, "input")
+                    finally:
+                        self.reading = None
+        with self.released():
+            return read_input(prompt, direct, stdin)
+
+    def finish(self, failed=False):
+        """
+        Wait for every task to finish and give up the lock.
+
+        Raises the error of the first task that failed and was not
+        joined. When the run has failed already, tasks still waiting
+        are stopped instead. InputNeeded, raised while a task waits for a
+        line of input under run_async, leaves everything as it is, for
+        finish() to be called again once the line is there.
+        """
+        stop = True
+        try:
+            if not failed:
+                try:
+                    self.wait_for(lambda: self.alive == 1, "the end of the program")
+                except TaskError as e:
+                    raise CeronaError(str(e))
+                for task in self.tasks:
+                    if task.error is not None and not task.joined:
+                        raise task.error
+        except InputNeeded:
+            stop = False
+            raise
+        finally:
+            if stop:
+                self.stopping = True
+                self.changed.notify_all()
+                while self.alive > 1:
+                    self.changed.wait()
+                self.changed.release()
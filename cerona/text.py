@@ -0,0 +1,157 @@
+"""
+Text: the string builder behind append and the string commands.
+
+    append report "total: "
+    append report total
+    split line "," fields
+    concat fields ";" row
+    replace row "old" "new" row
+    upper row loud
+    find row "new" where
+    match "([a-z]+)=([0-9]+)" row parts
+
+append NAME VALUE adds VALUE (as text) to the end of NAME. The pieces
+are kept in a TextBuilder and only joined into one string the first
+time the whole text is needed, so adding a piece costs the same however
+long the text already is; set s s + piece copies all of s every time.
+A builder behaves like the string it holds: other variables set from
+it keep that text when NAME is appended to later, and its methods are
+those of str.
+
+The other commands store their result in the variable named last:
+split makes a list of the pieces between separators (whitespace if none
+is given), concat joins the items of a list with a separator (nothing
+if none is given; join is taken by tasks), replace, upper and lower make
+new text, find gives the index of the first occurrence or -1, and match
+a list of the first match of a regular expression and its groups, or an
+empty list. A pattern is the variable it names or else its own text,
+never an expression (as [0-9] would be), and compiled patterns are kept
+in an LRU cache, so a match in a loop compiles its pattern once.
+"""
+import re
+from functools import lru_cache
+
+# Compiled regular expressions kept for match
+PATTERN_CACHE_SIZE = 256
+
+TEXT_COMMANDS = ("append", "split", "concat", "replace", "upper", "lower", "find", "match")
+
+
+class TextBuilder:
+    """
+    Text made of pieces, joined into one string when it is read.
+
+    A TextBuilder never changes once made, so variables, lists and keys
+    holding one keep their text whatever is appended later: appended()
+    returns a new TextBuilder. Builders made one from another share the
+    list of pieces, each seeing the first count of them, and only the
+    one whose pieces are the whole list adds to it in place; appending
+    to an older one copies its pieces first.
+    """
+    __slots__ = ("parts", "count")
+
+    def __init__(self, text="", parts=None):
+        if parts is None:
+            parts = [text] if text else []
+        self.parts = parts
+        self.count = len(parts)
+
+    def appended(self, piece):
+        """This text with piece added to the end"""
+        parts = self.parts
+        if self.count != len(parts):
+            parts = parts[:self.count]
+        parts.append(piece)
+        return TextBuilder(parts=parts)
+
+    def __str__(self):
+        if self.count == 1:
+            return self.parts[0]
+        text = "".join(self.parts[:self.count] if self.count != len(self.parts) else self.parts)
+        # Joined once, into pieces of this builder's own; later pieces go on after it
+        self.parts = [text]
+        self.count = 1
+        return text
+
+    def __repr__(self):
+        return repr(str(self))
+
+    def __getattr__(self, name):
+        # What text can do, such as upper() or startswith()
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(str(self), name)
+
+    def __len__(self):
+        return len(str(self))
+
+    def __iter__(self):
+        return iter(str(self))
+
+    def __contains__(self, part):
+        return str(part) in str(self)
+
+    def __getitem__(self, index):
+        return str(self)[index]
+
+    def __eq__(self, other):
+        return str(self) == (str(other) if isinstance(other, TextBuilder) else other)
+
+    def __hash__(self):
+        # The text never changes, so neither does its hash
+        return hash(str(self))
+
+    def __add__(self, other):
+        return str(self) + (str(other) if isinstance(other, TextBuilder) else other)
+
+    def __radd__(self, other):
+        return other + str(self)
+
+
+@lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def compiled_pattern(pattern):
+    """pattern compiled as a regular expression; ValueError if it is not one"""
+    try:
+        return re.compile(pattern)
+    except re.error as e:
+        raise ValueError(f"invalid pattern '{pattern}' ({e})")
+
+
+def text_command(keyword, name, scope, values):
+    """
+    Run a text command (see main.collection_syntax) and return its
+    result; for append, the TextBuilder NAME is to hold next. name is
+    the first word after the keyword, which for match is the pattern.
+    """
+    if keyword == "append":
+        text = scope[name] if name in scope else None
+        if not isinstance(text, TextBuilder):
+            text = TextBuilder("" if text is None else str(text))
+        return text.appended(str(values[0]))
+    if keyword == "concat":
+        items = values[0]
+        if isinstance(items, (str, TextBuilder)) or not hasattr(items, "__iter__"):
+            raise ValueError(f"'{name}' is not a list")
+        separator = str(values[1]) if len(values) > 1 else ""
+        return separator.join([item if item.__class__ is str else str(item) for item in items])
+    text = str(values[0])
+    if keyword == "split":
+        if len(values) == 1:
+            return text.split()
+        separator = str(values[1])
+        if not separator:
+            raise ValueError("split separator must not be empty")
+        return text.split(separator)
+    if keyword == "replace":
+        return text.replace(str(values[1]), str(values[2]))
+    if keyword == "upper":
+        return text.upper()
+    if keyword == "lower":
+        return text.lower()
+    if keyword == "find":
+        return text.find(str(values[1]))
+    pattern = scope[name] if name in scope else name
+    found = compiled_pattern(str(pattern)).search(text)
+    if found is None:
+        return []
+    return [found.group(0), *found.groups("")]
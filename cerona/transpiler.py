@@ -0,0 +1,396 @@
+"""
+Cerona to Python transpiler.
+
+Translates a parsed program (the (line_num, tokens) list built by
+parse_program) into Python module source. Every block of statements
+becomes a Python function taking the scope dict `v`: the program itself
+is BODIES[0], and each func/method body is BODIES[index of its first
+statement]. Loops and conditions become native Python loops and ifs,
+arithmetic in `set` becomes inline Python over `v[...]`, and statements
+without a direct translation call back into the interpreter.
+
+The generated code expects these names from the runtime that executes it:
+
+    _store(v, name, expr, line)          set fallback when evaluation fails
+    _resolved(v, expr, line)             the value that fallback would store
+    _print(v, expr)                      the print statement
+    _condition(v, tokens, line)          evaluate_condition
+    _num(value)                          numeric coercion used by comparisons
+    _eval(expr, v)                       sandboxed eval of an expression
+    _iterable(v, token, line)            the 'for VAR in EXPR' iterable
+    _range_error(line)                   CeronaError for bad range bounds
+    _call(name, args, v)                 call_function, returning the result
+    _call_method(obj_name, name, args, line)
+    _collection(operation, name, target, values, v)
+                                         a list, map, array or text command (collection_command)
+    _exec(line, tokens, v)               execute_single_command
+
+transpile() also returns a line map so the runtime can report errors
+against Cerona line numbers rather than lines of the generated code.
+"""
+import ast
+
+from .main import (
+    CeronaError, parse_line, parse_condition, coerce_number, block_keyword,
+    COLLECTION_COMMANDS, collection_syntax,
+)
+
+COMPARISONS = {
+    "greater": ">", ">": ">",
+    "greaterequals": ">=", ">=": ">=",
+    "less": "<", "<": "<",
+    "lessequals": "<=", "<=": "<=",
+}
+
+# Expression nodes that open a new Python scope or write to one; names in
+# them cannot simply be rewritten to scope lookups
+_SCOPED_NODES = (ast.Lambda, ast.ListComp, ast.SetComp, ast.DictComp,
+                 ast.GeneratorExp, ast.NamedExpr)
+
+# Values a constant `set` may compute once at translation time
+_IMMUTABLE = (int, float, complex, str, bool, type(None))
+
+
+class _ScopeLookups(ast.NodeTransformer):
+    """Rewrite every name in an expression to a lookup in the scope dict"""
+    def visit_Name(self, node):
+        return ast.copy_location(
+            ast.Subscript(
+                value=ast.Name(id="v", ctx=ast.Load()),
+                slice=ast.Constant(value=node.id),
+                ctx=ast.Load()
+            ),
+            node
+        )
+
+
+def _native_expression(expr):
+    """Python source evaluating expr against the scope dict, or None if it needs eval()"""
+    try:
+        tree = ast.parse(expr.lstrip(" \t"), mode="eval")
+    except (SyntaxError, ValueError):
+        return None
+    if not hasattr(ast, "unparse"):
+        return None
+    if any(isinstance(node, _SCOPED_NODES) for node in ast.walk(tree)):
+        return None
+    tree = ast.fix_missing_locations(_ScopeLookups().visit(tree))
+    return ast.unparse(tree.body)
+
+
+def _constant_value(expr):
+    """(True, value) if expr is an immutable constant, else (False, None)"""
+    try:
+        code = compile(expr.lstrip(" \t"), "<cerona>", "eval")
+    except (SyntaxError, ValueError):
+        return False, None
+    if code.co_names:
+        return False, None
+    try:
+        value = eval(code, {"__builtins__": None})
+    except Exception:
+        return False, None
+    if isinstance(value, _IMMUTABLE):
+        return True, value
+    return False, None
+
+
+def _compiles(expr):
+    try:
+        compile(expr.lstrip(" \t"), "<cerona>", "eval")
+    except (SyntaxError, ValueError):
+        return False
+    return True
+
+
+def _is_quoted(token):
+    return len(token) >= 2 and token[0] == token[-1] and token[0] in ('"', "'")
+
+
+def _looks_numeric(token):
+    return token.replace('.', '', 1).replace('-', '', 1).isdigit()
+
+
+def _operand(token):
+    """Python source resolving a token the way resolve_value does"""
+    if _is_quoted(token):
+        return repr(token[1:-1])
+    if _looks_numeric(token):
+        return repr(token)
+    return f"(v[{token!r}] if {token!r} in v else {token!r})"
+
+
+def _numeric_operand(token):
+    """Python source for an operand of an ordering comparison"""
+    if _is_quoted(token):
+        return repr(coerce_number(token[1:-1]))
+    if _looks_numeric(token):
+        return repr(coerce_number(token))
+    return f"_num({_operand(token)})"
+
+
+def _string_operand(token):
+    """Python source for an operand of equals/contains, which compare as strings"""
+    if _is_quoted(token):
+        return repr(token[1:-1])
+    if _looks_numeric(token):
+        return repr(token)
+    return f"str({_operand(token)})"
+
+
+def _comparison(left, operator, right):
+    """Python source for one comparison of a condition"""
+    if operator in COMPARISONS:
+        return f"{_numeric_operand(left)} {COMPARISONS[operator]} {_numeric_operand(right)}"
+    left, right = _string_operand(left), _string_operand(right)
+    if operator in ("equals", "=="):
+        return f"{left} == {right}"
+    if operator in ("notequals", "!="):
+        return f"{left} != {right}"
+    if operator == "contains":
+        return f"{right} in {left}"
+    return f"{left} in {right}"
+
+
+def _condition_source(node):
+    """Python source for a parsed condition; and/or/not map onto Python's own"""
+    kind = node[0]
+    if kind == "compare":
+        return _comparison(*node[1:])
+    if kind == "not":
+        return f"not ({_condition_source(node[1])})"
+    return f" {kind} ".join(f"({_condition_source(part)})" for part in node[1])
+
+
+def _condition(tokens, line_num, line_content=None):
+    """Python source for an if/while condition"""
+    try:
+        return _condition_source(parse_condition(tokens, line_num, line_content))
+    except CeronaError:
+        # Malformed conditions raise from the interpreter when they run
+        return f"_condition(v, {tokens!r}, {line_num})"
+
+
+class _Emitter:
+    """Accumulates generated lines together with their Cerona line numbers"""
+    def __init__(self):
+        self.lines = []
+        self.line_map = []
+
+    def emit(self, indent, text, line_num=None):
+        self.lines.append("    " * indent + text)
+        self.line_map.append(line_num)
+
+
+def transpile(commands, blocks, original_lines=(), filename="<input>"):
+    """
+    Translate a parsed program into Python source.
+
+    commands and blocks are the parsed program and the table from
+    build_block_table. Returns (source, line_map) where line_map[n] is the
+    Cerona line number for line n + 1 of the source, or None.
+    """
+    out = _Emitter()
+    pending = [0]
+    bodies = []
+    in_function = False
+
+    def source_line(line_num):
+        if line_num and line_num <= len(original_lines):
+            return original_lines[line_num - 1]
+        return None
+
+    def emit_call(i, line_num):
+        """Python source for "call NAME ARGS...", evaluating to the result"""
+        args = "[" + ", ".join(_operand(arg) for arg in i[2:]) + "]"
+        if "." in i[1]:
+            obj_name, method_name = i[1].split(".", 1)
+            return f"_call_method({obj_name!r}, {method_name!r}, {args}, {line_num})"
+        return f"_call({i[1]!r}, {args}, v)"
+
+    def emit_value(indent, name, expr, line_num):
+        """
+        Python source for the value set would store for expr, emitting
+        whatever has to run first into the local name
+        """
+        is_constant, value = _constant_value(expr)
+        if is_constant:
+            return repr(value)
+        native = _native_expression(expr)
+        if native is None and _compiles(expr):
+            native = f"_eval({expr!r}, v)"
+        if native is None:
+            return f"_resolved(v, {expr!r}, {line_num})"
+        out.emit(indent, "try:", line_num)
+        out.emit(indent + 1, f"{name} = {native}", line_num)
+        out.emit(indent, "except Exception:", line_num)
+        out.emit(indent + 1, f"{name} = _resolved(v, {expr!r}, {line_num})", line_num)
+        return name
+
+    def emit_statement(indent, index, line_num, i):
+        keyword = i[0]
+
+        if keyword == "set" and len(i) >= 4 and i[2] == "call":
+            out.emit(indent, f"v[{i[1]!r}] = {emit_call(i[2:], line_num)}", line_num)
+            return
+
+        if keyword == "return" and in_function:
+            if len(i) == 1:
+                out.emit(indent, "return None", line_num)
+                return
+            expr = " ".join(i[1:])
+            is_constant, value = _constant_value(expr)
+            if is_constant:
+                out.emit(indent, f"return {value!r}", line_num)
+                return
+            native = _native_expression(expr)
+            if native is None and _compiles(expr):
+                native = f"_eval({expr!r}, v)"
+            if native is None:
+                out.emit(indent, f"return _resolved(v, {expr!r}, {line_num})", line_num)
+                return
+            out.emit(indent, "try:", line_num)
+            out.emit(indent + 1, f"_result = {native}", line_num)
+            out.emit(indent, "except Exception:", line_num)
+            out.emit(indent + 1, f"_result = _resolved(v, {expr!r}, {line_num})", line_num)
+            out.emit(indent, "return _result", line_num)
+            return
+
+        if keyword == "set" and len(i) >= 3:
+            var_name = i[1]
+            expr = " ".join(i[2:])
+            is_constant, value = _constant_value(expr)
+            if is_constant:
+                out.emit(indent, f"v[{var_name!r}] = {value!r}", line_num)
+                return
+            native = _native_expression(expr)
+            if native is None and _compiles(expr):
+                native = f"_eval({expr!r}, v)"
+            if native is None:
+                out.emit(indent, f"_store(v, {var_name!r}, {expr!r}, {line_num})", line_num)
+                return
+            out.emit(indent, "try:", line_num)
+            out.emit(indent + 1, f"v[{var_name!r}] = {native}", line_num)
+            out.emit(indent, "except Exception:", line_num)
+            out.emit(indent + 1, f"_store(v, {var_name!r}, {expr!r}, {line_num})", line_num)
+            return
+
+        if keyword == "print" and len(i) >= 2:
+            out.emit(indent, f"_print(v, {' '.join(i[1:])!r})", line_num)
+            return
+
+        if keyword in COLLECTION_COMMANDS and len(i) >= 2:
+            try:
+                operation, value_exprs, target = collection_syntax(i)
+            except ValueError:
+                value_exprs = None
+            if value_exprs is not None:
+                values = []
+                for n, expr in enumerate(value_exprs):
+                    values.append(emit_value(indent, f"_item_{n}", expr, line_num))
+                out.emit(indent, f"_collection({operation!r}, {i[1]!r}, {target!r}, "
+                                 f"[{', '.join(values)}], v)", line_num)
+                return
+
+        if keyword == "call" and len(i) >= 2:
+            out.emit(indent, emit_call(i, line_num), line_num)
+            return
+
+        if keyword == "if" and "then" in i:
+            then_index = i.index("then")
+            try:
+                inline_commands = [parse_line(cmd.strip(), line_num, original_lines)
+                             for cmd in " ".join(i[then_index + 1:]).split(";")]
+            except CeronaError:
+                inline_commands = None
+            if inline_commands is not None:
+                out.emit(indent, f"if {_condition(i[1:then_index], line_num, source_line(line_num))}:", line_num)
+                first = len(out.lines)
+                for cmd in inline_commands:
+                    if cmd:
+                        emit_statement(indent + 1, None, line_num, cmd)
+                if len(out.lines) == first:
+                    out.emit(indent + 1, "pass", line_num)
+                return
+
+        is_block = index is not None and index in blocks
+
+        if keyword == "if" and is_block:
+            endif_index, else_index = blocks[index]
+            out.emit(indent, f"if {_condition(i[1:], line_num, source_line(line_num))}:", line_num)
+            emit_block(indent + 1, index + 1, else_index if else_index else endif_index)
+            if else_index is not None:
+                out.emit(indent, "else:", line_num)
+                emit_block(indent + 1, else_index + 1, endif_index)
+            return
+
+        if keyword == "while" and is_block:
+            out.emit(indent, f"while {_condition(i[1:], line_num, source_line(line_num))}:", line_num)
+            emit_block(indent + 1, index + 1, blocks[index][0])
+            return
+
+        if keyword == "for" and is_block and len(i) in (4, 5) and i[2] == "in":
+            loop_value = f"_value_{index}"
+            if len(i) == 5:
+                bounds = f"_bounds_{index}"
+                out.emit(indent, "try:", line_num)
+                out.emit(indent + 1, f"{bounds} = range(int({_operand(i[3])}), int({_operand(i[4])}))", line_num)
+                out.emit(indent, "except ValueError:", line_num)
+                out.emit(indent + 1, f"raise _range_error({line_num})", line_num)
+                out.emit(indent, f"for {loop_value} in {bounds}:", line_num)
+            else:
+                out.emit(indent, f"for {loop_value} in _iterable(v, {i[3]!r}, {line_num}):", line_num)
+            out.emit(indent + 1, f"v[{i[1]!r}] = {loop_value}", line_num)
+            emit_block(indent + 1, index + 1, blocks[index][0])
+            return
+
+        if block_keyword(i) in ("func", "class") and is_block:
+            # Registration stays with the interpreter; bodies become functions
+            end_index = blocks[index][0]
+            if keyword != "class":
+                pending.append(index + 1)
+            else:
+                member = index + 1
+                while member < end_index:
+                    if cleaned_keyword(member) == "func" and member in blocks:
+                        pending.append(member + 1)
+                    member = blocks[member][0] + 1 if member in blocks else member + 1
+
+        out.emit(indent, f"_exec({line_num}, {i!r}, v)", line_num)
+
+    def cleaned_keyword(index):
+        return commands[index][1][0]
+
+    def emit_block(indent, start, end):
+        first = len(out.lines)
+        index = start
+        while index < end:
+            line_num, i = commands[index]
+            emit_statement(indent, index, line_num, i)
+            index = blocks[index][0] + 1 if index in blocks else index + 1
+        if len(out.lines) == first:
+            out.emit(indent, "pass")
+
+    out.emit(0, f"# Generated by cerona from {filename}")
+    while pending:
+        start = pending.pop(0)
+        # A return at the top level is an error the interpreter reports
+        in_function = start != 0
+        if start == 0:
+            end = len(commands)
+        else:
+            end = blocks[start - 1][0]
+        name = f"_cerona_body_{start}"
+        bodies.append((start, name))
+        out.emit(0, "")
+        if start == 0:
+            out.emit(0, "def _cerona_body_0(v):")
+        else:
+            opener_line, opener = commands[start - 1]
+            out.emit(0, f"# {' '.join(opener)}", opener_line)
+            out.emit(0, f"def {name}(v):", opener_line)
+        emit_block(1, start, end)
+
+    out.emit(0, "")
+    out.emit(0, "BODIES = {" + ", ".join(f"{start}: {name}" for start, name in bodies) + "}")
+    return "\n".join(out.lines) + "\n", out.line_map
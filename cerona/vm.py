@@ -0,0 +1,991 @@
+"""
+Stack-based virtual machine for Cerona.
+
+compile_program() turns a parsed program into a Code object: parallel
+arrays of opcodes, operands and line numbers plus a constant pool.
+VirtualMachine runs a Code object in a single dispatch loop. Function and
+method calls push frames on an explicit stack instead of recursing, and
+every error is reported against the Cerona line of the failing
+instruction, exactly like the tree walker.
+
+Code objects can be written to disk with dumps()/save() and read back
+with loads()/load().
+"""
+import marshal
+import sys
+from array import array
+from types import CodeType
+
+from .main import (
+    CeronaError, CeronaClass, CeronaObject, ExpressionCache,
+    EXPRESSION_OPERATORS, coerce_number, parse_line, parse_condition,
+    call_scope, method_scope, eval_globals, _missing_end_message, RECURSION_LIMIT,
+    MemoCache, MISSING, COLLECTION_COMMANDS, collection_syntax, collection_command,
+)
+from .output import DirectOutput, read_input
+from .parallel import Loop, parse_header, run_parallel_for
+from .tasks import CHANNEL_CAPACITY, Channel, Scheduler, Task
+
+# --- INSTRUCTION SET ---
+OPCODES = [
+    "LOAD_CONST",         # push consts[arg]
+    "LOAD",               # push the variable or literal named by consts[arg] = (token, literal)
+    "EVAL_EXPR",          # push sandboxed eval of the code in consts[arg], or FAILED
+    "EVAL_PRINT",         # push eval of consts[arg] with the scope as globals, or FAILED
+    "STORE",              # pop into consts[arg] = (name, expr); FAILED applies the set fallback
+    "STORE_RESOLVED",     # apply the set fallback for consts[arg] = (name, expr)
+    "STORE_VAR",          # pop into the variable consts[arg]
+    "EVAL_VALUE",         # push what set would store for consts[arg] = (expr, code or None)
+    "PRINT",              # pop and print it; FAILED prints what consts[arg] names instead
+    "PRINT_UNEVALUATED",  # print what consts[arg] names
+    "COMPARE",            # pop right and left, push the result of comparison number arg
+    "JUMP",               # continue at arg
+    "JUMP_IF_FALSE",      # pop, continue at arg if it is false
+    "RANGE",              # pop end and start, push an iterator over range(start, end)
+    "GET_ITER",           # push an iterator over the for-loop iterable named by consts[arg]
+    "FOR_NEXT",           # push the next value of the iterator on top, or drop it and jump to arg
+    "DEFINE_FUNC",        # register consts[arg] = (name, params, entry)
+    "DEFINE_CLASS",       # register consts[arg] = (name, attributes, methods)
+    "CALL",               # call consts[arg] = (name, nargs, keep) with nargs popped arguments
+    "CALL_METHOD",        # call consts[arg] = (object, method, nargs, keep)
+    "NEW_OBJECT",         # create consts[arg] = (class, instance, nargs) and run its init
+    "RETURN",             # leave the current function or method with the popped result if arg is 1,
+                          # else None; calls made with keep push the result
+    "MEMO_STATS",         # print the cache statistics of the memo func consts[arg]
+    "INPUT",              # read consts[arg] = (name, prompt) from stdin
+    "SPAWN",              # start consts[arg] = (name, function, nargs) as a task and store it in name
+    "JOIN",               # wait for the task in the variable consts[arg] and store its result there
+    "CHANNEL",            # store a new channel in consts[arg] = (name, sized), popping the capacity if sized
+    "SEND",               # pop a value and send it to the channel in the variable consts[arg]
+    "RECV",               # receive from the channel in consts[arg] = (channel, name) into name
+    "COLLECTION",         # run the list, map, array or text operation consts[arg] = (operation, name, target, nvalues)
+                          # on nvalues popped values, storing its result in target unless it is None
+    "PARALLEL_FOR",       # pop last and first, run the parallel for consts[arg] = (var, start, end,
+                          # reductions) over range(first, last) (cerona.parallel)
+    "EXPR_STATEMENT",     # evaluate and print consts[arg] = (code, keyword), the unknown-command path
+    "RAISE",              # raise CeronaError(*consts[arg])
+    "HALT",
+]
+(LOAD_CONST, LOAD, EVAL_EXPR, EVAL_PRINT, STORE, STORE_RESOLVED, STORE_VAR,
+ EVAL_VALUE, PRINT, PRINT_UNEVALUATED, COMPARE, JUMP, JUMP_IF_FALSE, RANGE,
+ GET_ITER, FOR_NEXT, DEFINE_FUNC, DEFINE_CLASS, CALL, CALL_METHOD, NEW_OBJECT,
+ RETURN, MEMO_STATS, INPUT, SPAWN, JOIN, CHANNEL, SEND, RECV, COLLECTION, PARALLEL_FOR,
+ EXPR_STATEMENT, RAISE, HALT) = range(len(OPCODES))
+
+COMPARISONS = {
+    "equals": 0, "==": 0,
+    "notequals": 1, "!=": 1,
+    "greater": 2, ">": 2,
+    "greaterequals": 3, ">=": 3,
+    "less": 4, "<": 4,
+    "lessequals": 5, "<=": 5,
+    "contains": 6,
+    "in": 7,
+}
+
+FORMAT_VERSION = 7
+MAGIC = b"CRNB"
+
+# Pushed instead of a value when an expression fails to evaluate
+FAILED = object()
+
+_SANDBOX = {"__builtins__": None}
+
+
+def _resolve(token, scope):
+    """resolve_value: a variable, else the token with surrounding quotes removed"""
+    if token in scope:
+        return scope[token]
+    if len(token) >= 2 and token[0] == token[-1] and token[0] in ('"', "'"):
+        return token[1:-1]
+    return token
+
+
+class Code:
+    """A compiled Cerona program: array-backed instructions plus a constant pool"""
+    def __init__(self, source=()):
+        self.ops = array("B")
+        self.args = array("l")
+        self.lines = array("l")
+        self.consts = []
+        self.source = tuple(source)
+
+    def emit(self, op, arg=0, line_num=0):
+        """Append an instruction and return its address"""
+        self.ops.append(op)
+        self.args.append(arg)
+        self.lines.append(line_num or 0)
+        return len(self.ops) - 1
+
+    def const(self, value):
+        self.consts.append(value)
+        return len(self.consts) - 1
+
+    def patch(self, address, arg):
+        self.args[address] = arg
+
+    def __len__(self):
+        return len(self.ops)
+
+    def dumps(self):
+        """Serialize to bytes. Constants include code objects, so the Python version must match"""
+        payload = (
+            FORMAT_VERSION,
+            sys.implementation.cache_tag,
+            self.ops.tobytes(),
+            self.args.tobytes(),
+            self.lines.tobytes(),
+            tuple(self.consts),
+            self.source,
+        )
+        return MAGIC + marshal.dumps(payload)
+
+    @classmethod
+    def loads(cls, data):
+        if not data.startswith(MAGIC):
+            raise ValueError("not a Cerona bytecode file")
+        version, cache_tag, ops, args, lines, consts, source = marshal.loads(data[len(MAGIC):])
+        if version != FORMAT_VERSION or cache_tag != sys.implementation.cache_tag:
+            raise ValueError("bytecode was written by a different Cerona or Python version")
+        code = cls(source)
+        code.ops.frombytes(ops)
+        code.args.frombytes(args)
+        code.lines.frombytes(lines)
+        code.consts = list(consts)
+        return code
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.dumps())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls.loads(f.read())
+
+    def disassemble(self):
+        """Human readable listing, one instruction per line"""
+        listing = []
+        for address, (op, arg, line_num) in enumerate(zip(self.ops, self.args, self.lines)):
+            name = OPCODES[op]
+            detail = ""
+            if op in (JUMP, JUMP_IF_FALSE, FOR_NEXT, COMPARE):
+                detail = str(arg)
+            elif op not in (RETURN, HALT):
+                const = self.consts[arg]
+                shown = "<expression>" if isinstance(const, CodeType) else repr(const)
+                detail = f"{arg} ({shown})"
+            listing.append(f"{line_num:>5} {address:>6} {name:<18} {detail}".rstrip())
+        return "\n".join(listing)
+
+
+class _Compiler:
+    """Translates (line_num, tokens) statements into instructions"""
+    def __init__(self, code, commands, blocks, original_lines):
+        self.code = code
+        self.commands = commands
+        self.blocks = blocks
+        self.original_lines = original_lines
+
+    def source_line(self, line_num):
+        if line_num and line_num <= len(self.original_lines):
+            return self.original_lines[line_num - 1]
+        return None
+
+    def emit_raise(self, message, line_num, with_source=True):
+        content = self.source_line(line_num) if with_source else None
+        self.code.emit(RAISE, self.code.const((message, line_num, content)), line_num)
+
+    def emit_load(self, token, line_num):
+        literal = token
+        if (token.startswith('"') and token.endswith('"')) or (token.startswith("'") and token.endswith("'")):
+            literal = token[1:-1]
+        self.code.emit(LOAD, self.code.const((token, literal)), line_num)
+
+    def compile_expression(self, expr):
+        try:
+            return compile(expr.lstrip(" \t"), "<cerona>", "eval")
+        except (SyntaxError, ValueError):
+            return None
+
+    def block(self, start, end):
+        index = start
+        while index < end:
+            line_num, i = self.commands[index]
+            self.statement(index, line_num, i)
+            index = self.blocks[index][0] + 1 if index in self.blocks else index + 1
+
+    def condition(self, tokens, line_num):
+        """Emit instructions leaving the truth of an if/while condition on the stack"""
+        try:
+            node = parse_condition(tokens, line_num, self.source_line(line_num))
+        except CeronaError as e:
+            self.emit_raise(e.message, line_num)
+            return
+        self.emit_condition(node, line_num)
+
+    def emit_condition(self, node, line_num):
+        """and/or jump past the remaining parts as soon as the result is known"""
+        code = self.code
+        kind = node[0]
+        if kind == "compare":
+            left, operator, right = node[1:]
+            self.emit_load(left, line_num)
+            self.emit_load(right, line_num)
+            code.emit(COMPARE, COMPARISONS[operator], line_num)
+            return
+
+        if kind == "not":
+            self.emit_condition(node[1], line_num)
+            when_false = code.emit(JUMP_IF_FALSE, 0, line_num)
+            code.emit(LOAD_CONST, code.const(False), line_num)
+            done = code.emit(JUMP, 0, line_num)
+            code.patch(when_false, len(code))
+            code.emit(LOAD_CONST, code.const(True), line_num)
+            code.patch(done, len(code))
+            return
+
+        # and: any false part decides; or: any true part decides
+        decided = []
+        for part in node[1][:-1]:
+            self.emit_condition(part, line_num)
+            if kind == "and":
+                decided.append(code.emit(JUMP_IF_FALSE, 0, line_num))
+            else:
+                next_part = code.emit(JUMP_IF_FALSE, 0, line_num)
+                decided.append(code.emit(JUMP, 0, line_num))
+                code.patch(next_part, len(code))
+        self.emit_condition(node[1][-1], line_num)
+        done = code.emit(JUMP, 0, line_num)
+        for address in decided:
+            code.patch(address, len(code))
+        code.emit(LOAD_CONST, code.const(kind == "or"), line_num)
+        code.patch(done, len(code))
+
+    def statement(self, index, line_num, i):
+        code = self.code
+        keyword = i[0]
+        is_block = index is not None and index in self.blocks
+
+        if keyword == "set":
+            if len(i) < 3:
+                self.emit_raise("set requires variable name and value", line_num)
+                return
+            if i[2] == "call" and len(i) >= 4:
+                self.call(i[2:], line_num, keep=True)
+                code.emit(STORE_VAR, code.const(i[1]), line_num)
+                return
+            expr = " ".join(i[2:])
+            compiled = self.compile_expression(expr)
+            target = code.const((i[1], expr))
+            if compiled is None:
+                code.emit(STORE_RESOLVED, target, line_num)
+            else:
+                code.emit(EVAL_EXPR, code.const(compiled), line_num)
+                code.emit(STORE, target, line_num)
+
+        elif keyword == "print":
+            if len(i) < 2:
+                self.emit_raise("print requires at least one argument", line_num, with_source=False)
+                return
+            expr = " ".join(i[1:])
+            compiled = self.compile_expression(expr)
+            if compiled is None:
+                code.emit(PRINT_UNEVALUATED, code.const(expr), line_num)
+            else:
+                code.emit(EVAL_PRINT, code.const(compiled), line_num)
+                code.emit(PRINT, code.const(expr), line_num)
+
+        elif keyword == "class":
+            if len(i) < 2:
+                self.emit_raise("class requires class name", line_num)
+            elif not is_block:
+                self.emit_raise(_missing_end_message(i), line_num)
+            else:
+                self.class_definition(index, line_num, i)
+
+        elif keyword == "new":
+            if len(i) < 3:
+                self.emit_raise("new requires class name and instance name", line_num)
+                return
+            for arg in i[3:]:
+                self.emit_load(arg, line_num)
+            code.emit(NEW_OBJECT, code.const((i[1], i[2], len(i) - 3)), line_num)
+
+        elif keyword == "func" or keyword == "memo":
+            memo = keyword == "memo"
+            if memo:
+                if len(i) < 2 or i[1] != "func":
+                    self.emit_raise("memo must be followed by func NAME", line_num)
+                    return
+                i = i[1:]
+            if len(i) < 2:
+                self.emit_raise("func requires function name", line_num)
+            elif not is_block:
+                self.emit_raise(_missing_end_message(i), line_num)
+            else:
+                define = code.emit(DEFINE_FUNC, 0, line_num)
+                entry = self.function_body(index, line_num)
+                code.patch(define, code.const((i[1], tuple(i[2:]), entry, memo)))
+
+        elif keyword == "call":
+            if len(i) < 2:
+                self.emit_raise("call requires function name", line_num)
+                return
+            self.call(i, line_num)
+
+        elif keyword == "return":
+            if len(i) == 1:
+                code.emit(RETURN, 0, line_num)
+            else:
+                expr = " ".join(i[1:])
+                code.emit(EVAL_VALUE, code.const((expr, self.compile_expression(expr))), line_num)
+                code.emit(RETURN, 1, line_num)
+
+        elif keyword == "memostats":
+            if len(i) < 2:
+                self.emit_raise("memostats requires function name", line_num)
+                return
+            code.emit(MEMO_STATS, code.const(i[1]), line_num)
+
+        elif keyword == "if" and "then" in i:
+            then_index = i.index("then")
+            self.condition(i[1:then_index], line_num)
+            skip = code.emit(JUMP_IF_FALSE, 0, line_num)
+            try:
+                inline = [parse_line(cmd.strip(), line_num, self.original_lines)
+                          for cmd in " ".join(i[then_index + 1:]).split(";")]
+            except CeronaError as e:
+                code.emit(RAISE, code.const((e.message, e.line_num, e.line_content)), line_num)
+            else:
+                for cmd in inline:
+                    if cmd:
+                        self.statement(None, line_num, cmd)
+            code.patch(skip, len(code))
+
+        elif keyword == "if":
+            if not is_block:
+                self.emit_raise(_missing_end_message(i), line_num)
+                return
+            endif_index, else_index = self.blocks[index]
+            self.condition(i[1:], line_num)
+            skip = code.emit(JUMP_IF_FALSE, 0, line_num)
+            self.block(index + 1, else_index if else_index else endif_index)
+            if else_index is not None:
+                done = code.emit(JUMP, 0, line_num)
+                code.patch(skip, len(code))
+                self.block(else_index + 1, endif_index)
+                code.patch(done, len(code))
+            else:
+                code.patch(skip, len(code))
+
+        elif keyword == "while":
+            if not is_block:
+                self.emit_raise(_missing_end_message(i), line_num)
+                return
+            top = len(code)
+            self.condition(i[1:], line_num)
+            exit_jump = code.emit(JUMP_IF_FALSE, 0, line_num)
+            self.block(index + 1, self.blocks[index][0])
+            code.emit(JUMP, top, line_num)
+            code.patch(exit_jump, len(code))
+
+        elif keyword == "for":
+            if not is_block:
+                self.emit_raise(_missing_end_message(i), line_num)
+                return
+            if len(i) < 4 or i[2] != "in":
+                self.emit_raise("invalid for loop syntax (expected: for VAR in ITERABLE)", line_num)
+                return
+            if len(i) == 5:
+                self.emit_load(i[3], line_num)
+                self.emit_load(i[4], line_num)
+                code.emit(RANGE, 0, line_num)
+            elif len(i) == 4:
+                code.emit(GET_ITER, code.const(i[3]), line_num)
+            else:
+                self.emit_raise("invalid for loop syntax", line_num)
+                return
+            top = code.emit(FOR_NEXT, 0, line_num)
+            code.emit(STORE_VAR, code.const(i[1]), line_num)
+            self.block(index + 1, self.blocks[index][0])
+            code.emit(JUMP, top, line_num)
+            code.patch(top, len(code))
+
+        elif keyword == "input":
+            if len(i) < 2:
+                self.emit_raise("input requires variable name", line_num)
+                return
+            prompt = " ".join(i[2:]) if len(i) > 2 else ""
+            code.emit(INPUT, code.const((i[1], prompt)), line_num)
+
+        elif keyword in COLLECTION_COMMANDS:
+            try:
+                operation, value_exprs, target = collection_syntax(i)
+            except ValueError as e:
+                self.emit_raise(str(e), line_num)
+                return
+            for expr in value_exprs:
+                code.emit(EVAL_VALUE, code.const((expr, self.compile_expression(expr))), line_num)
+            code.emit(COLLECTION, code.const((operation, i[1], target, len(value_exprs))), line_num)
+
+        elif keyword == "parallel":
+            if not is_block:
+                self.emit_raise(_missing_end_message(i), line_num)
+                return
+            try:
+                var_name, first, last, reductions = parse_header(i)
+            except ValueError as e:
+                self.emit_raise(str(e), line_num)
+                return
+            # The body itself runs in the workers and is not compiled here
+            self.emit_load(first, line_num)
+            self.emit_load(last, line_num)
+            loop = (var_name, index + 1, self.blocks[index][0], reductions)
+            code.emit(PARALLEL_FOR, code.const(loop), line_num)
+
+        elif keyword == "spawn":
+            if len(i) < 4 or i[2] != "call":
+                self.emit_raise("invalid spawn syntax (expected: spawn NAME call FUNC ARGS...)", line_num)
+                return
+            for arg in i[4:]:
+                self.emit_load(arg, line_num)
+            code.emit(SPAWN, code.const((i[1], i[3], len(i) - 4)), line_num)
+
+        elif keyword == "join":
+            if len(i) != 2:
+                self.emit_raise("join requires task name", line_num)
+                return
+            code.emit(JOIN, code.const(i[1]), line_num)
+
+        elif keyword == "channel":
+            if len(i) not in (2, 3):
+                self.emit_raise("channel requires channel name and optional capacity", line_num)
+                return
+            if len(i) == 3:
+                self.emit_load(i[2], line_num)
+            code.emit(CHANNEL, code.const((i[1], len(i) == 3)), line_num)
+
+        elif keyword == "send":
+            if len(i) < 3:
+                self.emit_raise("send requires channel name and value", line_num)
+                return
+            expr = " ".join(i[2:])
+            code.emit(EVAL_VALUE, code.const((expr, self.compile_expression(expr))), line_num)
+            code.emit(SEND, code.const(i[1]), line_num)
+
+        elif keyword == "recv":
+            if len(i) != 3:
+                self.emit_raise("recv requires channel name and variable name", line_num)
+                return
+            code.emit(RECV, code.const((i[1], i[2])), line_num)
+
+        else:
+            compiled = self.compile_expression(" ".join(i))
+            code.emit(EXPR_STATEMENT, code.const((compiled, keyword)), line_num)
+
+    def call(self, i, line_num, keep=False):
+        """Emit "call NAME ARGS..."; with keep the result is left on the stack"""
+        code = self.code
+        for arg in i[2:]:
+            self.emit_load(arg, line_num)
+        if "." in i[1]:
+            obj_name, method_name = i[1].split(".", 1)
+            code.emit(CALL_METHOD, code.const((obj_name, method_name, len(i) - 2, keep)), line_num)
+        else:
+            code.emit(CALL, code.const((i[1], len(i) - 2, keep)), line_num)
+
+    def function_body(self, index, line_num):
+        """Emit a jump over the body of the func at index, the body and its RETURN; return the entry"""
+        code = self.code
+        over = code.emit(JUMP, 0, line_num)
+        entry = len(code)
+        self.block(index + 1, self.blocks[index][0])
+        code.emit(RETURN, 0, line_num)
+        code.patch(over, len(code))
+        return entry
+
+    def class_definition(self, index, line_num, i):
+        code = self.code
+        end_index = self.blocks[index][0]
+        attributes = []
+        methods = []
+
+        define = code.emit(DEFINE_CLASS, 0, line_num)
+        member = index + 1
+        while member < end_index:
+            ln, cmd = self.commands[member]
+            if cmd[0] == "set":
+                if len(cmd) >= 3:
+                    attributes.append((cmd[1], " ".join(cmd[2:])))
+            elif cmd[0] == "memo":
+                code.ops[define] = RAISE
+                code.patch(define, code.const(("memo func is not supported for methods", ln, self.source_line(ln))))
+                return
+            elif cmd[0] == "func":
+                if len(cmd) < 2:
+                    code.ops[define] = RAISE
+                    code.patch(define, code.const(("func requires function name", ln, self.source_line(ln))))
+                    return
+                if member not in self.blocks:
+                    code.ops[define] = RAISE
+                    code.patch(define, code.const((f"missing 'endfunc' for method '{cmd[1]}'", ln, self.source_line(ln))))
+                    return
+                methods.append((cmd[1], tuple(cmd[2:]), self.function_body(member, ln)))
+                member = self.blocks[member][0]
+            member += 1
+
+        code.patch(define, code.const((i[1], tuple(attributes), tuple(methods))))
+
+
+def compile_program(commands, blocks, original_lines=()):
+    """Compile a parsed program and its block table into a Code object"""
+    code = Code(original_lines)
+    _Compiler(code, commands, blocks, original_lines).block(0, len(commands))
+    code.emit(HALT, 0, 0)
+    return code
+
+
+class VirtualMachine:
+    """
+    Executes a Code object; owns the functions, classes and objects it defines.
+
+    At most recursion_limit calls (cerona.main.RECURSION_LIMIT by default)
+    can be active at once. Printed lines go to output (a cerona.output
+    writer; print() directly when none is given) and input reads from
+    stdin (see cerona.output.read_input). expressions may be an
+    ExpressionCache shared with other runs of the same program, and
+    filename the name its errors are reported under. Spawned
+    tasks (cerona.tasks) run execute() from the function's entry on
+    threads of their own, each with its own frames.
+    """
+    def __init__(self, code, recursion_limit=None, output=None, expressions=None, stdin=None,
+                 directory=None, filename="<input>"):
+        self.code = code
+        self.recursion_limit = RECURSION_LIMIT if recursion_limit is None else recursion_limit
+        self.output = DirectOutput() if output is None else output
+        self.stdin = stdin
+        # Where relative paths are taken from, if not the working directory
+        self.directory = directory
+        self.filename = filename
+        self.functions = {}
+        self.memos = {}
+        self.classes = {}
+        self.objects = {}
+        # Where each function was defined, for parallel for
+        self.function_lines = {}
+        self.expressions = ExpressionCache() if expressions is None else expressions
+        self.scheduler = None
+
+    def source_line(self, line_num):
+        source = self.code.source
+        return source[line_num - 1] if line_num and line_num <= len(source) else None
+
+    def recursion_error(self, pc):
+        line_num = self.code.lines[pc - 1]
+        raise CeronaError(
+            f"recursion limit exceeded ({self.recursion_limit} nested calls)",
+            line_num,
+            self.source_line(line_num)
+        )
+
+    def resolved_value(self, expr, scope):
+        """The value of a set or return expression that did not evaluate as Python"""
+        resolved = _resolve(expr, scope)
+        if isinstance(resolved, str) and any(op in resolved for op in EXPRESSION_OPERATORS):
+            try:
+                return self.expressions.eval(resolved, _SANDBOX, scope)
+            except:
+                return resolved
+        return resolved
+
+    def store_resolved(self, name, expr, scope):
+        """The set fallback for values that did not evaluate as a Python expression"""
+        scope[name] = self.resolved_value(expr, scope)
+
+    def print_unevaluated(self, expr, scope):
+        write_line = self.output.line
+        if expr in scope:
+            write_line(scope[expr])
+            return
+        for obj in self.objects.values():
+            if obj.has_attr(expr):
+                write_line(obj.get_attr(expr))
+                return
+        write_line(expr)
+
+    def iterable(self, token, scope):
+        value = _resolve(token, scope)
+        if isinstance(value, str):
+            try:
+                return self.expressions.eval(value, _SANDBOX, scope)
+            except:
+                return value
+        return value
+
+    def method_scope(self, obj, method_name, args, root):
+        """Build the scope a method runs in and return (scope, entry)"""
+        methods = obj.class_def.methods
+        if method_name not in methods:
+            raise CeronaError(f"method '{method_name}' not found in class '{obj.class_def.name}'")
+        params, entry = methods[method_name]
+        if len(args) != len(params):
+            raise CeronaError(f"method '{method_name}' expects {len(args)} arguments, got {len(args)}")
+        scope = method_scope(obj, root)
+        scope.update(zip(params, args))
+        return scope, entry
+
+    def run(self, variables):
+        """Run the program with variables as its global scope"""
+        try:
+            self.execute(0, variables, variables)
+        except BaseException:
+            if self.scheduler is not None:
+                self.scheduler.finish(failed=True)
+            raise
+        if self.scheduler is not None:
+            self.scheduler.finish()
+        return variables
+
+    def tasks(self):
+        """The Scheduler of this run, made by its first spawn or channel (see cerona.tasks)"""
+        if self.scheduler is None:
+            self.scheduler = Scheduler()
+        return self.scheduler
+
+    def variable(self, name, kind, scope, pc):
+        """The task or channel (kind) in the variable name"""
+        value = scope.get(name)
+        if not isinstance(value, kind):
+            line_num = self.code.lines[pc - 1]
+            raise CeronaError(f"'{name}' is not a {kind.__name__.lower()}", line_num, self.source_line(line_num))
+        return value
+
+    def spawn(self, name, target, args, scope, variables, pc):
+        """Start target (a function or obj.method) with args as a task"""
+        if "." in target:
+            obj_name, method_name = target.split(".", 1)
+            if obj_name not in self.objects:
+                line_num = self.code.lines[pc - 1]
+                raise CeronaError(f"undefined object '{obj_name}'", line_num, self.source_line(line_num))
+            obj = self.objects[obj_name]
+            method_scope, entry = self.method_scope(obj, method_name, args, variables)
+
+            def work():
+                value = self.execute(entry, method_scope, variables, call=True)
+                obj.update_from(method_scope)
+                return value
+        else:
+            if target not in self.functions:
+                line_num = self.code.lines[pc - 1]
+                raise CeronaError(f"undefined function '{target}'", line_num, self.source_line(line_num))
+            params, entry = self.functions[target]
+            if len(args) != len(params):
+                raise CeronaError(f"function '{target}' expects {len(params)} arguments, got {len(args)}")
+            memo = self.memos.get(target)
+            key = memo.key(args) if memo is not None else None
+            func_scope = call_scope(scope)
+            func_scope.update(zip(params, args))
+
+            def work():
+                if key is not None:
+                    value = memo.lookup(key)
+                    if value is not MISSING:
+                        return value
+                value = self.execute(entry, func_scope, variables, call=True)
+                if key is not None:
+                    memo.remember(key, value)
+                return value
+        return self.tasks().spawn(name, work)
+
+    def execute(self, pc, scope, variables, call=False):
+        """
+        Run from pc in scope until HALT, or with call set until the
+        function or method started at pc returns, and return its result
+        """
+        code = self.code
+        ops = code.ops.tolist()
+        operands = code.args.tolist()
+        consts = code.consts
+        functions = self.functions
+        memos = self.memos
+        objects = self.objects
+
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        frames = []
+        recursion_limit = self.recursion_limit
+        write_line = self.output.line
+
+        try:
+            while True:
+                op = ops[pc]
+                arg = operands[pc]
+                pc += 1
+
+                if op == LOAD:
+                    token, literal = consts[arg]
+                    push(scope[token] if token in scope else literal)
+                elif op == COMPARE:
+                    right = pop()
+                    left = pop()
+                    if arg < 2 or arg > 5:
+                        # equals, notequals, contains and in compare text
+                        if left.__class__ is not str:
+                            left = str(left)
+                        if right.__class__ is not str:
+                            right = str(right)
+                    if arg == 0:
+                        push(left == right)
+                    elif arg == 1:
+                        push(left != right)
+                    elif arg == 2:
+                        push(coerce_number(left) > coerce_number(right))
+                    elif arg == 3:
+                        push(coerce_number(left) >= coerce_number(right))
+                    elif arg == 4:
+                        push(coerce_number(left) < coerce_number(right))
+                    elif arg == 5:
+                        push(coerce_number(left) <= coerce_number(right))
+                    elif arg == 6:
+                        push(right in left)
+                    else:
+                        push(left in right)
+                elif op == JUMP_IF_FALSE:
+                    if not pop():
+                        pc = arg
+                elif op == JUMP:
+                    pc = arg
+                elif op == EVAL_EXPR:
+                    try:
+                        push(eval(consts[arg], _SANDBOX, scope))
+                    except Exception:
+                        push(FAILED)
+                elif op == STORE:
+                    value = pop()
+                    name, expr = consts[arg]
+                    if value is FAILED:
+                        self.store_resolved(name, expr, scope)
+                    else:
+                        scope[name] = value
+                elif op == FOR_NEXT:
+                    value = next(stack[-1], FAILED)
+                    if value is FAILED:
+                        pop()
+                        pc = arg
+                    else:
+                        push(value)
+                elif op == STORE_VAR:
+                    scope[consts[arg]] = pop()
+                elif op == EVAL_PRINT:
+                    try:
+                        push(eval(consts[arg], eval_globals(consts[arg], scope)))
+                    except Exception:
+                        push(FAILED)
+                elif op == PRINT:
+                    value = pop()
+                    if value is FAILED:
+                        self.print_unevaluated(consts[arg], scope)
+                    else:
+                        write_line(value)
+                elif op == PRINT_UNEVALUATED:
+                    self.print_unevaluated(consts[arg], scope)
+                elif op == STORE_RESOLVED:
+                    name, expr = consts[arg]
+                    self.store_resolved(name, expr, scope)
+                elif op == LOAD_CONST:
+                    push(consts[arg])
+                elif op == CALL:
+                    func_name, nargs, keep = consts[arg]
+                    args = stack[len(stack) - nargs:]
+                    del stack[len(stack) - nargs:]
+                    memo = memos.get(func_name)
+                    if memo is not None:
+                        key = memo.key(args)
+                        if key is None:
+                            memo = None
+                        else:
+                            value = memo.lookup(key)
+                            if value is not MISSING:
+                                if keep:
+                                    push(value)
+                                continue
+                            memo = (memo, key)
+                    if func_name not in functions:
+                        raise CeronaError(f"undefined function '{func_name}'")
+                    params, entry = functions[func_name]
+                    if len(args) != len(params):
+                        raise CeronaError(
+                            f"function '{func_name}' expects {len(params)} arguments, got {len(args)}"
+                        )
+                    if len(frames) >= recursion_limit:
+                        self.recursion_error(pc)
+                    frames.append((pc, scope, None, len(stack), keep, memo))
+                    scope = call_scope(scope)
+                    scope.update(zip(params, args))
+                    pc = entry
+                elif op == RETURN:
+                    value = pop() if arg else None
+                    if not frames:
+                        if call:
+                            return value
+                        line_num = code.lines[pc - 1]
+                        raise CeronaError("return outside function", line_num, self.source_line(line_num))
+                    pc, caller_scope, obj, height, keep, memo = frames.pop()
+                    if len(stack) > height:
+                        # Drop what loops left on the stack when returning from inside them
+                        del stack[height:]
+                    if obj is not None:
+                        # Update instance variables from method scope
+                        obj.update_from(scope)
+                    if memo is not None:
+                        memo[0].remember(memo[1], value)
+                    scope = caller_scope
+                    if keep:
+                        push(value)
+                elif op == CALL_METHOD:
+                    obj_name, method_name, nargs, keep = consts[arg]
+                    args = stack[len(stack) - nargs:]
+                    del stack[len(stack) - nargs:]
+                    if obj_name not in objects:
+                        line_num = code.lines[pc - 1]
+                        raise CeronaError(f"undefined object '{obj_name}'", line_num, self.source_line(line_num))
+                    obj = objects[obj_name]
+                    method_scope, entry = self.method_scope(obj, method_name, args, variables)
+                    if len(frames) >= recursion_limit:
+                        self.recursion_error(pc)
+                    frames.append((pc, scope, obj, len(stack), keep, None))
+                    scope = method_scope
+                    pc = entry
+                elif op == RANGE:
+                    end = pop()
+                    start = pop()
+                    try:
+                        start = int(start)
+                        end = int(end)
+                    except ValueError:
+                        line_num = code.lines[pc - 1]
+                        raise CeronaError(
+                            "for loop range bounds must be integers",
+                            line_num,
+                            self.source_line(line_num)
+                        )
+                    push(iter(range(start, end)))
+                elif op == GET_ITER:
+                    push(iter(self.iterable(consts[arg], scope)))
+                elif op == DEFINE_FUNC:
+                    name, params, entry, memo = consts[arg]
+                    functions[name] = (params, entry)
+                    self.function_lines[name] = code.lines[pc - 1]
+                    if memo:
+                        memos[name] = MemoCache()
+                    else:
+                        memos.pop(name, None)
+                elif op == EVAL_VALUE:
+                    expr, compiled = consts[arg]
+                    try:
+                        if compiled is None:
+                            raise SyntaxError(expr)
+                        push(eval(compiled, _SANDBOX, scope))
+                    except Exception:
+                        push(self.resolved_value(expr, scope))
+                elif op == MEMO_STATS:
+                    if consts[arg] not in memos:
+                        line_num = code.lines[pc - 1]
+                        raise CeronaError(f"'{consts[arg]}' is not a memo func", line_num, self.source_line(line_num))
+                    write_line(memos[consts[arg]].stats(consts[arg]))
+                elif op == DEFINE_CLASS:
+                    name, attribute_exprs, method_defs = consts[arg]
+                    attributes = {}
+                    for attr_name, attr_value in attribute_exprs:
+                        try:
+                            attributes[attr_name] = self.expressions.eval(attr_value, _SANDBOX, {})
+                        except:
+                            attributes[attr_name] = attr_value
+                    methods = {method: (params, entry) for method, params, entry in method_defs}
+                    self.classes[name] = CeronaClass(name, attributes, methods, code.lines[pc - 1])
+                elif op == NEW_OBJECT:
+                    class_name, instance_name, nargs = consts[arg]
+                    args = stack[len(stack) - nargs:]
+                    del stack[len(stack) - nargs:]
+                    if class_name not in self.classes:
+                        line_num = code.lines[pc - 1]
+                        raise CeronaError(f"undefined class '{class_name}'", line_num, self.source_line(line_num))
+                    class_def = self.classes[class_name]
+                    obj = CeronaObject(class_def)
+                    objects[instance_name] = obj
+                    if "init" in class_def.methods:
+                        method_scope, entry = self.method_scope(obj, "init", args, variables)
+                        if len(frames) >= recursion_limit:
+                            self.recursion_error(pc)
+                        frames.append((pc, scope, obj, len(stack), False, None))
+                        scope = method_scope
+                        pc = entry
+                elif op == INPUT:
+                    name, prompt = consts[arg]
+                    if self.scheduler is None:
+                        scope[name] = read_input(prompt, self.output, self.stdin)
+                    else:
+                        scope[name] = self.scheduler.read_input(prompt, self.output, self.stdin)
+                elif op == COLLECTION:
+                    operation, name, target, nvalues = consts[arg]
+                    values = stack[len(stack) - nvalues:]
+                    del stack[len(stack) - nvalues:]
+                    result = collection_command(operation, name, scope, values, self.directory)
+                    if target is not None:
+                        scope[target] = result
+                elif op == PARALLEL_FOR:
+                    last = pop()
+                    first = pop()
+                    try:
+                        first = int(first)
+                        last = int(last)
+                    except ValueError:
+                        line_num = code.lines[pc - 1]
+                        raise CeronaError(
+                            "for loop range bounds must be integers",
+                            line_num,
+                            self.source_line(line_num)
+                        )
+                    defined = {name: (params, self.function_lines[name], name in memos)
+                               for name, (params, entry) in functions.items()}
+                    run_parallel_for(Loop(*consts[arg]), first, last, scope, defined, "\n".join(code.source),
+                                     self.filename, "vm", self.recursion_limit, self.output,
+                                     self.directory,
+                                     {name: class_def.line_num for name, class_def in self.classes.items()},
+                                     objects)
+                elif op == SPAWN:
+                    name, target, nargs = consts[arg]
+                    args = stack[len(stack) - nargs:]
+                    del stack[len(stack) - nargs:]
+                    scope[name] = self.spawn(name, target, args, scope, variables, pc)
+                elif op == JOIN:
+                    scope[consts[arg]] = self.tasks().join(self.variable(consts[arg], Task, scope, pc))
+                elif op == CHANNEL:
+                    name, sized = consts[arg]
+                    capacity = int(pop()) if sized else CHANNEL_CAPACITY
+                    scope[name] = Channel(self.tasks(), name, capacity)
+                elif op == SEND:
+                    self.variable(consts[arg], Channel, scope, pc).send(pop())
+                elif op == RECV:
+                    channel, name = consts[arg]
+                    scope[name] = self.variable(channel, Channel, scope, pc).recv()
+                elif op == EXPR_STATEMENT:
+                    compiled, keyword = consts[arg]
+                    try:
+                        if compiled is None:
+                            raise SyntaxError(keyword)
+                        write_line(eval(compiled, _SANDBOX, scope))
+                    except Exception:
+                        line_num = code.lines[pc - 1]
+                        raise CeronaError(f"unknown command '{keyword}'", line_num, self.source_line(line_num))
+                elif op == RAISE:
+                    raise CeronaError(*consts[arg])
+                elif op == HALT:
+                    return variables
+        except CeronaError:
+            raise
+        except Exception as e:
+            line_num = code.lines[pc - 1]
+            raise CeronaError(f"runtime error: {str(e)}", line_num, self.source_line(line_num))
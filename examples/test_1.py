@@ -1,6 +1,20 @@
+import importlib
 import io
+import os
 import sys
-from cerona.main import execute
+
+import pytest
+
+from cerona.main import execute, emit_python, ExpressionCache, ENGINES
+
+# cerona/__init__.py defines main(), which shadows the submodule attribute
+cerona_main = importlib.import_module("cerona.main")
+
+@pytest.fixture(autouse=True, params=ENGINES)
+def engine(request, monkeypatch):
+    """Run every test once per execution engine; their output must match."""
+    monkeypatch.setattr(cerona_main, "DEFAULT_ENGINE", request.param)
+    return request.param
 
 def run_cerona(code: str) -> str:
     """Capture stdout from executing Cerona code."""
@@ -206,3 +220,1146 @@ def test_OOP():
     """
     output = run_cerona(code)
     assert output == "2\n10"
+
+# Block structure tests
+def test_inline_if_inside_block():
+    code = """
+    set total 0
+    for i in 0 3
+        if i equals 1
+            set total total + 10
+        else
+            set total total + 1
+        endif
+        if i equals 2 then print("last")
+    endfor
+    print(total)
+    """
+    output = run_cerona(code)
+    assert output == "last\n12"
+
+def test_unmatched_block_reported_at_load_time(capsys):
+    with pytest.raises(SystemExit):
+        execute('print("before")\nwhile x less 3\n')
+    captured = capsys.readouterr()
+    assert "before" not in captured.out
+    assert "missing 'endwhile' for while loop" in captured.err
+
+# Tokenizer tests
+@pytest.mark.parametrize("line, tokens", [
+    ('print("a (b)" x)  # note', ['print', 'a (b)', 'x']),
+    ('if x in "#tag" then print(1)', ['if', 'x', 'in', '#tag', 'then', 'print', '1']),
+    ('say"hi"there', ['say', 'hi', 'there']),
+    ("set s 'it''s'", ['set', 's', 'it', 's']),
+    (r'set p "C:\\dir\"x"', ['set', 'p', 'C:\\dir"x']),
+    (r'a\ b "c"', ['a b', 'c']),
+    ('((print x))', ['print', 'x']),
+    ('# only a comment', []),
+])
+def test_parse_line_tokens(line, tokens):
+    assert cerona_main.parse_line(line, 1) == tokens
+
+def test_parse_line_rejects_unterminated_strings():
+    with pytest.raises(cerona_main.CeronaError, match="unterminated string literal"):
+        cerona_main.parse_line('print("open', 1)
+
+# Expression cache tests
+def test_expression_cache_compiles_once():
+    cache = ExpressionCache()
+    for n in range(5):
+        assert cache.eval("x + 1", {"__builtins__": None}, {"x": n}) == n + 1
+    assert cache.misses == 1
+    assert cache.hits == 4
+
+def test_expression_cache_is_bounded():
+    cache = ExpressionCache(maxsize=2)
+    for expr in ["1", "2", "3"]:
+        cache.compile(expr)
+    assert len(cache) == 2
+    assert ("1", "eval") not in cache.codes
+
+def test_expression_cache_remembers_syntax_errors():
+    cache = ExpressionCache()
+    for _ in range(3):
+        with pytest.raises(SyntaxError):
+            cache.compile("Hello World")
+    assert cache.misses == 1
+
+# Engine tests
+def test_closure_engine_nested_loops_and_functions():
+    code = """
+    func report label value
+        print(label)
+        print(value)
+    endfunc
+    set total 0
+    set i 0
+    while i less 4
+        for j in 0 3
+            if j equals 1
+                set total total + i
+            else
+                set total total + 1
+            endif
+        endfor
+        set i i + 1
+    endwhile
+    call report "result" total
+    """
+    assert run_cerona(code) == "result\n14"
+
+def test_unknown_engine_is_rejected():
+    with pytest.raises(ValueError):
+        execute("print(1)", engine="turbo")
+
+def test_runtime_errors_keep_cerona_line_numbers(capsys):
+    code = "set a 1\nif a less abc\n    print(1)\nendif\n"
+    with pytest.raises(SystemExit):
+        execute(code)
+    assert "error at line 2: runtime error" in capsys.readouterr().err
+
+# Transpiler tests
+def test_emit_python_uses_native_loops():
+    source = emit_python("set i 0\nwhile i less 3\n    set i i + 1\nendwhile\n")
+    assert "def _cerona_body_0(v):" in source
+    assert "while _num(" in source
+    assert "v['i'] = v['i'] + 1" in source
+    compile(source, "<generated>", "exec")
+
+def test_emit_python_compiles_function_bodies():
+    source = emit_python("func greet name\n    print(name)\nendfunc\ncall greet bob\n")
+    assert "def _cerona_body_1(v):" in source
+    assert "BODIES = {0: _cerona_body_0, 1: _cerona_body_1}" in source
+
+# Bytecode VM tests
+def compile_for_vm(code):
+    from cerona.main import parse_program, build_block_table
+    from cerona.vm import compile_program
+
+    original_lines = code.split("\n")
+    cleaned = parse_program(original_lines)
+    line_index, blocks = build_block_table(cleaned, original_lines)
+    return compile_program(cleaned, blocks, original_lines)
+
+def test_vm_bytecode_round_trips_through_disk(tmp_path):
+    from cerona.vm import Code, VirtualMachine
+
+    bytecode = compile_for_vm("set total 0\nfor i in 0 5\n    set total total + i\nendfor\nprint(total)")
+    path = tmp_path / "program.ceronab"
+    bytecode.save(path)
+    loaded = Code.load(path)
+    assert loaded.ops == bytecode.ops
+    assert loaded.lines == bytecode.lines
+    assert loaded.disassemble() == bytecode.disassemble()
+
+    old_stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        VirtualMachine(loaded).run({})
+        assert sys.stdout.getvalue() == "10\n"
+    finally:
+        sys.stdout = old_stdout
+
+def test_vm_calls_do_not_use_the_python_stack():
+    from cerona.vm import VirtualMachine
+
+    bytecode = compile_for_vm("""
+func down n
+    if n greater 0
+        set m n - 1
+        call down m
+    endif
+endfunc
+set start 5000
+call down start
+print("done")
+""")
+    old_stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        VirtualMachine(bytecode).run({})
+        assert sys.stdout.getvalue() == "done\n"
+    finally:
+        sys.stdout = old_stdout
+
+# Parsed program cache tests
+def run_file(path):
+    old_stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        cerona_main.ifs(path.read_text(), str(path))
+        return sys.stdout.getvalue().strip()
+    finally:
+        sys.stdout = old_stdout
+
+def test_parsed_program_is_cached_next_to_source(tmp_path, monkeypatch):
+    monkeypatch.delenv("CERONA_NO_CACHE", raising=False)
+    monkeypatch.delenv("CERONA_CACHE_DIR", raising=False)
+    script = tmp_path / "hello.cerona"
+    script.write_text('set x 2\nprint(x * 21)\n')
+    assert run_file(script) == "42"
+    assert (tmp_path / "hello.ceronac").exists()
+
+    def no_parsing(lines):
+        raise AssertionError("program was parsed again")
+    monkeypatch.setattr(cerona_main, "parse_program", no_parsing)
+    monkeypatch.setattr("cerona.cache.parse_program", no_parsing)
+    assert run_file(script) == "42"
+
+def test_parsed_program_cache_notices_edits(tmp_path, monkeypatch):
+    monkeypatch.delenv("CERONA_NO_CACHE", raising=False)
+    monkeypatch.setenv("CERONA_CACHE_DIR", str(tmp_path / "cache"))
+    script = tmp_path / "edit.cerona"
+    script.write_text('print("old")\n')
+    assert run_file(script) == "old"
+    script.write_text('print("new")\n')
+    assert run_file(script) == "new"
+    assert len(list((tmp_path / "cache").iterdir())) == 1
+
+def test_parsed_program_cache_can_be_disabled(tmp_path, monkeypatch):
+    monkeypatch.setenv("CERONA_NO_CACHE", "1")
+    script = tmp_path / "nocache.cerona"
+    script.write_text('print("hi")\n')
+    assert run_file(script) == "hi"
+    assert not (tmp_path / "nocache.ceronac").exists()
+
+# Streaming tests
+def run_streamed(source, engine):
+    if engine not in cerona_main.STREAM_ENGINES:
+        pytest.skip(f"engine '{engine}' does not stream")
+    old_stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        cerona_main.ifs(source, stream=True)
+        return sys.stdout.getvalue().strip()
+    finally:
+        sys.stdout = old_stdout
+
+def test_stream_runs_blocks_functions_and_classes(engine):
+    code = """
+    func square n
+        set r n * n
+        print(r)
+    endfunc
+    set i 0
+    while i less 3
+        call square i
+        set i i + 1
+    endwhile
+    class Box
+        set size 4
+        func show
+            print(size)
+        endfunc
+    endclass
+    new Box b
+    call b.show
+    """
+    assert run_streamed(io.StringIO(code), engine) == "0\n1\n4\n4"
+
+def test_stream_runs_each_statement_as_it_is_read(engine):
+    def lines():
+        yield 'print("first")\n'
+        # The first statement has already run by the time the next line is read
+        assert sys.stdout.getvalue() == "first\n"
+        yield 'print("second")\n'
+    assert run_streamed(lines(), engine) == "first\nsecond"
+
+def test_stream_forgets_statements_that_ran(engine, monkeypatch):
+    from cerona import stream
+    windows = []
+    original = stream.SourceWindow.__init__
+    def remember(self):
+        original(self)
+        windows.append(self)
+    monkeypatch.setattr(stream.SourceWindow, "__init__", remember)
+    code = "func f\n    print(1)\nendfunc\n" + "set x 1\n" * 500 + "call f\n"
+    assert run_streamed(code, engine) == "1"
+    assert sorted(windows[0].lines) == [1, 2, 3]
+
+def test_stream_reports_unclosed_blocks(engine, capsys):
+    with pytest.raises(SystemExit):
+        run_streamed("print(1)\nwhile x less 3\nprint(2)\n", engine)
+    assert "error at line 2: missing 'endwhile' for while loop" in capsys.readouterr().err
+
+# Call frame tests
+def test_functions_see_caller_variables_but_keep_their_own():
+    code = """
+    set g 100
+    func inner
+        print(g + outer_local)
+        set g 5
+    endfunc
+    func outer n
+        set outer_local n * 2
+        call inner
+        print(g)
+    endfunc
+    set start 7
+    call outer start
+    print(g)
+    """
+    assert run_cerona(code) == "114\n100\n100"
+
+def test_print_in_function_evaluates_nested_scopes():
+    code = """
+    set items [1, 2, 3]
+    func scaled n
+        print [x * n for x in items]
+    endfunc
+    set k 10
+    call scaled k
+    """
+    assert run_cerona(code) == "[10, 20, 30]"
+
+def test_methods_see_globals_and_update_instance_variables():
+    code = """
+    set step 3
+    class Counter
+        set count 1
+        func bump
+            set count count * step
+        endfunc
+        func show
+            print(count)
+        endfunc
+    endclass
+    new Counter c
+    call c.bump
+    call c.bump
+    call c.show
+    """
+    assert run_cerona(code) == "9"
+
+def test_call_scope_does_not_copy_globals():
+    globals_ = {"a": 1, "b": 2}
+    frame = cerona_main.call_scope(globals_)
+    frame["n"] = 3
+    nested = cerona_main.call_scope(frame)
+    assert dict(nested) == {"n": 3}
+    assert nested.parent is globals_
+    assert nested["a"] == 1 and "b" in nested and "zzz" not in nested
+
+# Object layout tests
+def test_objects_store_declared_attributes_by_layout():
+    point = cerona_main.CeronaClass("Point", {"x": 0, "y": 0}, {}, 1)
+    assert point.layout == {"x": 0, "y": 1}
+    obj = cerona_main.CeronaObject(point)
+    obj.set_attr("y", 5)
+    assert obj.values == [0, 5] and obj.extra is None
+    assert not hasattr(obj, "__dict__")
+
+def test_objects_fall_back_to_a_dict_for_undeclared_attributes():
+    point = cerona_main.CeronaClass("Point", {"x": 0}, {}, 1)
+    obj = cerona_main.CeronaObject(point, {"x": 1, "label": "a"})
+    assert obj.get_attr("label") == "a" and obj.has_attr("label")
+    assert obj.get_attr("missing") is None and not obj.has_attr("missing")
+    assert obj.instance_vars == {"x": 1, "label": "a"}
+    assert cerona_main.CeronaObject(point).get_attr("x") == 0
+
+# Compiled condition tests
+def test_compiled_conditions_match_operator_semantics():
+    scope = {"i": 3, "text": "7", "word": "hello"}
+    assert cerona_main.compile_condition(["i", "less", "10"])(scope)
+    assert cerona_main.compile_condition(["text", "greater", "i"])(scope)
+    assert cerona_main.compile_condition(["i", "equals", "3"])(scope)
+    assert not cerona_main.compile_condition(["i", "equals", "3.0"])(scope)
+    assert cerona_main.compile_condition(["word", "contains", "ell"])(scope)
+    assert cerona_main.compile_condition(["ell", "in", "word"])(scope)
+    assert cerona_main.compile_condition(["missing", "equals", "missing"])(scope)
+
+def test_malformed_conditions_fail_when_they_run():
+    condition = cerona_main.compile_condition(["i", "bigger", "3"], 4, "if i bigger 3")
+    with pytest.raises(cerona_main.CeronaError, match="unknown operator 'bigger'"):
+        condition({"i": 1})
+    with pytest.raises(cerona_main.CeronaError, match="expected at least 3 tokens"):
+        cerona_main.compile_condition(["i", "less"])({})
+
+def test_while_condition_runs_on_every_iteration():
+    code = """
+    set i 0
+    set limit 5
+    while i less limit
+        set i i + 1
+    endwhile
+    print(i)
+    """
+    assert run_cerona(code) == "5"
+
+def test_compound_conditions():
+    code = """
+    set x 5
+    set y 10
+    set name "bob"
+    if x greater 1 and y less 20 then print "and"
+    if x greater 7 or y equals 10 then print "or"
+    if not x equals 5 then print "not"
+    if (x greater 7 or y equals 10) and not name equals "alice" then print "grouped"
+    if x greater 7 or (y equals 10 and name contains "o") then print "nested"
+    if not (x less 3 or y less 3)
+        print "negated group"
+    endif
+    set i 0
+    while i less 10 and not i equals 4
+        set i i + 1
+    endwhile
+    print i
+    """
+    assert run_cerona(code).split("\n") == ["and", "or", "grouped", "nested", "negated group", "4"]
+
+def test_compound_conditions_short_circuit():
+    # "name greater 2" would fail if it were ever evaluated
+    code = """
+    set name "bob"
+    if name equals "bob" or name greater 2 then print "or"
+    if name equals "al" and name greater 2 then print "and"
+    print "done"
+    """
+    assert run_cerona(code).split("\n") == ["or", "done"]
+
+def test_parse_condition_precedence():
+    tree = cerona_main.parse_condition(
+        ["a", "less", "1", "or", "not", "b", "less", "2", "and", "c", "less", "3"])
+    assert tree == ("or", (("compare", "a", "less", "1"),
+                           ("and", (("not", ("compare", "b", "less", "2")),
+                                    ("compare", "c", "less", "3")))))
+    line = "if (a less 1 or b less 2) and c less 3 then print 1"
+    tokens = cerona_main.parse_line(line, 1)[1:-3]
+    assert cerona_main.parse_condition(tokens, 1, line)[0] == "and"
+    # A quoted "and" is still just an operand
+    assert cerona_main.parse_condition(["w", "equals", "and"]) == ("compare", "w", "equals", "and")
+    with pytest.raises(cerona_main.CeronaError, match="ends too early"):
+        cerona_main.parse_condition(["a", "less", "1", "and"])
+
+# Frame stack tests
+COUNTDOWN = """
+func down n
+    if n greater 0
+        set m n - 1
+        call down m
+    endif
+endfunc
+set start {depth}
+call down start
+print "done"
+"""
+
+def test_deep_recursion_does_not_use_the_python_stack(engine):
+    if engine not in ("tree", "vm"):
+        pytest.skip(f"engine '{engine}' runs Cerona calls as Python calls")
+    assert run_cerona(COUNTDOWN.format(depth=20000)) == "done"
+
+def test_recursion_limit_is_configurable(engine, capsys):
+    with pytest.raises(SystemExit):
+        execute(COUNTDOWN.format(depth=50), recursion_limit=10)
+    assert "recursion limit exceeded (10 nested calls)" in capsys.readouterr().err
+
+def test_python_stack_overflow_is_reported(engine, capsys):
+    if engine in ("tree", "vm"):
+        pytest.skip(f"engine '{engine}' keeps its own call stack")
+    with pytest.raises(SystemExit):
+        execute(COUNTDOWN.format(depth=100000))
+    assert f"recursion too deep for the {engine} engine" in capsys.readouterr().err
+
+def test_deeply_nested_blocks(engine):
+    if engine != "tree":
+        pytest.skip(f"engine '{engine}' compiles nested blocks recursively")
+    code = "set n 1\n" + "if n equals 1\n" * 2000 + "print \"deep\"\n" + "endif\n" * 2000
+    assert run_cerona(code) == "deep"
+
+def test_inline_if_runs_calls_in_order():
+    code = """
+    func show x
+        print x
+    endfunc
+    set a 1
+    set b 2
+    if a equals 1 then call show a; call show b; print "after"
+    """
+    assert run_cerona(code).split("\n") == ["1", "2", "after"]
+
+# Return value and memo func tests
+def test_functions_return_values():
+    code = """
+    func add a b
+        return a + b
+    endfunc
+    func first_over limit
+        for i in 0 100
+            if i greater limit then return i
+        endfor
+        return "none"
+    endfunc
+    func nothing
+        print "side effect"
+    endfunc
+    set x 3
+    set y 4
+    set total call add x y
+    set big call first_over x
+    set empty call nothing
+    print total
+    print big
+    print empty
+    """
+    assert run_cerona(code).split("\n") == ["side effect", "7", "4", "None"]
+
+def test_methods_return_values():
+    code = """
+    class Counter
+        set count 1
+        func bump
+            set count count + 1
+            return count
+        endfunc
+    endclass
+    new Counter c
+    set seen call c.bump
+    print seen
+    """
+    assert run_cerona(code) == "2"
+
+def test_return_outside_function_is_an_error(capsys):
+    with pytest.raises(SystemExit):
+        execute('print "before"\nreturn 1\nprint "after"')
+    captured = capsys.readouterr()
+    assert captured.out == "before\n"
+    assert "error at line 2: return outside function" in captured.err
+
+def test_memo_func_caches_results():
+    code = """
+    memo func fib n
+        if n less 2
+            return n
+        endif
+        set a n - 1
+        set b n - 2
+        set fa call fib a
+        set fb call fib b
+        return fa + fb
+    endfunc
+    set n 80
+    set result call fib n
+    print result
+    memostats fib
+    """
+    assert run_cerona(code).split("\n") == [
+        "23416728348467685", "fib: 78 hits, 81 misses, 81/1024 cached"]
+
+def test_memo_cache_evicts_least_recently_used():
+    cache = cerona_main.MemoCache(maxsize=2)
+    for n in (1, 2):
+        cache.remember(cache.key([n]), n * 10)
+    assert cache.lookup(cache.key([1])) == 10
+    cache.remember(cache.key([3]), 30)
+    assert cache.lookup(cache.key([2])) is cerona_main.MISSING
+    assert cache.lookup(cache.key([1])) == 10
+    assert (cache.hits, cache.misses, len(cache)) == (2, 1, 2)
+    assert cache.key([[1, 2]]) is None
+
+# Buffered output tests
+class RecordingStream(io.StringIO):
+    """A stream that remembers each write as a separate chunk"""
+    def __init__(self, chunks):
+        super().__init__()
+        self.chunks = chunks
+
+    def write(self, text):
+        self.chunks.append(text)
+        return super().write(text)
+
+def test_print_output_is_written_in_batches(monkeypatch):
+    chunks = []
+    monkeypatch.setattr(sys, "stdout", RecordingStream(chunks))
+    execute('for i in 0 1000\n    print(i)\nendfor')
+    assert "".join(chunks) == "".join(f"{i}\n" for i in range(1000))
+    assert len(chunks) == 1
+
+def test_unbuffered_output_prints_each_line(monkeypatch):
+    chunks = []
+    monkeypatch.setattr(sys, "stdout", RecordingStream(chunks))
+    execute('for i in 0 3\n    print(i)\nendfor', unbuffered=True)
+    assert "".join(chunks) == "0\n1\n2\n"
+    assert len(chunks) == 6
+
+def test_output_is_flushed_before_input_and_errors(monkeypatch):
+    chunks = []
+    monkeypatch.setattr(sys, "stdout", RecordingStream(chunks))
+    monkeypatch.setattr(sys, "stderr", RecordingStream(chunks))
+    seen = []
+    monkeypatch.setattr("builtins.input", lambda prompt: seen.append("".join(chunks)) or "Ada")
+    with pytest.raises(SystemExit):
+        execute('print "before"\ninput name "? "\nprint name\nreturn 1')
+    assert seen == ["before\n"]
+    assert chunks[:2] == ["before\n", "Ada\n"]
+    assert "error at line 4: return outside function" in chunks[2]
+
+def test_output_buffer_limits():
+    stream = io.StringIO()
+    output = cerona_main.make_output(stream=stream)
+    output.max_lines = 2
+    output.line("a")
+    assert stream.getvalue() == ""
+    output.line("b")
+    assert stream.getvalue() == "a\nb\n"
+    output.max_chars = 3
+    output.line("long line")
+    assert stream.getvalue() == "a\nb\nlong line\n"
+
+# Embedding API tests
+def test_program_runs_many_times_with_fresh_state():
+    from cerona import Program
+    program = Program("""
+    func bump
+        set count count + 1
+        return count
+    endfunc
+    set total call bump
+    print total
+    """)
+    for start in (0, 10):
+        out = io.StringIO()
+        scope = program.run({"count": start}, stdout=out)
+        assert out.getvalue() == f"{start + 1}\n"
+        assert scope["total"] == start + 1
+    # Nothing is left over from earlier runs
+    assert "count" not in program.run(stdout=io.StringIO())
+
+def test_program_raises_instead_of_exiting(capsys):
+    from cerona import CeronaError, Program
+    program = Program('print "partial"\nreturn 1')
+    out = io.StringIO()
+    with pytest.raises(CeronaError, match="return outside function"):
+        program.run(stdout=out)
+    assert out.getvalue() == "partial\n"
+    with pytest.raises(CeronaError, match="missing 'endif'"):
+        Program("if x equals 1\n")
+    assert capsys.readouterr() == ("", "")
+
+def test_interpreter_keeps_programs_parsed(engine):
+    from cerona import Interpreter
+    out = io.StringIO()
+    interpreter = Interpreter(stdout=out, cache_size=2)
+    for n in range(3):
+        interpreter.run("print(n * 2)", {"n": n})
+    assert out.getvalue() == "0\n2\n4\n"
+    program = interpreter.compile("print(n * 2)")
+    assert program.engine == engine and len(interpreter.programs) == 1
+    interpreter.run("print(1)")
+    interpreter.run("print(2)")
+    assert interpreter.compile("print(n * 2)") is not program
+
+def test_concurrent_runs_keep_their_own_output_and_input():
+    from concurrent.futures import ThreadPoolExecutor
+    from cerona import Interpreter
+    code = """
+    input name "? "
+    func weigh n
+        return n * id
+    endfunc
+    set total 0
+    for i in 0 50
+        set w call weigh i
+        set total total + w
+    endfor
+    print name
+    print total
+    """
+    # Two interpreters that share one parsed program
+    first = Interpreter()
+    second = Interpreter(shared={(code, "<input>"): first.compile(code)})
+    def job(n):
+        interpreter = (first, second)[n % 2]
+        out = io.StringIO()
+        interpreter.run(code, {"id": n}, stdout=out, stdin=io.StringIO(f"job{n}\n"))
+        return out.getvalue()
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            outputs = list(pool.map(job, range(300)))
+    finally:
+        sys.setswitchinterval(interval)
+    assert outputs == [f"? job{n}\n{1225 * n}\n" for n in range(300)]
+    assert not second.programs
+
+# Batch runner tests
+def test_batch_runs_scripts_on_worker_processes(engine, tmp_path, capsys):
+    (tmp_path / "a.cerona").write_text('print "from a"\n')
+    (tmp_path / "b.cerona").write_text('print "from b"\nreturn 1\n')
+    (tmp_path / "c.cerona").write_text('set i 0\nwhile 1 equals 1\n    set i i + 1\nendwhile\n')
+    with pytest.raises(SystemExit) as exit_info:
+        cerona_main.main(["batch", str(tmp_path / "*.cerona"), "--engine", engine,
+                          "--workers", "2", "--timeout", "0.3"])
+    assert exit_info.value.code == 1
+    out, err = capsys.readouterr()
+    lines = out.split("\n")
+    assert lines[0].startswith(f"== {tmp_path / 'a.cerona'}: ok in ")
+    assert lines[1] == "from a"
+    assert lines[2].startswith(f"== {tmp_path / 'b.cerona'}: exit 1 in ")
+    assert lines[3] == "from b"
+    assert lines[4].startswith(f"== {tmp_path / 'c.cerona'}: timed out in ")
+    assert lines[5].startswith("3 scripts: 1 ok, 1 failed, 1 timed out in ")
+    assert "b.cerona:error at line 2: return outside function" in err
+    assert "c.cerona: error: timed out after 0.3s" in err
+
+# Daemon and client tests
+@pytest.fixture
+def cerona_server(monkeypatch):
+    import tempfile
+    import threading
+    from cerona import server
+    # Unix socket paths are limited to about 100 characters, too short for tmp_path
+    directory = tempfile.mkdtemp(prefix="cerona-")
+    path = f"{directory}/serve.sock"
+    monkeypatch.setenv("CERONA_SOCKET", path)
+    daemon = server.make_server(path)
+    thread = threading.Thread(target=server.serve_until_stopped, args=(daemon,))
+    thread.start()
+    yield daemon
+    daemon.shutdown()
+    thread.join()
+    os.rmdir(directory)
+
+def test_client_runs_scripts_through_the_daemon(engine, cerona_server, tmp_path, capsys, monkeypatch):
+    from cerona import client
+    script = tmp_path / "greet.cerona"
+    script.write_text('print "hello"\ninput name "name? "\nprint name\nreturn 1\n')
+    monkeypatch.setattr(sys, "stdin", io.StringIO("ada\n"))
+    with pytest.raises(SystemExit) as exit_info:
+        client.main([str(script), "--engine", engine])
+    assert exit_info.value.code == 1
+    out, err = capsys.readouterr()
+    assert out == "hello\nname? ada\n"
+    assert err.startswith(f"{script}:error at line 4: return outside function")
+    # The parsed program stays in the daemon for the next run
+    assert len(cerona_server.interpreter(engine, None).programs) == 1
+    with pytest.raises(SystemExit):
+        client.main([str(tmp_path / "missing.cerona"), "--engine", engine])
+    assert capsys.readouterr().err == f"{tmp_path / 'missing.cerona'}: error: file not found\n"
+
+def test_daemon_runs_in_the_client_directory(engine, cerona_server, tmp_path, capsys, monkeypatch):
+    from cerona import client
+    (tmp_path / "nums.txt").write_text("1 2 3")
+    script = tmp_path / "total.cerona"
+    script.write_text('array f file "nums.txt"\nsum f total\nprint total\n')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("CERONA_NO_CACHE", raising=False)
+    monkeypatch.setenv("CERONA_CACHE_DIR", "parsed")
+    client.main(["total.cerona", "--engine", engine])
+    assert capsys.readouterr().out == "6.0\n"
+    # The cache directory is the client's, relative to its working directory
+    assert len(os.listdir(tmp_path / "parsed")) == 1
+
+def test_daemon_socket_is_private(cerona_server, tmp_path, capsys, monkeypatch):
+    import stat
+    from cerona import client
+    path = cerona_server.server_address
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert client.owned_by_user(path)
+    # A socket someone else made is never connected to
+    monkeypatch.setattr(os, "getuid", lambda: os.stat(path).st_uid + 1)
+    script = tmp_path / "local.cerona"
+    script.write_text('print "local"\n')
+    client.main([str(script)])
+    out, err = capsys.readouterr()
+    assert out == "local\n"
+    assert err == f"cerona-client: warning: not using {path}, which belongs to another user\n"
+
+def test_client_runs_locally_without_a_daemon(tmp_path, capsys, monkeypatch):
+    from cerona import client
+    monkeypatch.setenv("CERONA_SOCKET", str(tmp_path / "nobody.sock"))
+    script = tmp_path / "local.cerona"
+    script.write_text('print "local"\n')
+    client.main([str(script)])
+    assert capsys.readouterr().out == "local\n"
+
+# Async run tests
+def test_run_async_shares_the_event_loop(engine):
+    import asyncio
+    from cerona import Program
+    program = Program("""
+    set i 0
+    while i less 2000
+        set i i + 1
+    endwhile
+    input name "name? "
+    print name
+    print i
+    """)
+    if engine != "tree":
+        with pytest.raises(ValueError, match="only the tree engine"):
+            asyncio.run(program.run_async())
+        return
+
+    async def main():
+        reader = asyncio.StreamReader()
+        ticks = []
+        async def ticker():
+            while True:
+                ticks.append(len(ticks))
+                await asyncio.sleep(0)
+        background = asyncio.create_task(ticker())
+        outputs = [io.StringIO(), io.StringIO()]
+        runs = [
+            asyncio.create_task(program.run_async(stdout=outputs[0], stdin=reader, slice_size=50)),
+            asyncio.create_task(program.run_async(stdout=outputs[1], stdin=io.StringIO("bo\n"), slice_size=50)),
+        ]
+        await asyncio.sleep(0.05)
+        # The first run is waiting for its line without holding up the loop
+        assert outputs[0].getvalue() == "name? "
+        reader.feed_data(b"ada\n")
+        scopes = await asyncio.gather(*runs)
+        background.cancel()
+        return ticks, outputs, scopes
+
+    ticks, outputs, scopes = asyncio.run(main())
+    assert len(ticks) > 2000 / 50
+    assert [out.getvalue() for out in outputs] == ["name? ada\n2000\n", "name? bo\n2000\n"]
+    assert scopes[0]["name"] == "ada"
+
+def test_run_async_input_in_an_inline_if_runs_once(engine):
+    import asyncio
+    from cerona import Program
+    if engine != "tree":
+        pytest.skip(f"engine '{engine}' cannot run in slices")
+    program = Program("""
+    set n 0
+    if 1 equals 1 then set n n + 1; print(n); input y "? "
+    print(y)
+    print(n)
+    """)
+
+    async def main():
+        reader = asyncio.StreamReader()
+        output = io.StringIO()
+        run = asyncio.create_task(program.run_async(stdout=output, stdin=reader, slice_size=5))
+        await asyncio.sleep(0.05)
+        reader.feed_data(b"ok\n")
+        return await run, output.getvalue()
+
+    scope, printed = asyncio.run(main())
+    # The condition and the commands before input do not run again with the line
+    assert scope["n"] == 1
+    assert printed.endswith("ok\n1\n")
+    assert printed.count("1\n") == 2
+
+def test_run_async_input_in_a_spawned_task(engine):
+    import asyncio
+    from cerona import Program
+    if engine != "tree":
+        pytest.skip(f"engine '{engine}' cannot run in slices")
+    program = Program("""
+    func ask
+        input name "name? "
+        return name
+    endfunc
+    spawn t call ask
+    join t
+    print t
+    """)
+
+    async def main():
+        reader = asyncio.StreamReader()
+        output = io.StringIO()
+        run = asyncio.create_task(program.run_async(stdout=output, stdin=reader, slice_size=50))
+        await asyncio.sleep(0.05)
+        assert output.getvalue() == "name? "
+        reader.feed_data(b"ada\n")
+        return await asyncio.wait_for(run, 5), output.getvalue()
+
+    scope, printed = asyncio.run(main())
+    assert scope["t"] == "ada"
+    assert printed == "name? ada\n"
+
+# Task and channel tests
+def test_spawned_tasks_share_channels(engine):
+    from cerona import Program
+    program = Program("""
+    func produce ch n
+        for i in 0 n
+            send ch i * 10
+        endfor
+        send ch "done"
+        return n
+    endfunc
+    func ask
+        input name
+        return name
+    endfunc
+    channel jobs 2
+    set n 4
+    spawn p call produce jobs n
+    spawn q call ask
+    set item 0
+    while item notequals "done"
+        recv jobs item
+        print item
+    endwhile
+    join p
+    join q
+    print p
+    print q
+    """)
+    out = io.StringIO()
+    scope = program.run(stdout=out, stdin=io.StringIO("ada\n"))
+    assert out.getvalue() == "0\n10\n20\n30\ndone\n4\nada\n"
+    assert scope["p"] == 4 and scope["q"] == "ada"
+
+def test_task_errors_and_deadlocks(engine):
+    from cerona import CeronaError, Program
+    failing = Program("""
+    func broken
+        call missing
+    endfunc
+    spawn t call broken
+    print "spawned"
+    """)
+    out = io.StringIO()
+    with pytest.raises(CeronaError, match="undefined function 'missing'"):
+        failing.run(stdout=out)
+    assert out.getvalue() == "spawned\n"
+    with pytest.raises(CeronaError, match="line 3: runtime error: deadlock"):
+        Program("channel c\nsend c 1\nsend c 2\n").run(stdout=io.StringIO())
+    with pytest.raises(CeronaError, match="'x' is not a task"):
+        Program("set x 1\njoin x\n").run(stdout=io.StringIO())
+
+# Parallel for tests
+def test_parallel_for_reduces_in_iteration_order(engine, monkeypatch):
+    from cerona import CeronaError, Program, parallel
+    monkeypatch.setattr(parallel, "PARALLEL_WORKERS", 3)
+    program = Program("""
+    func square x
+        return x * x
+    endfunc
+    set total 5
+    set n 20
+    parallel for i in 0 n with sum total max best collect odd
+        set total call square i
+        set best i * 3
+        set r i % 2
+        if r equals 1
+            set odd i
+            print i
+        endif
+    endfor
+    print total
+    """)
+    out = io.StringIO()
+    scope = program.run(stdout=out)
+    assert out.getvalue() == "1\n3\n5\n7\n9\n11\n13\n15\n17\n19\n2475\n"
+    assert scope["best"] == 57 and scope["odd"] == [1, 3, 5, 7, 9, 11, 13, 15, 17, 19]
+    assert "r" not in scope
+    failing = Program("parallel for i in 0 40\n    print i\n    if i equals 25 then memostats i\nendfor\n")
+    out = io.StringIO()
+    with pytest.raises(CeronaError, match="line 3: 'i' is not a memo func"):
+        failing.run(stdout=out)
+    assert out.getvalue() == "".join(f"{i}\n" for i in range(26))
+    with pytest.raises(CeronaError, match="unknown reduction 'avg'"):
+        Program("parallel for i in 0 3 with avg x\nendfor\n").run(stdout=io.StringIO())
+
+def test_parallel_for_sees_objects(engine, monkeypatch):
+    from cerona import Program, parallel
+    monkeypatch.setattr(parallel, "PARALLEL_WORKERS", 3)
+    scope = Program("""
+    class Scale
+        set factor 1
+        func init f
+            set factor f
+        endfunc
+        func apply x
+            return x * factor
+        endfunc
+    endclass
+    set f 5
+    new Scale s f
+    set total 0
+    parallel for i in 0 10 with sum total
+        set total call s.apply i
+    endfor
+    """).run()
+    assert scope["total"] == 225
+
+def test_parallel_for_chunks_get_the_filename(engine, monkeypatch):
+    from cerona import Program, parallel
+    monkeypatch.setattr(parallel, "PARALLEL_WORKERS", 1)
+    filenames = []
+    run_chunk = parallel.run_chunk
+
+    def recording(job):
+        filenames.append(job[1])
+        return run_chunk(job)
+    monkeypatch.setattr(parallel, "run_chunk", recording)
+    Program("parallel for i in 0 4 with sum n\n    set n i\nendfor\n", "jobs.cer").run()
+    assert filenames and set(filenames) == {"jobs.cer"}
+
+# List and map tests
+def test_lists_and_maps_change_in_place(engine):
+    output = run_cerona("""
+    list xs 1 2
+    push xs 3 * 10
+    put xs 0 5
+    pop xs last
+    len xs n
+    print last
+    print n
+    map ages
+    put ages "ada" 36
+    get ages "ada" a
+    has ages "bob" b
+    print a
+    print b
+    func fill items count
+        for i in 0 count
+            push items i
+        endfor
+    endfunc
+    call fill xs 3
+    del xs 1
+    set total 0
+    for x in xs
+        set total total + x
+    endfor
+    print xs
+    print total
+    """)
+    assert output.split("\n") == ["30", "2", "36", "False", "[5, 0, 1, 2]", "8"]
+
+def test_has_checks_list_indexes(engine):
+    output = run_cerona("""
+    list xs 5 6
+    has xs 0 first
+    has xs 1 second
+    has xs 5 value
+    has xs -2 back
+    print first
+    print second
+    print value
+    print back
+    """)
+    assert output.split("\n") == ["True", "True", "False", "True"]
+
+def test_collection_command_errors(engine, capsys):
+    with pytest.raises(SystemExit):
+        execute("list xs 1\nget xs 3 v\n")
+    assert "line 2: runtime error: index 3 is out of range for 'xs' (length 1)" in capsys.readouterr().err
+    with pytest.raises(SystemExit):
+        execute("map m\nget m k v\n")
+    assert "key 'k' not found in 'm'" in capsys.readouterr().err
+    with pytest.raises(SystemExit):
+        execute("set s 1\npush s 2\n")
+    assert "'s' is not a list" in capsys.readouterr().err
+    with pytest.raises(SystemExit):
+        execute("map m\nget m k\n")
+    assert "invalid get syntax (expected: get LIST_OR_MAP KEY VAR)" in capsys.readouterr().err
+
+# Array tests
+def test_array_arithmetic_is_element_wise(engine, tmp_path):
+    path = tmp_path / "numbers.txt"
+    path.write_text("0.5, 1.5\n2\n")
+    output = run_cerona(f"""
+    array a range 0 4
+    array b 1 2 3 4
+    array f file "{path}"
+    set c a * b + 1
+    sum c total
+    mean c average
+    max c top
+    len f n
+    set d 10 - c[1:3]
+    print c
+    print total
+    print average
+    print top
+    print n
+    print d
+    print d[0]
+    """)
+    assert output.split("\n") == ["[1.0, 3.0, 7.0, 13.0]", "24.0", "6.0", "13.0", "3", "[7.0, 3.0]",
+                                   "7.0"]
+
+def test_array_errors(engine, capsys):
+    with pytest.raises(SystemExit):
+        execute("array a 1 two\n")
+    assert "line 1: runtime error: array elements must be numbers, got 'two'" in capsys.readouterr().err
+    with pytest.raises(SystemExit):
+        execute("list xs 1 2\nsum xs total\n")
+    assert "line 2: runtime error: 'xs' is not an array" in capsys.readouterr().err
+
+# Text tests
+def test_append_builds_text(engine):
+    output = run_cerona("""
+    append report "start;"
+    for i in 0 3
+        append report i
+        append report ";"
+    endfor
+    len report size
+    print report
+    print size
+    if report contains "1;2"
+        print "found"
+    endif
+    set tail "end"
+    set copy report + tail
+    print copy
+    """)
+    assert output.split("\n") == ["start;0;1;2;", "12", "found", "start;0;1;2;end"]
+
+def test_text_commands(engine):
+    output = run_cerona("""
+    set line "a=1, b=22, c=333"
+    split line ", " pairs
+    concat pairs "|" joined
+    replace joined "=" ":" swapped
+    upper swapped loud
+    lower "MiXeD" quiet
+    find line "b=" at
+    find line "z" missing
+    split "  x  y " words
+    print pairs
+    print loud
+    print quiet
+    print at
+    print missing
+    print words
+    for pair in pairs
+        match "([a-z])=([0-9]+)" pair found
+        get found 2 digits
+        print digits
+    endfor
+    match "[0-9]{4}" line none
+    print none
+    """)
+    assert output.split("\n") == ["['a=1', 'b=22', 'c=333']", "A:1|B:22|C:333", "mixed", "5", "-1",
+                                   "['x', 'y']", "1", "22", "333", "[]"]
+
+def test_text_command_errors(engine, capsys):
+    with pytest.raises(SystemExit):
+        execute("match \"(\" \"text\" m\n")
+    assert "line 1: runtime error: invalid pattern '('" in capsys.readouterr().err
+    with pytest.raises(SystemExit):
+        execute("set n 5\nconcat n \",\" s\n")
+    assert "line 2: runtime error: 'n' is not a list" in capsys.readouterr().err
+    with pytest.raises(SystemExit):
+        execute("replace \"abc\" \"a\" s\n")
+    assert "invalid replace syntax (expected: replace TEXT OLD NEW VAR)" in capsys.readouterr().err
+
+def test_appended_text_is_a_value(engine):
+    output = run_cerona("""
+    append a "x"
+    set b a
+    map seen
+    put seen a 1
+    list xs
+    push xs a
+    append a "y"
+    append b "z"
+    set loud "a.upper()"
+    print a
+    print b
+    print seen
+    print xs
+    print loud
+    """)
+    assert output.split("\n") == ["xy", "xz", "{'x': 1}", "['x']", "XY"]
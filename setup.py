@@ -29,6 +29,7 @@ setup(
     entry_points={
         "console_scripts": [
             "cerona=cerona.main:main",
+            "cerona-client=cerona.client:main",
         ],
     },
     install_requires=[],